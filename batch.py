@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+"""Parameter sweeps.  A sweep cfg is an ordinary cfg in which any setting may list
+several values separated by commas, and which may have named sections besides
+[DEFAULT] (each inheriting [DEFAULT], as usual):
+
+    [DEFAULT]
+    key = CM, GM, DM
+    numMeasures = 16
+
+    [dense]
+    density = 0.75, 1.0
+
+    [meander]
+    algorithm = MAGaussMeander
+    meanderInKey = yes, no
+
+Every section (or [DEFAULT] alone, if there are none) expands to the Cartesian product
+of its values, one job per combination: 3 keys x 2 densities = 6 'dense' jobs and 6
+'meander' jobs above.  runBatch() composes the jobs in a pool of worker processes into
+<section>_<n>.ly files, and writes batch.json listing each job's settings and seed.
+Job n of a section is seeded with muse.spawnSeed(seed, section, n) unless it sets
+'seed' itself, so a batch is reproducible from its seed.  Each worker parses each
+distinct key, range, time signature and weight list once, and builds each key table
+once, however many jobs use them (see muse.Configuration.shareParsedValues()).
+
+    python3 batch.py <sweep.ini> <outputDirectory> [--seed=N] [--workers=N] [-m] [-j]"""
+
+import configparser, itertools, json, os, re, sys
+import composer, debug, muse
+
+def expandSweep(filename):
+    """Return the jobs of sweep cfg 'filename' as a list of (section, n, settings),
+    settings a dict of the setting names and their (single) values as text"""
+    parser = configparser.ConfigParser()
+    if len(parser.read(filename)) == 0:
+        raise muse.Error_FileNotFound("Cannot open file {}".format(filename))
+    names = {name.lower(): name for name in muse.Configuration._ConfigCalls}
+    jobs = []
+    for section in parser.sections() or ["DEFAULT"]:
+        axes = []
+        for option, text in parser[section].items():
+            name = names.get(option, None)
+            if name == None:
+                _dbg("{} [{}]: ignoring unknown setting {}", filename, section, option)
+                continue
+            values = [value.strip() for value in text.split(',')]
+            if '' in values:
+                raise muse.Error_InvalidConfig("{} [{}]: empty value in {} = {}".format(filename, section, name, text))
+            axes.append((name, values))
+        for n, combination in enumerate(itertools.product(*[values for name, values in axes])):
+            jobs.append((section, n, dict(zip([name for name, values in axes], combination))))
+    return jobs
+
+def _sharedSignature(settings):
+    """Sort key grouping jobs which share parsed values, so each worker's chunks
+    reuse them"""
+    return tuple(settings.get(name, '') for name in sorted(muse.Configuration._sharedNames))
+
+def _initWorker():
+    muse.Configuration.shareParsedValues()
+
+def _runJob(section, n, settings, outputFilename, formats):
+    """Compose one job into 'outputFilename' (and the other 'formats'); return the
+    files written.  Runs in a worker process for runBatch()."""
+    config = muse.Configuration.fromStrings(settings, "{}[{}]#{}".format(section, n, settings))
+    comp = composer.Composer(config, outputFilename)
+    if comp.numVoices > 1:
+        comp.composeVoices(parallel = False)            # Already in a worker
+    else:
+        comp.composeScore()
+    comp.writeAll()
+    files = [comp.outputFilename]
+    for ext in formats:
+        filename = comp.writeFormat(ext)
+        if filename != None:
+            files.append(filename)
+    return files
+
+def _runJobs(tasks):
+    return [_runJob(*task) for task in tasks]
+
+def runBatch(filename, directory, seed = None, workers = None, formats = ()):
+    """Compose every job of sweep cfg 'filename' into 'directory' with 'workers'
+    processes (default one per CPU; 1 composes in this process), also writing the
+    formats (file extensions, e.g. 'mid') in 'formats'.  Returns the list of job
+    records, which are also written to batch.json: section, n, settings, seed, files."""
+    jobs = expandSweep(filename)
+    if seed == None:
+        seed = muse.newSeed()
+    if workers == None:
+        workers = os.cpu_count() or 1
+    os.makedirs(directory, exist_ok = True)
+    tasks = []
+    for section, n, settings in jobs:
+        settings = dict(settings)
+        if muse._seedParser(settings.get('seed', None)) == None:
+            settings['seed'] = str(muse.spawnSeed(seed, section, n))
+        outputFilename = os.path.join(directory, "{}_{:04}.ly".format(re.sub(r'\W', '_', section), n))
+        tasks.append((section, n, settings, outputFilename, tuple(formats)))
+    # Jobs which share a key (and so on) go to the same worker, one after the other
+    order = sorted(range(len(tasks)), key = lambda i: (_sharedSignature(tasks[i][2]), i))
+    chunkSize = max(1, min(16, len(tasks)//(4*workers)))
+    chunks = [[tasks[i] for i in order[start:start + chunkSize]] for start in range(0, len(order), chunkSize)]
+    files = [None]*len(tasks)
+    pool = None
+    if workers > 1 and len(chunks) > 1:
+        import concurrent.futures
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(workers, initializer = _initWorker)
+        except (OSError, NotImplementedError) as e:
+            _dbg("No process pool ({}); composing jobs one at a time", e)
+    if pool != None:
+        with pool:
+            results = list(pool.map(_runJobs, chunks))
+    else:
+        shared = muse.Configuration._shared
+        muse.Configuration.shareParsedValues()
+        try:
+            results = [_runJobs(chunk) for chunk in chunks]
+        finally:
+            muse.Configuration._shared = shared
+    position = 0
+    for chunkFiles in results:
+        for jobFiles in chunkFiles:
+            files[order[position]] = jobFiles
+            position += 1
+    records = [{'section': section, 'n': n, 'settings': settings, 'seed': int(settings['seed']),
+                'files': [os.path.basename(name) for name in jobFiles]}
+               for (section, n, settings, outputFilename, formats), jobFiles in zip(tasks, files)]
+    with open(os.path.join(directory, "batch.json"), 'w') as fd:
+        json.dump({'sweep': filename, 'seed': seed, 'jobs': records}, fd, indent = 1)
+    return records
+
+_dbg = debug.getLogger("batch.py").dbg
+
+def _testBatch(argv):
+    USAGE = "python3 {} <sweep.ini> <outputDirectory> [--seed=N] [--workers=N] [-m] [-j]".format(argv[0])
+    import time, render
+    positional = [arg for arg in argv[1:] if not arg.startswith('-')]
+    if len(positional) < 2:
+        print(USAGE)
+        return
+    seed = None
+    workers = None
+    formats = []
+    for arg in argv[1:]:
+        if arg.startswith('--seed='):
+            seed = muse._seedParser(arg[len('--seed='):])
+        elif arg.startswith('--workers='):
+            workers = int(arg[len('--workers='):])
+    if '-m' in argv:
+        formats.append(render.MIDIRenderer.ext)
+    if '-j' in argv:
+        formats.append(render.JSONRenderer.ext)
+    start = time.perf_counter()
+    records = runBatch(positional[0], positional[1], seed, workers, formats)
+    print("{} jobs in {:.2f} s".format(len(records), time.perf_counter() - start))
+    for record in records[:8]:
+        print("{}[{}] {} -> {}".format(record['section'], record['n'], record['settings'], record['files']))
+
+if __name__ == "__main__":
+    argv = sys.argv
+    _testBatch(argv)
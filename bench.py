@@ -0,0 +1,517 @@
+#!/usr/bin/python3
+
+"""Micro-benchmarks for the hot paths of the composer.  Each _benchX(argv) function
+can be selected from the command line:
+
+    python3 bench.py <benchmark> [args...]
+
+Run without arguments for the list of benchmarks."""
+
+import time
+import pypond
+from orchestrator import Orchestrator
+
+def _timeit(func, repeat = 5, number = 1):
+    """Return the best wall time (seconds) of 'repeat' runs of 'number' calls to func()"""
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        for n in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best/number
+
+def _report(name, seconds, count, unit = "measure"):
+    print("{:<24}{:>10.3f} us/{}".format(name, 1e6*seconds/count, unit))
+
+def _sixtyFourthMeasure(restEvery = 4):
+    """A whole-note measure of 1/64 notes, every 'restEvery'th note a rest"""
+    measure = []
+    for n in range(64):
+        if restEvery and n % restEvery == restEvery - 1:
+            measure.append(pypond.Rest(1/64))
+        else:
+            measure.append(pypond.Note('C4' if n % 2 else 'Eb4', 1/64))
+    return Orchestrator._setBeatNums(measure)
+
+def _benchOrchestrator(argv):
+    USAGE = "python3 {} orchestrator [numMeasures] [restEvery]".format(argv[0])
+    numMeasures = 200
+    restEvery = 4
+    if len(argv) > 2:
+        numMeasures = int(argv[2])
+    if len(argv) > 3:
+        restEvery = int(argv[3])
+    measures = [_sixtyFourthMeasure(restEvery) for n in range(numMeasures)]
+    Orchestrator.getTable(1)            # Don't time building the table
+    def multiPass():
+        for measure in measures:
+            # The multi-pass algorithm consumes its input, so time the copy it needs too
+            Orchestrator.processMeasureMultiPass([note.clone() for note in measure], True, 1)
+    def fused():
+        for measure in measures:
+            Orchestrator.processMeasure(measure, True, measureDuration = 1)
+    print("{} measures of 1/64 notes, rest every {}".format(numMeasures, restEvery))
+    _report("multi-pass", _timeit(multiPass), numMeasures)
+    _report("fused", _timeit(fused), numMeasures)
+
+def _benchMeasureBuffer(argv):
+    USAGE = "python3 {} buffer [numMeasures]".format(argv[0])
+    import composer
+    numMeasures = 20000
+    if len(argv) > 2:
+        numMeasures = int(argv[2])
+    # Cycle through durations which straddle the barline now and then
+    durations = [1/16, 1/8, 3/16, 1/64, 1/4, 3/8, 1/32]
+    notes = [pypond.Note('C4', durations[n % len(durations)]) for n in range(997)]
+    def fill():
+        buf = composer.MeasureBuffer(1, 1/64)
+        count = 0
+        n = 0
+        while count < numMeasures:
+            note = notes[n]
+            n = (n + 1) % len(notes)
+            duration = note.getDuration()
+            response = buf.add(note)
+            while response:
+                buf.getMeasure()
+                count += 1
+                if response is True:
+                    break
+                response = buf.add(response)
+            note.setDuration(duration)      # Undo any barline split
+    print("{} 4/4 measures through a MeasureBuffer".format(numMeasures))
+    _report("fill + getMeasure", _timeit(fill, repeat = 3), numMeasures)
+
+def _benchFIFO(argv):
+    USAGE = "python3 {} fifo [batchSize] [numBatches]".format(argv[0])
+    import collections, fifo
+    batchSize = 64
+    numBatches = 2000
+    if len(argv) > 2:
+        batchSize = int(argv[2])
+    if len(argv) > 3:
+        numBatches = int(argv[3])
+    items = list(range(batchSize))
+    depth = batchSize + batchSize//3        # So batches wrap around the end of the ring
+    def fifoSingle():
+        buf = fifo.FIFO(depth)
+        for n in range(numBatches):
+            for item in items:
+                buf.add(item)
+            for item in items:
+                buf.get()
+    def fifoBulk():
+        buf = fifo.FIFO(depth)
+        for n in range(numBatches):
+            buf.extend(items)
+            buf.drain()
+    def fifoIter():
+        buf = fifo.FIFO(depth)
+        buf.extend(items)
+        for n in range(numBatches):
+            for item in buf:
+                pass
+    def dequeSingle():
+        buf = collections.deque(maxlen = depth)
+        for n in range(numBatches):
+            for item in items:
+                buf.append(item)
+            for item in items:
+                buf.popleft()
+    def dequeBulk():
+        # deque has no bulk pop: list() then clear() is the closest equivalent
+        buf = collections.deque(maxlen = depth)
+        for n in range(numBatches):
+            buf.extend(items)
+            list(buf)
+            buf.clear()
+    def dequeIter():
+        buf = collections.deque(items, maxlen = depth)
+        for n in range(numBatches):
+            for item in buf:
+                pass
+    print("{} batches of {} items, depth {}".format(numBatches, batchSize, depth))
+    for name, func in (("FIFO add/get", fifoSingle), ("FIFO extend/drain", fifoBulk),
+                       ("FIFO iterate", fifoIter), ("deque append/popleft", dequeSingle),
+                       ("deque extend/list/clear", dequeBulk), ("deque iterate", dequeIter)):
+        _report(name, _timeit(func, repeat = 3), numBatches*batchSize, "item")
+
+def _benchMARandom(argv):
+    USAGE = "python3 {} marandom [numNotes] [cfgFile]".format(argv[0])
+    import muse
+    numNotes = 100000
+    cfgFile = "cfg.ini"
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    if len(argv) > 3:
+        cfgFile = argv[3]
+    config = muse.Configuration(cfgFile)
+    numpy = muse.numpy
+    def notesPerSecond(blockSize, withNumpy = True):
+        algorithm = muse.MARandom()
+        algorithm.setConfig(config)
+        algorithm.blockSize = blockSize
+        muse.numpy = numpy if withNumpy else None
+        def run():
+            for n in range(numNotes):
+                algorithm.getNextNote()
+        seconds = _timeit(run, repeat = 3)
+        muse.numpy = numpy
+        return numNotes/seconds
+    print("{} MARandom notes ({})".format(numNotes, cfgFile))
+    for name, blockSize, withNumpy in (("one at a time", 1, False), ("blocks, numpy", 4096, True)):
+        if withNumpy and numpy == None:
+            print("{:<24}{:>10}".format(name, "no numpy"))
+            continue
+        print("{:<24}{:>10.0f} notes/s".format(name, notesPerSecond(blockSize, withNumpy)))
+
+def _benchMeander(argv):
+    USAGE = "python3 {} meander [numNotes]".format(argv[0])
+    import muse
+    numNotes = 100000
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    config = muse.Configuration('*')
+    print("{} MAGaussMeander notes".format(numNotes))
+    for name, blockSize, inKey in (("one at a time", 1, False), ("blocks, numpy", 4096, False),
+                                   ("blocks, in key", 4096, True)):
+        if blockSize > 1 and muse.numpy == None:
+            print("{:<24}{:>10}".format(name, "no numpy"))
+            continue
+        algorithm = muse.MAGaussMeander()
+        algorithm.setConfig(config)
+        algorithm.blockSize = blockSize
+        algorithm.inKey = inKey
+        def run():
+            for n in range(numNotes):
+                algorithm.getNextNote()
+        _report(name, _timeit(run, repeat = 3), numNotes, "note")
+
+def _benchConstraint(argv):
+    USAGE = "python3 {} constraint [numMeasures]".format(argv[0])
+    import constraint, muse
+    numMeasures = 1000
+    if len(argv) > 2:
+        numMeasures = int(argv[2])
+    config = muse.Configuration('*')
+    total = numMeasures*config.getMeasureDuration()
+    algorithm = constraint.MAConstraint()
+    algorithm.setConfig(config)
+    def run():
+        algorithm.plantSeed(1)
+        duration = 0
+        while duration < total:
+            duration += algorithm.getNextNote().getDuration()
+    print("{} measures of MAConstraint (maxLeap {}, maxRepeats {}, tonic every {} measures)".format(
+          numMeasures, config.get('maxLeap'), config.get('maxRepeats'), config.get('phraseMeasures')))
+    _report("search", _timeit(run, repeat = 3), numMeasures)
+
+def _benchGrammar(argv):
+    USAGE = "python3 {} grammar [numNotes] [depth]".format(argv[0])
+    import itertools, random, grammar
+    numNotes = 200000
+    depth = 10
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    if len(argv) > 3:
+        depth = int(argv[3])
+    # A deterministic motif tree 2**depth notes deep, between random choices
+    rules = ["S -> [3] T0 S | T0+2 S | 0:1/4 S"]
+    rules += ["T{} -> T{} T{}+{}".format(n, n + 1, n + 1, n % 3 + 1) for n in range(depth)]
+    rules.append("T{} -> 0:1/16".format(depth))
+    text = "\n".join(rules)
+    print("{} grammar notes, motifs of {} notes".format(numNotes, 2**depth))
+    for name, memoLimit in (("no memo", 0), ("memoized", grammar.Grammar.memoLimit)):
+        def run():
+            rulesGrammar = grammar.Grammar(text)
+            rulesGrammar.memoLimit = memoLimit
+            for item in itertools.islice(rulesGrammar.expand(rng = random.Random(1)), numNotes):
+                pass
+        _report(name, _timeit(run, repeat = 3), numNotes, "note")
+
+def _benchSampler(argv):
+    USAGE = "python3 {} sampler [numDraws]".format(argv[0])
+    import random, muse
+    numDraws = 100000
+    if len(argv) > 2:
+        numDraws = int(argv[2])
+    rng = random.Random(1)
+    print("{} weighted draws by number of items".format(numDraws))
+    for size in (8, 128, 4096):
+        weights = [rng.random() for n in range(size)]
+        sampler = muse.WeightedSampler(weights)
+        def linear():
+            # The hand-rolled scan this replaces
+            total = sum(weights)
+            for n in range(numDraws):
+                r = rng.random()*total
+                for index, w in enumerate(weights):
+                    r -= w
+                    if r < 0:
+                        break
+        def choices():
+            random.choices(range(size), weights, k = numDraws)
+        def alias():
+            for n in range(numDraws):
+                sampler.sample(rng = rng)
+        def aliasBatch():
+            sampler.sample(numDraws, rng)
+        for name, func in (("linear scan", linear), ("random.choices", choices),
+                           ("alias", alias), ("alias batch", aliasBatch)):
+            if func is linear and size > 128:
+                continue
+            _report("{} ({})".format(name, size), _timeit(func, repeat = 3), numDraws, "draw")
+
+def _benchMarkov(argv):
+    USAGE = "python3 {} markov [numNotes]".format(argv[0])
+    import markov, muse
+    numNotes = 50000
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    config = muse.Configuration('*')
+    print("{} MAMarkov notes by model size".format(numNotes))
+    for numDegrees, numDurations in ((7, 3), (70, 10), (700, 30)):
+        durations = [(1/64*(n + 1), n + 1) for n in range(numDurations)]
+        model = markov.MarkovModel.stepwise(numDegrees, durations)
+        algorithm = markov.MAMarkov()
+        algorithm.setConfig(config)
+        algorithm.model = model
+        algorithm.plantSeed(1)
+        model.getTables()                   # Don't time building the tables
+        def run():
+            for n in range(numNotes):
+                algorithm.getNextNote()
+        name = "{} states".format(len(model.getStates()))
+        _report(name, _timeit(run, repeat = 3), numNotes, "note")
+
+def _benchNgram(argv):
+    USAGE = "python3 {} ngram [numStates] [numNotes]".format(argv[0])
+    import os, pickle, random, tempfile, muse, ngram
+    numStates = 2000
+    numNotes = 50000
+    if len(argv) > 2:
+        numStates = int(argv[2])
+    if len(argv) > 3:
+        numNotes = int(argv[3])
+    # An order-2 model of a long random walk over numStates (interval, ticks) states
+    rng = random.Random(1)
+    states = [(rng.randint(-12, 12), 16*rng.randint(1, numStates//25 + 1)) for n in range(200*numStates)]
+    trainer = ngram.NgramTrainer(2)
+    trainer.train(states)
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'model.ngm')
+    pickled = os.path.join(directory, 'model.pickle')
+    trainer.save(filename)
+    with open(pickled, 'wb') as fd:
+        pickle.dump((trainer.states, trainer.counts), fd)
+    print("{} contexts, {} transitions ({} KB mapped, {} KB pickled)".format(
+          len(trainer.counts), sum(len(nexts) for nexts in trainer.counts.values()),
+          os.path.getsize(filename)//1024, os.path.getsize(pickled)//1024))
+    def openMapped():
+        ngram.NgramModel(filename).close()
+    def openPickled():
+        with open(pickled, 'rb') as fd:
+            pickle.load(fd)
+    _report("open, mapped", _timeit(openMapped), 1, "load")
+    _report("open, unpickled dicts", _timeit(openPickled), 1, "load")
+    config = muse.Configuration('*')
+    config.config['ngramModel'] = filename
+    algorithm = ngram.MANgram()
+    algorithm.setConfig(config)
+    algorithm.plantSeed(1)
+    def run():
+        for n in range(numNotes):
+            algorithm.getNextNote()
+    _report("MANgram", _timeit(run, repeat = 3), numNotes, "note")
+    os.remove(filename)
+    os.remove(pickled)
+    os.rmdir(directory)
+
+def _benchCompose(argv):
+    USAGE = "python3 {} compose [numMeasures]".format(argv[0])
+    import composer, muse
+    numMeasures = 500
+    if len(argv) > 2:
+        numMeasures = int(argv[2])
+    print("{} measures of 1/16 and 1/8 notes composed a note at a time and in batches".format(numMeasures))
+    for name, algorithm in (("MARandom", muse.MARandom()), ("MAGaussMeander", muse.MAGaussMeander())):
+        comp = composer.Composer('*', 'bench.ly')
+        comp.numMeasures = numMeasures
+        algorithm.setConfig(comp.config)
+        algorithm.durationWeights = muse.WeightedSampler.fromString("1/16:1 1/8:1")
+        comp.algorithm = algorithm
+        def run(step):
+            algorithm.plantSeed(1)
+            comp.newScore()
+            comp.finished = False
+            comp.measureCount = 0
+            comp.beatCount = 0
+            comp.initBuffer(comp.measureDuration, comp.precision)
+            while not comp.finished:
+                step()
+        _report("{}, compose()".format(name), _timeit(lambda: run(comp.compose), repeat = 3), numMeasures)
+        _report("{}, composeBatch()".format(name), _timeit(lambda: run(comp.composeBatch), repeat = 3),
+                numMeasures)
+
+def _benchDataset(argv):
+    USAGE = "python3 {} dataset [numPieces]".format(argv[0])
+    import os, random, shutil, tempfile, composer, dataset, ngram, render
+    numPieces = 200
+    if len(argv) > 2:
+        numPieces = int(argv[2])
+    directory = tempfile.mkdtemp()
+    print("{} pieces of 8 measures ({} CPUs)".format(numPieces, os.cpu_count()))
+    for workers in sorted({1, os.cpu_count() or 1}):
+        def export():
+            dataset.exportDataset(os.path.join(directory, 'ds'), numPieces, '*', 1, workers)
+        _report("export, {} workers".format(workers), _timeit(export, repeat = 3), numPieces, "piece")
+    # Reading a piece back: sliced from the mapped arrays, or parsed from Lilypond text
+    data = dataset.Dataset(os.path.join(directory, 'ds'))
+    comp = composer.Composer('*', os.path.join(directory, 'unused.ly'))
+    comp.setSeed(data.getSeed(0))
+    text = ''.join(render.LilyRenderer(comp.composeScore()).stream())
+    order = list(range(numPieces))
+    random.Random(1).shuffle(order)
+    def sliced():
+        for k in order:
+            data.getPiece(k)['pitch'].tolist()
+    def parsed():
+        for k in order:
+            ngram.parseLily(text)
+    _report("read, mapped arrays", _timeit(sliced), numPieces, "piece")
+    _report("read, parse .ly", _timeit(parsed), numPieces, "piece")
+    data.close()
+    shutil.rmtree(directory)
+
+def _benchConfig(argv):
+    USAGE = "python3 {} config [cfgFile]".format(argv[0])
+    import os, shutil, tempfile, muse
+    cfgFile = "cfg.ini"
+    if len(argv) > 2:
+        cfgFile = argv[2]
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, os.path.basename(cfgFile))
+    shutil.copy(cfgFile, filename)
+    def load(snapshots):
+        muse.Configuration.snapshots = snapshots
+        def run():
+            muse.Configuration(filename)
+        return run
+    print("Configuration({})".format(cfgFile))
+    _report("parsed", _timeit(load(False), repeat = 3, number = 200), 1, "load")
+    muse.Configuration(filename)                    # Write the snapshot
+    _report("snapshot", _timeit(load(True), repeat = 3, number = 200), 1, "load")
+    muse.Configuration.snapshots = True
+    shutil.rmtree(directory)
+
+def _benchSweep(argv):
+    USAGE = "python3 {} sweep [numJobs]".format(argv[0])
+    import muse
+    numJobs = 300
+    if len(argv) > 2:
+        numJobs = int(argv[2])
+    # A grid of 3 keys x numJobs/3 densities, as batch.expandSweep() would make it
+    jobs = [{'key': key, 'noteLowest': 'Bb3', 'density': str(0.5 + n/(2*numJobs))}
+            for key in ('CM', 'GM', 'EbM') for n in range(numJobs//3)]
+    def configure(share):
+        def run():
+            muse.Configuration.shareParsedValues(False)
+            muse.Configuration.shareParsedValues(share)
+            for settings in jobs:
+                muse.Configuration.fromStrings(settings)
+            muse.Configuration.shareParsedValues(False)
+        return run
+    print("Configurations for {} jobs in 3 keys".format(len(jobs)))
+    _report("parsed per job", _timeit(configure(False), repeat = 3), len(jobs), "job")
+    _report("shared per key", _timeit(configure(True), repeat = 3), len(jobs), "job")
+
+# Cold-start budget (ms, cumulative import time of the module, bytecode cached) of the
+# command-line entry points
+_STARTUPBUDGET = {
+    'composer'      : 40,
+    'batch'         : 50,
+    'dataset'       : 40,
+}
+
+def _parseImportTime(text):
+    """Parse the stderr of 'python -X importtime' into a list of (module, self us,
+    cumulative us, depth), in import order"""
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue                            # The column header
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()))//2
+        modules.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return modules
+
+def _benchStartup(argv):
+    USAGE = "python3 {} startup [module] [budgetMs]".format(argv[0])
+    import os, shutil, subprocess, sys, tempfile
+    names = sorted(_STARTUPBUDGET)
+    if len(argv) > 2:
+        names = [argv[2]]
+    here = os.path.dirname(os.path.abspath(__file__))
+    pycache = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)    # Time a CLI run with its bytecode cached
+    env['PYTHONPATH'] = os.pathsep.join([here] + [p for p in [env.get('PYTHONPATH', None)] if p])
+    def importTime(name):
+        command = [sys.executable, '-X', 'importtime', '-X', 'pycache_prefix=' + pycache,
+                   '-c', "import " + name]
+        result = subprocess.run(command, env = env, cwd = pycache, capture_output = True, text = True)
+        if result.returncode != 0:
+            raise RuntimeError("import {} failed:\n{}".format(name, result.stderr))
+        return _parseImportTime(result.stderr)
+    overBudget = []
+    for name in names:
+        importTime(name)                        # Fill the bytecode cache
+        runs = [importTime(name) for n in range(5)]
+        modules = min(runs, key = lambda modules: sum(m[1] for m in modules))
+        total = sum(m[1] for m in modules)
+        top = [m for m in modules if m[0] == name][0]
+        budget = _STARTUPBUDGET.get(name, None)
+        if len(argv) > 3:
+            budget = float(argv[3])
+        print("import {}: {:.1f} ms ({:.1f} ms with the interpreter's own), budget {} ms".format(
+              name, top[2]/1000, total/1000, budget))
+        for module, own, cumulative, depth in sorted(modules, key = lambda m: -m[1])[:12]:
+            print("  {:<32}{:>8.1f} ms self{:>8.1f} ms cumulative".format(module, own/1000, cumulative/1000))
+        if budget != None and top[2]/1000 > budget:
+            overBudget.append(name)
+    shutil.rmtree(pycache)
+    if len(overBudget) > 0:
+        print("Over the start-up budget: {}".format(', '.join(overBudget)))
+        sys.exit(1)
+
+_Benchmarks = {
+    'orchestrator'  : _benchOrchestrator,
+    'buffer'        : _benchMeasureBuffer,
+    'fifo'          : _benchFIFO,
+    'marandom'      : _benchMARandom,
+    'meander'       : _benchMeander,
+    'markov'        : _benchMarkov,
+    'sampler'       : _benchSampler,
+    'constraint'    : _benchConstraint,
+    'grammar'       : _benchGrammar,
+    'ngram'         : _benchNgram,
+    'compose'       : _benchCompose,
+    'dataset'       : _benchDataset,
+    'config'        : _benchConfig,
+    'sweep'         : _benchSweep,
+    'startup'       : _benchStartup,
+}
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    if len(argv) > 1 and argv[1] in _Benchmarks:
+        _Benchmarks[argv[1]](argv)
+    else:
+        print("python3 {} <{}> [args...]".format(argv[0], '|'.join(_Benchmarks)))
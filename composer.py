@@ -2,13 +2,15 @@
 
 """A python script to generate GNU lilypad sheet music from muse.py and pypond.py"""
 
-import os, subprocess
-import muse, pypond, theory, fifo, diagnostics
+import os, threading
+import muse, pypond, fifo, rhythm, score, debug, timing
+from orchestrator import Orchestrator
 import time
+# Imported where they are used, off the start-up path: render (its formats),
+# subprocess (Lilypond), concurrent.futures (parallel voices)
 
-DEBUG = False
-LOGFILE = None
 FILENAME = "composer.py"
+_LOGFILE = "dbg.log"
 
 # Change the below to match the install path of GNU Lilypond on your system
 _LILYPATH = "\"C:/Program Files (x86)/LilyPond/usr/bin\""
@@ -16,17 +18,25 @@ _LILYPATH = "\"C:/Program Files (x86)/LilyPond/usr/bin\""
 _LILYEXEC = "lilypond.exe"
 
 class Composer():
-    headerString = pypond.LilySyntax.headerString
-    footerString = pypond.LilySyntax.footerString
     _defaultConfigFile = "cfg.ini"
     _defaultOutputFile = "test.ly"
     _lilyExt = "ly"
+    maxBatch = 256              # Most notes asked of the algorithm at once; see composeBatch()
     def __init__(self, configFilename, outputFilename):
+        """'configFilename' may also be a muse.Configuration, which is cloned (so
+        the composer has its own algorithm) rather than read from a file"""
         if configFilename == None:
             self.configFilename = self._defaultConfigFile
         else:
             self.configFilename = configFilename
-        self.config = muse.Configuration(self.configFilename)
+        if timing.enabled:
+            start = timing.now()
+        if isinstance(self.configFilename, muse.Configuration):
+            self.config = self.configFilename.clone()
+        else:
+            self.config = muse.Configuration(self.configFilename)
+        if timing.enabled:
+            timing.addTime('config', start)
         if outputFilename == None:
             self.outputFilename = self.generateOutputFilename()
         else:
@@ -37,19 +47,29 @@ class Composer():
         self.algorithm = self.config.get('algorithm')
         self.algorithm.setConfig(self.config)
         self.numMeasures = self.config.get('numMeasures')
+        self.numVoices = self.config.get('voices', 1)
+        self.seed = self.config.get('seed', None)
+        if self.seed == None:
+            self.seed = muse.newSeed()      # Fresh each run, but recorded in the Score
+        self.log = _log.bind(output = os.path.basename(self.outputFilename), seed = self.seed)
         self.measureCount = 0
         self.beatCount = 0
         self.measureDuration = self.config.getMeasureDuration()
         self.homeKey = self.config.get('key', None)         # The key signature of the sheet music
         #print("self.measureDuration = {}".format(self.measureDuration))
         self.precision = self.config.get('shortestNote', 1/64)
+        self.resolution = self.algorithm.getResolution()      # On whose grid the algorithm plays
         self.initBuffer(self.measureDuration, self.precision)
         self.finished = False       # Terminates the composition process
+        self.batchSize = 8          # Notes per composeBatch(), adjusted to about a measure's worth
+        self.score = None           # The score.Score intermediate representation
+        self._pool = None           # composeVoices()' worker processes; see close()
 
     def initBuffer(self, measureDuration, precision = 1/64):
         """Initialize the MeasureBuffer with a measure duration and minimum note
-        duration that will need to be contained in the buffer."""
-        self._buffer = MeasureBuffer(measureDuration, precision)
+        duration that will need to be contained in the buffer, counting at
+        self.resolution."""
+        self._buffer = MeasureBuffer(measureDuration, precision, self.resolution)
 
     def inspectBuffer(self, index):
         return self._buffer.inspectBuffer(index)
@@ -85,50 +105,272 @@ class Composer():
     def getNextNoteLilyOLD(self):
         return self.algorithm.getNextNoteLily()
 
+    def newScore(self):
+        """Start a new, empty score.Score with the clef, key and time signature
+        of the configuration."""
+        self.score = score.Score.fromConfig(self.config, self.resolution)
+        self.score.setSeed(self.seed)
+        self._lastKey = getattr(self.algorithm, 'key', None)
+        return self.score
+
     def compose(self):
-        """Returns a formatted measure string (in GNU Lilypond format) after each measure
-        is completed.  Returns None if we're mid-measure (no new measure is ready).
+        """Pulls the next note from the algorithm and adds it to the measure buffer.
+        Returns a list of the score.Measures completed by that note (these are also
+        appended to self.score), or None if we're mid-measure (no new measure is ready).
         Sets self.finished = True when we reach the measure count."""
         #print("- - - - compose - - - -")
+        if self.score == None:
+            self.newScore()
         # Get the next note from the algorithm
+        if timing.enabled:
+            start = timing.now()
         note = self.algorithm.getNextNote()
+        if timing.enabled:
+            start = timing.addTime('compose/algorithm', start)
+            timing.count('notes')
+        measures = self.composeNote(note, getattr(self.algorithm, 'key', None))
+        if timing.enabled:
+            timing.addTime('compose/buffer', start)
+        return measures
+
+    def composeBatch(self):
+        """Pull about a measure's worth of notes from the algorithm at once (see
+        MelodyAlgorithm.getNextNotes()) and add them to the measure buffer, stopping at
+        the last measure.  Returns a list of the score.Measures completed (possibly
+        empty).  The same notes are composed as by calling compose() repeatedly; any
+        drawn after the last measure is finished are dropped."""
+        if self.score == None:
+            self.newScore()
+        keys = []
+        if timing.enabled:
+            start = timing.now()
+        notes = self.algorithm.getNextNotes(self.batchSize, keys)
+        if timing.enabled:
+            start = timing.addTime('compose/algorithm', start)
+            timing.count('notes', len(notes))
+        measures = []
+        duration = 0
+        addNoteToBuffer = self.addNoteToBuffer
+        for note, key in zip(notes, keys):
+            noteDuration = note.getDuration()           # Before the buffer splits it
+            duration += noteDuration
+            # composeNote(), inlined for the common case of no key change
+            if key is not self._lastKey:
+                completed = self.composeNote(note, key)
+                if completed:
+                    measures.extend(completed)
+            else:
+                note.setBeatNum(self.beatCount)
+                self.beatCount += noteDuration
+                response = addNoteToBuffer(note)
+                if response:
+                    measures.extend(self._closeMeasures(response))
+            if self.finished:
+                break
+        if timing.enabled:
+            timing.addTime('compose/buffer', start)
+        if duration > 0:
+            batchSize = int(round(len(notes)*self.measureDuration/duration))
+            self.batchSize = min(max(batchSize, 1), self.maxBatch)
+        return measures
+
+    def composeNote(self, note, key = None):
+        """Add 'note', chosen by the algorithm while in key 'key', to the measure buffer.
+        Returns as compose()."""
+        if self.score == None:
+            self.newScore()
         # Associate the beat number with the note
         note.setBeatNum(self.beatCount)
+        # Record any key change the algorithm made while choosing the note
+        if key is not self._lastKey:
+            self.score.addKeyChange(self.measureCount, self.beatCount, key)
+            self._lastKey = key
         # Increment the beat number
         self.beatCount += note.getDuration()
         # Add to the measure buffer
-        again = True
-        measureStrings = [] 
-        while again:
-            again = False
-            response = self.addNoteToBuffer(note)
-            #print("        response = {}".format(response))
-            if response:    # Measure is ready for orchestration
-                tieLastNote = False
-                self.beatCount = 0                      # Reset the beat number
-                measure, isfull = self.getMeasureFromBuffer()
-                if not isfull:
-                    _dbg("WARNING: Measure number {} is not full!".format(self.measureCount))
-                self.measureCount += 1
-                if self.measureCount == self.numMeasures:   # If we've made our last measure, let's exit
-                    self.finished = True
-                elif hasattr(response, 'getDuration'):  # If there was a remainder note
-                    tieLastNote = True
-                    #self.addNoteToBuffer(response)      # Add it to the buffer
-                    note = response                     # Register the response to be the new note for the next round
-                    self.beatCount += response.getDuration()    # Add the remainder duration to the beat number
-                    again = True
-                #print(diagnostics.prettyMeasure(measure, self.measureDuration))
-                measureStrings.append(self.processMeasure(measure, tieLastNote))
-        if len(measureStrings) == 0:
+        measures = self._closeMeasures(self.addNoteToBuffer(note))
+        if len(measures) == 0:
             return None
-        return ' '.join(measureStrings)
+        return measures
+
+    def _closeMeasures(self, response):
+        """Given the measure buffer's response to adding a note, move each measure it
+        completed into the score, carrying any remainder note over into the next measure.
+        Returns the list of score.Measures added (empty if the measure isn't full yet)."""
+        measures = []
+        while response:     # Measure is ready for orchestration
+            tieLastNote = False
+            self.beatCount = 0                      # Reset the beat number
+            measure, isfull = self.getMeasureFromBuffer()
+            if not isfull:
+                self.log.warning("Measure number {} is not full!", self.measureCount)
+            self.measureCount += 1
+            note = None
+            if self.measureCount == self.numMeasures:   # If we've made our last measure, let's exit
+                self.finished = True
+            elif hasattr(response, 'getDuration'):  # If there was a remainder note
+                tieLastNote = True
+                note = response                     # Register the response to be the new note for the next round
+                note.setBeatNum(0)                  # The remainder starts the next measure
+                self.beatCount += response.getDuration()    # Add the remainder duration to the beat number
+            #print(diagnostics.prettyMeasure(measure, self.measureDuration))
+            self.log.dbg("measure #{}", self.measureCount)
+            measures.append(self.score.addMeasure(measure, tieLastNote))
+            if note == None:
+                break
+            response = self.addNoteToBuffer(note)
+        if timing.enabled:
+            timing.count('measures', len(measures))
+        return measures
+
+    def getSeed(self):
+        return self.seed
+
+    def setSeed(self, seed):
+        """Set the seed of the next composition: the same configuration and seed
+        always compose the same piece"""
+        self.seed = seed
+        self.log = _log.bind(output = os.path.basename(self.outputFilename), seed = seed)
+
+    def composeScore(self):
+        """Compose the whole piece (self.numMeasures measures of self.numVoices voices)
+        into a new score.Score and return it.  The score is kept in self.score for
+        rendering."""
+        if timing.enabled:
+            start = timing.now()
+        if self.numVoices > 1:
+            self.composeVoices()
+        else:
+            self.algorithm.plantSeed(self.seed)
+            self.composeVoice()
+        if timing.enabled:
+            timing.addTime('compose', start)
+        return self.score
+
+    def composeVoice(self):
+        """Compose a single voice of self.numMeasures measures into a new score.Score
+        and return it."""
+        self.newScore()
+        self.finished = False
+        self.measureCount = 0
+        self.beatCount = 0
+        while not self.finished:
+            self.composeBatch()
+        return self.score
+
+    def composeVoices(self, numVoices = None, parallel = True, pool = None):
+        """Compose 'numVoices' (default self.numVoices) voices into one score.Score.
+        Every voice has its own algorithm instance and MeasureBuffer, so ties over
+        barlines are handled per voice, and the same number of measures of the same
+        time signature, so the barlines line up.
+        If 'parallel', the other voices are composed by 'pool' (a
+        concurrent.futures.Executor) while this process composes the first; by default
+        in worker processes which the Composer keeps for its next pieces (see close()).
+        They compose from a copy of self.config, as it is in memory.  Voice n is seeded
+        with muse.spawnSeed(self.seed, n), so the piece is the same whether or not the
+        voices run in parallel."""
+        if numVoices == None:
+            numVoices = self.numVoices
+        seeds = [muse.spawnSeed(self.seed, n) for n in range(numVoices)]
+        self.algorithm.plantSeed(seeds[0])      # Back in the configured key before copying it
+        config = self.config.clone()            # Not changed by voice 0's key changes
+        jobs = [(config, self.numMeasures, seed) for seed in seeds[1:]]
+        voices = None
+        if parallel and len(jobs) > 0:
+            if pool == None:
+                pool = self._getPool(len(jobs))
+            if pool != None:
+                futures = [pool.submit(_composeVoice, *job) for job in jobs]
+                self.composeVoice()
+                voices = [future.result() for future in futures]
+        if voices == None:
+            self.composeVoice()
+            voices = [_composeVoice(*job) for job in jobs]
+        for voice in voices:
+            self.score.addVoice(voice.getMeasures(), voice.getKeyChanges())
+        return self.score
+
+    def _getPool(self, numWorkers):
+        """Return the Composer's process pool for composeVoices(), starting it (with
+        'numWorkers' workers) the first time, or None if there are no processes"""
+        if self._pool == None:
+            import concurrent.futures
+            try:
+                self._pool = concurrent.futures.ProcessPoolExecutor(numWorkers)
+            except (OSError, NotImplementedError) as e:
+                self.log.dbg("No process pool ({}); composing voices one at a time", e)
+        return self._pool
+
+    def close(self):
+        """Shut down composeVoices()' worker processes, if it started any"""
+        if self._pool != None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def composeScoreThreaded(self, bufferDepth = 64):
+        """As composeScore(), but the melody algorithm runs in a producer thread which
+        feeds (note, key) pairs through a fifo.BlockingFIFO of 'bufferDepth' items,
+        while this thread consumes them into the score.  Both ends move whole batches
+        (putMany(), drain()), so the lock is taken per batch rather than per note."""
+        if timing.enabled:
+            start = timing.now()
+        self.algorithm.plantSeed(self.seed)
+        self.newScore()
+        self.finished = False
+        self.measureCount = 0
+        self.beatCount = 0
+        notes = fifo.BlockingFIFO(bufferDepth)
+        errors = []
+        producer = threading.Thread(target = self._produceNotes, args = (notes, errors),
+                                    name = "composer-producer", daemon = True)
+        producer.start()
+        try:
+            while not self.finished:
+                try:
+                    batch = [notes.get()] + notes.drain()       # Wait for one, take them all
+                except fifo.Error_Closed:
+                    if errors:
+                        raise errors[0]
+                    raise
+                for n, (note, key) in enumerate(batch):
+                    self.composeNote(note, key)
+                    if self.finished:
+                        break
+                if timing.enabled:
+                    timing.count('notes', n + 1)
+        finally:
+            notes.close()           # Stops the producer
+            producer.join()
+        if timing.enabled:
+            timing.addTime('compose', start)
+        return self.score
+
+    def _produceNotes(self, notes, errors):
+        """Producer thread: put the algorithm's notes into 'notes' until it is closed.
+        Any exception is handed to the consumer through 'errors'."""
+        try:
+            while True:
+                keys = []
+                notes.putMany(zip(self.algorithm.getNextNotes(self.batchSize, keys), keys))
+        except fifo.Error_Closed:
+            pass
+        except Exception as e:
+            errors.append(e)
+            notes.close()
+
+    def getScore(self):
+        """Return the composed score.Score, composing it first if necessary."""
+        if self.score == None or not self.finished:
+            self.composeScore()
+        return self.score
 
     def processMeasure(self, measure, tieLastNote = False):
         """Send a measure to the Orchestrator.  Get a formatted measure back, and
         return it."""
-        print("measure #{}".format(self.measureCount))
-        return Orchestrator.processMeasure(measure, tieLastNote, homeKey = self.homeKey)
+        return Orchestrator.processMeasure(measure, tieLastNote, homeKey = self.homeKey,
+                                           measureDuration = self.measureDuration,
+                                           resolution = self.resolution,
+                                           groups = self.config.getGroupDurations())
 
     @staticmethod
     def _invert(length):
@@ -137,127 +379,60 @@ class Composer():
         else:
             return 1/length
 
-    def getFd(self):
+    def getFd(self, filename = None, mode = 'w'):
         #return None     # TEMPORARY BYPASS
+        if filename == None:
+            filename = self.outputFilename
         try:
-            _dbg("opening {}".format(self.outputFilename))
-            fd = open(self.outputFilename, 'w')
+            self.log.dbg("opening {}", filename)
+            fd = open(filename, mode)
         except:
             return None
         return fd
 
-    def writeString(self, string, fd = None):
-        self._write(string, fd)
-
-    def writeStringOLD(self, string, fd = None):
-        closeAfter = False
-        if fd == None:
-            closeAfter = True
-            fd = self.getFd()
-        fd.write(string)
-        if closeAfter:
-            fd.close()
+    def render(self, renderer, fd = None):
+        """Render the score with render.Renderer subclass 'renderer' to file object
+        'fd' (or stdout if 'fd' == None).  Composes the score first if necessary."""
+        score = self.getScore()
+        if timing.enabled:
+            start = timing.now()
+        renderer(score).write(fd)
+        if timing.enabled:
+            timing.addTime('write', start)
 
-    def writeHeader(self, fd = None):
-        """Write a GNU Lilypad header"""
-        self.writeString(self.headerString, fd)
-
-    def writeClefKeyTime(self, fd = None):
-        """Write the introductory clef, key, and time signature"""
-        clefstring = self.getClefLily()
-        keystring = self.getKeyLily()
-        timestring = self.getTimeSignatureLily()
-        outstring = clefstring + keystring + timestring
-        self.writeString(outstring, fd)
-
-    def getClefLily(self):
-        """Get the clef command in GNU Lilypond format"""
-        WHITESPACE = 4*" "
-        clef =  self.config.get('clef')
-        if clef == None:
-            return ""
-        clefstring = theory.TheoryClass._getClefString(clef)
-        if clefstring == None:
-            return ""
-        return "{}{} {}\n".format(WHITESPACE, pypond.LilySyntax.kwClef, clefstring)
-
-    def getKeyLily(self):
-        """Get the key signature command in GNU Lilypond format"""
-        WHITESPACE = 4*" "
-        key = self.config.get('key', None)
-        if key == None:
-            return ""
-        keyString = key.getKeyLily()
-        if keyString == None:
-            return ""
-        return "{}{} {}\n".format(WHITESPACE, pypond.LilySyntax.kwKey, keyString)
-
-    def getTimeSignatureLily(self):
-        """Get the time signature command in GNU Lilypond format"""
-        WHITESPACE = 4*" "
-        time = self.config.get('timeSignature', None)
-        if time == None:
-            return ""
-        timeString = time.asLily()
-        if timeString == None:
-            return ""
-        return "{}{} {}\n".format(WHITESPACE, pypond.LilySyntax.kwTimeSignature, timeString)
-
-    def writeNotes(self, fd = None):
-        lineMeasureCount = 0
-        measuresPerLine = 4
-        indent = "    "
-        #notes = []
-        self.writeString("\n", fd)
-        while not self.finished:
-            formattedMeasure = self.compose()
-            if formattedMeasure != None:
-                self.writeString(indent + formattedMeasure, fd)
-                if lineMeasureCount == measuresPerLine - 1:
-                    lineMeasureCount = 0
-                    #self.writeString("\n", fd)
-                    self.writeString("    % Measure {}\n".format(self.measureCount), fd)
-                else:
-                    lineMeasureCount += 1
-        self.writeString("\n", fd)
-        """
-            for note in nextNotes:
-                notes.append(note)
-                if wordcount == wordsperline:
-                    wordcount = 0
-                    notes.append('\n\r  ')
-                else:
-                    wordcount += 1
-        # Flush out the remainder of the buffer
-        lastNotes = self.flushBuffer()
-        for note in lastNotes:
-            notes.append(note)
-        notestring = " ".join(notes)
-        self.writeString(notestring, fd)
-        """
-
-    def writeFooter(self, fd = None):
-        """Write a GNU Lilypad footer"""
-        self.writeString(self.footerString, fd)
-    
     def writeAll(self, fd = None):
+        """Write the piece in GNU Lilypond format to 'fd', or to self.outputFilename
+        if 'fd' == None."""
         closeAfter = False
-        self.finished = False
         if fd == None:
             closeAfter = True
             fd = self.getFd()
-        self.writeHeader(fd)
-        self.writeClefKeyTime(fd)
-        self.writeNotes(fd)
-        self.writeFooter(fd)
-        if fd != None:
+        import render
+        self.render(render.LilyRenderer, fd)
+        if closeAfter and fd != None:
             fd.close()
 
-    def _write(self, string, fd = None):
-        if fd == None:
-            print(string)
+    def writeFormat(self, ext):
+        """Write the piece using the renderer for file extension 'ext' (e.g. 'mid',
+        'json') to a file named like self.outputFilename.  Returns the filename
+        written, or None on failure."""
+        import render
+        renderer = render.getRenderer(ext)
+        if renderer == None:
+            print("No renderer for format {}".format(ext))
+            return None
+        root, oldext = os.path.splitext(self.outputFilename)
+        filename = root + '.' + renderer.ext
+        if renderer.binary:
+            mode = 'wb'
         else:
-            fd.write(string)
+            mode = 'w'
+        fd = self.getFd(filename, mode)
+        if fd == None:
+            return None
+        self.render(renderer, fd)
+        fd.close()
+        return filename
 
     def generateOutputFilename(self):
         algorithm = self.config.gets('algorithm', None)
@@ -271,208 +446,33 @@ class Composer():
         return "{:02}{:02}{:02}_{:02}{:02}{:02}".format(ts.tm_year%100, ts.tm_mon,
                ts.tm_mday, ts.tm_hour, ts.tm_min, ts.tm_sec)
 
-class Orchestrator():
-    """The composer does the work of grabbing notes from the algorithm and chopping
-    them up at measure (bar) lines, but does no formatting.  The composer passes Note objects
-    (and/or Rest objects) to the Orchestrator in single-measure chunks, with each Note already
-    associated with its beat in the measure.  It is then the Orchestrator's job to format
-    the measure according to common notation standards and practice, and then hand the formatted
-    measure string back to the composer to write it to the output file (and take credit for it)."""
-    def __init__(self):
-        pass
-
-    @classmethod
-    def processMeasure(cls, measure, tieLastNote = False, homeKey = None):
-        """Multi-pass algorithm:
-        1. Combine adjacent rests.
-        2. Replace notes with more appropriate enharmonic equivalents when necessary
-        3. Replace notes with lists of tied notes from self.decomposeNotes
-        4. Flatten note list and join into Lilypond-formatted string.
-        5. Return string to caller.
-
-        'homeKey' is the key that is in use at the top of the piece (see cfg).
-        """
-        if not isinstance(homeKey, muse.Key):
-            try:
-                homeKey = muse.Key(homeKey)
-            except Exception as e:
-                print(e)
-                homeKey = None
-        measure = cls.combineRests(measure)
-        #measure = cls.optimizeEnharmonics(measure, homeKey)
-        measure = cls.expand(measure)
-        return cls.stringify(measure, tieLast = tieLastNote)
-
-    @classmethod
-    def combineRests(cls, measure):
-        """Step through the list of pypond.Notes making up a measure. If the note is
-        a rest and the next note is also a rest, replace the first with a new rest
-        with a duration the sum of the two. Delete the second rest.
-        """
-        # We need a separate index which gets decremented whenever we combine/delete
-        # a rest so we can continue to combine if there are further rests.
-        m = 0
-        for n in range(len(measure)):
-            #print('n = {}; m = {}, len = {}'.format(n, m, len(measure)))
-            if  measure[m].isRest():
-                if m < len(measure) - 1:
-                    if measure[m+1].isRest():
-                        measure[m] += measure[m+1]  # Combine
-                        del measure[m+1]            # Remove 2nd note
-                        m -= 1
-            m += 1
-        return measure
-
-    @classmethod
-    def optimizeEnharmonics(cls, measure, key = None):
-        """For each note in the measure, determine the best enharmonic equivalent
-        for this particular case."""
-        if key == None:
-            # Could also try to filter out double-sharps and double-flats
-            return measure
-        for n in range(len(measure)):
-            measure[n] = key.getBestEnharmonic(measure[n])
-        return measure
-
-    @classmethod
-    def expand(cls, measure):
-        """Replace each note with a list of tied basis notes if needed, returning
-        the expanded (nested-list) measure."""
-        for n in range(len(measure)):
-            measure[n] = cls.decomposeNote(measure[n])
-        return measure
-
-    @classmethod
-    def stringify(cls, measure, tieLast = False):
-        """Assume measure is nested-list.  Flatten it first, then convert each note
-        in the measure to a string in GNU Lilypond format, concatenate the strings
-        in order, and return the resulting string."""
-        measure = cls._flattenList(measure, depth = 1)
-        if tieLast:
-            if hasattr(measure[-1], 'setTie'):
-                measure[-1].setTie(True)
-        for n in range(len(measure)):
-            if hasattr(measure[n], 'asLily'):
-                measure[n] = measure[n].asLily()
-            else:
-                measure[n] = ''
-        return ' '.join(measure)
-
-    @classmethod
-    def decomposeNote(cls, note):
-        """First parse the alignBeat, then walk from LS-to-MS through the alignBeat parse
-        and 'fill in the holes' taking from the note duration.  Once the beat has rounded
-        out to all zeros (an even multiple of whole notes), walk down MS-to-LS the remaining
-        note duration parse.
-
-        On the first pass (LS-to-MS), we don't need to worry about dotting notes.
-
-        Returns a list of notes representing input 'note' decomposed into unit notes
-        (2**(-n)) with beats and ties set accordingly."""
-        alignBeat = note.getBeatNum()
-        if alignBeat == None:
-            return (note)
-        duration = note.getDuration()
-        nBeats = cls.parseBeat(alignBeat)
-        #print("0:\t{:.4f}\t{:.4f}\t{}".format(alignBeat, duration, nBeats))
-        notelist = []
-        for n in range(len(nBeats)):    # Walk the beat parse
-            if nBeats[-(n+1)]:          # (LS-to-MS)
-                index = len(nBeats) - (n + 1)
-                ddur = 2**(-index)      # We need to borrow this delta-duration from the note if possible
-                if duration >= ddur:
-                    duration -= ddur
-                    newNote = note.copy()
-                    newNote.setDuration(ddur)
-                    newNote.setBeatNum(alignBeat)
-                    notelist.append(newNote)
-                    alignBeat += ddur   # Give that duration to the alignBeat
-                    nBeats = cls.parseBeat(alignBeat)    # then parse the beat again
-                    #print("{}:\t{:.4f}\t{:.4f}\t{}".format(n+1, alignBeat, duration, nBeats))
-        # Now we walk down the parsed remainder of the note duration
-        nNotes = cls.parseBeat(duration)
-        #print("X:\t{:.4f}\t{:.4f}\t{}".format(alignBeat, duration, nNotes))
-        candot = False                  # Note dotting
-        for n in range(len(nNotes)):    # Walk through the breakdown of the note duration, starting from whole notes
-            if nNotes[n] > 0:           # If a duration exists,
-                if candot:              # If the last duration exists, we can dot it!
-                    candot = False      # Then we turn off dotting so we don't end up with double-dots
-                    notelist[-1].setDot(True) # (those are silly)
-                else:
-                    candot = True       # The next note can be a dot if present
-                    dur = 2**(-n)  # 4 for quarter note, 8 for eighth note, etc...
-                    newNote = note.copy()
-                    newNote.setDuration(dur)
-                    newNote.setBeatNum(alignBeat)
-                    notelist.append(newNote)
-                    alignBeat += dur
-            else:
-                candot = False          # The next note cannot be a dot
-        if len(notelist) > 1:           # If results in more than one note
-            for n in range(len(notelist)-1):  # Set the tie for all but the last
-                notelist[n].setTie(True)
-        return notelist
-
-    @staticmethod
-    def parseBeat(duration):
-        """Returns [n1, n2, n4, n8, n16, n32, n64] where nX is (either 0 or 1)
-        the number of the 'X'th unit duration in the decomposition of
-        'duration'.  The 'X'th unit duration means, e.g.:
-            2nd = 1/2 = half note
-            16th = 1/16 = sixteenth note
-            etc...
-        """
-        return [int(x) for x in "{:07b}".format(int(duration*64))]
+def _composeVoice(config, numMeasures, seed):
+    """Compose and return a single-voice score.Score with a fresh Composer (and so a
+    fresh algorithm instance) of muse.Configuration 'config'.  Runs in a worker process
+    for Composer.composeVoices()."""
+    composer = Composer(config, None)
+    composer.numMeasures = numMeasures
+    composer.algorithm.plantSeed(seed)
+    return composer.composeVoice()
 
-    @staticmethod
-    def _flattenList(l, depth = 1):
-        if not hasattr(l, '__len__'):
-            return l
-        n = 0
-        passes = 0
-        while True:
-            while True:
-                if hasattr(l[n], '__len__'):        # If the nth member is a list-like object
-                    todel = n
-                    for m in range(len(l[todel])):
-                        l.insert(1+todel+m, l[todel][m])
-                        n += 1
-                    del l[todel]
-                    n -= 1
-                n += 1
-                if n >= len(l):
-                    break
-            n = 0
-            passes += 1
-            if passes == depth:
-                break
-        return l
-
-    @staticmethod
-    def _setBeatNums(measure):
-        beat = 0
-        for n in range(len(measure)):
-            measure[n].setBeatNum(beat)
-            beat += measure[n].getDuration()
-        return measure
-
-    @staticmethod
-    def _printMeasure(measure):
-        print(diagnostics.prettyMeasure(measure, self.measureDuration))
-
-def _dbg(*args, **kwargs):
-    if DEBUG:
-        if LOGFILE != None:
-            print("[{}]\t".format(FILENAME), file = LOGFILE, end = '')
-            print(*args, **kwargs, file = LOGFILE)
+_log = debug.getLogger(FILENAME)
+_dbg = _log.dbg
 
 class MeasureBuffer():
-    def __init__(self, measureDuration, precision = 1/64):
+    def __init__(self, measureDuration, precision = 1/64, resolution = None):
+        """A buffer holding one measure's worth of notes.  The storage is allocated once
+        (one slot per tick, the most notes a measure can hold) and recycled for every
+        measure, and the running total is kept in integer ticks at 'resolution' (ticks
+        per whole note), by default one fine enough for 'precision' (the shortest note,
+        in whole notes).  Every note added must fall on that grid."""
         self.measureDuration = measureDuration
         self.precision = precision
-        self.fifoDepth = int(measureDuration/precision + 1)
-        self.fifo = self.initBuffer(self.fifoDepth)
-        self.total = 0
+        if resolution == None:
+            resolution = rhythm.getResolution(precision)
+        self.resolution = resolution
+        self.measureTicks = int(round(measureDuration*self.resolution))
+        self.initBuffer(self.measureTicks + 1)
+        self.totalTicks = 0
 
     def add(self, note):
         """Add a note to the measure.
@@ -482,224 +482,173 @@ class MeasureBuffer():
         Returns True if no overflow occurred and measure is full.
         Returns None if measure is full.
         Returns None if 'note' doesn't have a 'getDuration' attribute.
+        Raises muse.Error_InvalidConfig if the note is off the buffer's tick grid.
         """
-        #print("+ + + + Add + + + +")
-        #print("Measure Full? {}".format(self.isMeasureFull()))
-        #print("total = {}\tAdding {}{}".format(self.total, note.getNoteName(),
-        #   note.getDurationDecomposed(reciprocal = False)))
-        if hasattr(note, 'getDuration'):
+        try:
             duration = note.getDuration()
-        else:
+        except AttributeError:
             return None
-        if self.isMeasureFull():
+        if self.totalTicks == self.measureTicks:
             return None
-        newTotal = self.total + duration
-        if newTotal > self.measureDuration:         # If adding the note will overflow the measure
-            newDuration = self.measureDuration - self.total # Add only enough duration to fill the measure
-            note.setDuration(newDuration)           # Shorten the note
+        ticks = int(round(duration*self.resolution))
+        if ticks != duration*self.resolution:
+            raise muse.Error_InvalidConfig("{} is off the 1/{} grid of the measure".format(note, self.resolution))
+        newTotal = self.totalTicks + ticks
+        if newTotal > self.measureTicks:            # If adding the note will overflow the measure
+            newTicks = self.measureTicks - self.totalTicks  # Add only enough duration to fill the measure
+            note.setDuration(newTicks/self.resolution)      # Shorten the note
             self.addToBuffer(note)                  # Then add it to the buffer
-            remainder = newTotal - self.measureDuration # The remainder of the note will go to a new note
-            #print("@Overflow; {} - {} = {}".format(newTotal, self.measureDuration, remainder))
-            reNote = note.copy()                    # Copy so we get the same pitch
-            reNote.setDuration(remainder)           # Then set the duration
-            self.total += newDuration               # Add the new duration to the total
+            reNote = note.clone()                   # Copy so we get the same pitch
+            reNote.setDuration((newTotal - self.measureTicks)/self.resolution)  # The remainder
+            self.totalTicks = self.measureTicks
             return reNote                           # And return the new remainder note
-        else:                                       # If the note will fit without overflowing the measure
-            self.addToBuffer(note)                  # Add the full note
-            self.total = newTotal                   # And update the total
-            #print("@Non-overflow; total = {}; measDur = {}; isMeasureFull? {}".format(
-            #   self.total, self.measureDuration, self.isMeasureFull()))
-            if self.isMeasureFull():                # Check again to see if the measure is now full
-                #print("returning True")
-                return True                         # If so, return True
-            else:
-                return False                        # If not, return False
+        self.addToBuffer(note)                      # Add the full note
+        self.totalTicks = newTotal                  # And update the total
+        return newTotal == self.measureTicks        # True if the measure is now full
 
     def getMeasure(self):
-        """Empty the FIFO and return the resulting measure's worth of notes as a list."""
-        notes = []
-        while True:
-            note = self.getFromBuffer()
-            if note == None:    # FIFO is empty
-                break
-            self.total -= note.getDuration()
-            notes.append(note)
-        #print("getMeasure() nNotes = {}\tlen(buffer) = {}".format(len(notes),
-        #      self.getNumBufferItems()))
-        #print("&&&&&&&&&&&&&&&&&&&&& total = {}".format(self.total))
-        return notes
+        """Empty the buffer and return the measure's worth of notes as a view onto the
+        buffer's storage (supporting len(), iteration and indexing).  The view is only
+        valid until the next add(); copy it (e.g. tuple(view)) to keep it."""
+        self._length = self._count
+        self._count = 0
+        self.totalTicks = 0
+        return self._view
 
     def isMeasureFull(self):
-        return self.total == self.measureDuration
+        return self.totalTicks == self.measureTicks
+
+    def getTotal(self):
+        """Return the duration of the notes in the buffer in whole notes"""
+        return self.totalTicks/self.resolution
 
     def initBuffer(self, bufferDepth = 8):
-        return fifo.FIFO(int(bufferDepth), blockOnFull = False)
+        self._notes = [None]*int(bufferDepth)
+        self._count = 0
+        self._length = 0
+        self._view = _MeasureView(self)
 
     def inspectBuffer(self, index):
-        return self.fifo[index]
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            return None
+        return self._notes[index]
 
     def bufferItemReplace(self, index, newitem):
         if abs(index) < self.getNumBufferItems():
-            self.fifo[index] = newitem
+            if index < 0:
+                index += self._count
+            self._notes[index] = newitem
             return True
         return False
 
     def addToBuffer(self, item):
-        return self.fifo.add(item)
-
-    def getFromBuffer(self):
-        return self.fifo.get()
+        if self._count == len(self._notes):
+            self._notes.append(item)                # Only zero-length notes get us here
+        else:
+            self._notes[self._count] = item
+        self._count += 1
+        return True
 
     def getNumBufferItems(self):
-        return len(self.fifo)
-    
-
-class LogFile():
-    def __init__(self, filename = None):
-        self.filename = filename
-        self._new = True
-        self.fd = None
-    
-    def write(self, s):
-        if self.open():
-            self.fd.write(s)
-            self.close()
-            return
-        print(s)
-
-    def open(self):
-        """The first time this is called after instantiating this class,
-        the filename is opened for writing (to overwrite the previous log file).
-        Each subsequent time, the file is opened in append mode.
-        The file is opened before and closed after each write so the program
-        is free to crash whenever it wants."""
-        try:
-            if self._new:
-                wa = 'w'
-            else:
-                wa = 'a'
-            self.fd = open(self.filename, wa)
-            self._new = False
-        except IOError:
-            print("Cannot open file {}".format(self.filename))
-            return False
-        return True
+        return self._count
+
+
+class _MeasureView():
+    """A read-only window onto the measure last taken from a MeasureBuffer.  One view
+    belongs to each buffer and is handed out for every measure."""
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def __len__(self):
+        return self._buffer._length
+
+    def __iter__(self):
+        notes = self._buffer._notes
+        for n in range(self._buffer._length):
+            yield notes[n]
+
+    def __getitem__(self, index):
+        length = self._buffer._length
+        if isinstance(index, slice):
+            return [self._buffer._notes[n] for n in range(*index.indices(length))]
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("MeasureView index out of range")
+        return self._buffer._notes[index]
+
+    def __repr__(self):
+        return "MeasureView({})".format(list(self))
 
-    def close(self):
-        if self.fd != None:
-            if hasattr(self.fd, 'close'):
-                self.fd.close()
 
 class Error_Note(Exception):
     pass
 
 def execLily(filename):
+    import subprocess
     lily = os.path.join(_LILYPATH, _LILYEXEC)
     lilyCall = "{} {}".format(lily, filename)
     print(lilyCall)
     #return os.system(lilyCall)
-    return subprocess.call(lilyCall, shell=True)
+    if timing.enabled:
+        start = timing.now()
+    result = subprocess.call(lilyCall, shell=True)
+    if timing.enabled:
+        timing.addTime('lily', start)
+    return result
 
 def _testComposer(args):
-    USAGE = "python3 {} <configFile.ini> [outputFilename] [-x]\n\
-             -x : Do not call GNU Lilypond (don't generate PDF)".format(args[0])
+    USAGE = "python3 {} <configFile.ini> [outputFilename] [-x] [-m] [-j] [-t] [-d] [--profile] [--seed=N]\n\
+             -x : Do not call GNU Lilypond (don't generate PDF)\n\
+             -d : Log debug traces (not only warnings) to {}\n\
+             --seed=N : Compose with seed N (the seed of every piece is printed)\n\
+             -t : Run the melody algorithm in its own (producer) thread\n\
+             -m : Also write the piece as a MIDI file (.mid)\n\
+             -j : Also write the piece as a JSON file (.json)\n\
+             --profile : Time the stages of the run; print a summary and write it to <outputFilename>.profile.json".format(args[0], _LOGFILE)
     cfgFilename = None
     outputFilename = None
-    if len(args) > 2:
-        cfgFilename = args[1]
-        outputFilename = args[2]
-    elif len(args) > 1:
-        cfgFilename = args[1]
+    positional = [arg for arg in args[1:] if not arg.startswith('-')]
+    if len(positional) > 1:
+        cfgFilename = positional[0]
+        outputFilename = positional[1]
+    elif len(positional) > 0:
+        cfgFilename = positional[0]
     if '-x' in args:
         makepdf = False
     else:
         makepdf = True
+    if '-d' in args:
+        debug.setLevel(debug.DEBUG)
+    debug.setHandler(debug.BufferedFileHandler(_LOGFILE))     # Created by the first record
+    if '--profile' in args:
+        timing.enable()
     composer = Composer(cfgFilename, outputFilename)
+    for arg in args[1:]:
+        if arg.startswith('--seed='):
+            composer.setSeed(muse._seedParser(arg[len('--seed='):]))
+            if composer.getSeed() == None:
+                composer.setSeed(muse.newSeed())
+    print("seed = {}".format(composer.getSeed()))
+    if '-t' in args:
+        composer.composeScoreThreaded()
     composer.writeAll()
+    composer.close()
+    import render
+    if '-m' in args:
+        composer.writeFormat(render.MIDIRenderer.ext)
+    if '-j' in args:
+        composer.writeFormat(render.JSONRenderer.ext)
     if makepdf:
         execLily(composer.outputFilename)
-
-def _testOrchestratorDecomposeNote(args):
-    USAGE = "python3 {} <noteDuration> [beat]".format(args[0])
-    if len(args) > 1:
-        duration = eval(args[1])
-    else:
-        print(USAGE)
-        return
-    if len(args) > 2:
-        beat = eval(args[2])
-    else:
-        beat = 0
-    note = pypond.Note("C4", duration)
-    note.setBeatNum(beat)
-    noteList = Orchestrator.decomposeNote(note)
-    print("Name\tBeat\tDuration")
-    for note in noteList:
-        print("{}\t{:.4f}\t{:.4f}".format(note.getNoteName(), note.getBeatNum(), note.getDuration()))
-    return
-
-def _testOrchestratorCombineRests(args):
-    USAGE = "python3 {}".format(args[0])
-    testMeasure = [None]*6
-    for n in range(len(testMeasure)):
-        testMeasure[n] = pypond.Rest(1/8)
-    testMeasure[3] = pypond.Note("C4")
-    testMeasure[3].setDuration(1/8 + 1/4)
-    def setBeatNums(measure):
-        beat = 0
-        for n in range(len(measure)):
-            measure[n].setBeatNum(beat)
-            beat += measure[n].getDuration()
-        return measure
-    testMeasure = setBeatNums(testMeasure)
-    def printMeasure(measure):
-        print("Note\tBeat\tDuration")
-        for note in measure:
-            print("{}\t{:.4f}\t{:.4f}".format(note.getNoteName(),
-                  note.getBeatNum(), note.getDuration()))
-    printMeasure(testMeasure)
-    testMeasure = Orchestrator.combineRests(testMeasure)
-    printMeasure(testMeasure)
-    return
-
-def _testOrchestratorFlattenList(args):
-    l = [0, 1, 2, [3, [4, 5], 6, 7], 8, 9, [10, 11], [12]]
-    print(l)
-    l = Orchestrator._flattenList(l,2)
-    print(l)
-    return
-
-def _testOrchestratorStringify(args):
-    measure = [pypond.Note('C4', 1/4), [pypond.Rest(1/8), pypond.Rest(1/4)],
-               pypond.Note('Eb3', 1/2)]
-    lilystring = Orchestrator.stringify(measure, tieLast = True)
-    print(lilystring)
-
-def _testOrchestratorProcessMeasure(args):
-    USAGE = "python3 {} <lilyNote> ...".format(args[0])
-    if len(args) > 1:
-        measure = []
-        for arg in args[1:]:
-            measure.append(pypond.Note.fromLily(arg))
-        measure = Orchestrator._setBeatNums(measure)
-        Orchestrator._printMeasure(measure)
-        lilystring = Orchestrator.processMeasure(measure)
-        print(lilystring)
-    else:
-        print(USAGE)
+    if timing.enabled:
+        print(timing.formatSummary())
+        root, ext = os.path.splitext(composer.outputFilename)
+        timing.writeJSON(root + ".profile.json")
 
 if __name__ == "__main__":
     import sys
-    DEBUG = True
-    LOGFILE = LogFile("dbg.log")
-    FILENAME = sys.argv[0]
-    muse.LOGFILE = LOGFILE
-    pypond.LOGFILE = LOGFILE
     argv = sys.argv
     _testComposer(argv)
-    #_testOrchestratorDecomposeNote(argv)
-    #_testOrchestratorCombineRests(argv)
-    #_testOrchestratorFlattenList(argv)
-    #_testOrchestratorStringify(argv)
-    #_testOrchestratorProcessMeasure(argv)
-
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+
+"""Constraint-based melodies.  MAConstraint searches, one phrase at a time, for notes
+which satisfy a list of Constraints (maximum leap, maximum repeats, a tonic cadence at
+the end of every phrase, and the key range of the configuration), backtracking when it
+paints itself into a corner.  Loaded on demand by muse.getAlgorithm() when
+'algorithm = MAConstraint'."""
+
+import collections
+import debug, muse
+
+class Constraint(object):
+    """A rule on the melody, checked incrementally.  A constraint's state is a small,
+    immutable summary of the notes so far (a rolling window, never the history), so
+    checking a note is O(1) and backtracking only has to drop the latest state.
+    Notes are (index, ticks): an index into the algorithm's range table (see
+    muse.MelodyAlgorithm.getRangeTable()) and a duration in rhythm ticks."""
+    def start(self):
+        """Return the state before the first note"""
+        return None
+
+    def allows(self, state, index, ticks, remaining):
+        """Return True if note (index, ticks) may follow 'state' with 'remaining'
+        ticks left in the phrase"""
+        return True
+
+    def advance(self, state, index, ticks):
+        """Return the state after note (index, ticks)"""
+        return state
+
+class MaxLeap(Constraint):
+    """No leap of more than 'maxLeap' steps of the key between consecutive notes"""
+    def __init__(self, maxLeap):
+        self.maxLeap = maxLeap
+
+    def allows(self, state, index, ticks, remaining):
+        return state == None or abs(index - state) <= self.maxLeap
+
+    def advance(self, state, index, ticks):
+        return index
+
+class MaxRepeats(Constraint):
+    """No pitch more than 'maxRepeats' times in a row"""
+    def __init__(self, maxRepeats):
+        self.maxRepeats = maxRepeats
+
+    def start(self):
+        return (None, 0)
+
+    def allows(self, state, index, ticks, remaining):
+        return index != state[0] or state[1] < self.maxRepeats
+
+    def advance(self, state, index, ticks):
+        if index == state[0]:
+            return (index, state[1] + 1)
+        return (index, 1)
+
+class TonicCadence(Constraint):
+    """Every phrase ends on a tonic, exactly at the end of the phrase.  'tonics' are the
+    range table indices of the tonic and 'fillable'[n] is True if n ticks can be filled
+    with the available durations, so the search never leaves a gap it cannot close."""
+    def __init__(self, tonics, fillable):
+        self.tonics = frozenset(tonics)
+        self.fillable = fillable
+
+    def allows(self, state, index, ticks, remaining):
+        if ticks == remaining:
+            return index in self.tonics
+        return ticks < remaining and self.fillable[remaining - ticks]
+
+@muse.registerAlgorithm
+class MAConstraint(muse.MelodyAlgorithm):
+    """Melodies of phraseMeasures-measure phrases found by bounded backtracking search
+    through notes of the key within keyNoteMin..keyNoteMax, under self.constraints:
+    maxLeap, maxRepeats and a tonic cadence from the configuration by default."""
+    maxSteps = 5000             # Search steps per phrase before starting the phrase over
+    maxRestarts = 50
+
+    def __init__(self):
+        self.constraints = []
+        self._phrase = collections.deque()
+        self._states = None
+        super().__init__(None)
+
+    def setConfig(self, config):
+        super().setConfig(config)
+        self.resolution = self.getResolution()
+        measureTicks = int(round(config.getMeasureDuration()*self.resolution))
+        self.phraseTicks = config.get('phraseMeasures', 4)*measureTicks
+        self._durations = self._getDurations()
+        fillable = [True] + [False]*self.phraseTicks
+        for n in range(1, self.phraseTicks + 1):
+            fillable[n] = any(ticks <= n and fillable[n - ticks] for ticks, weight in self._durations)
+        table = self.getRangeTable()
+        numDegrees = len(self.key.getNotes())
+        minDegree = self.key.getScaleDegree(self.keyNoteMin)
+        tonics = [n for n in range(len(table)) if (minDegree + n) % numDegrees == 0]
+        self.constraints = [MaxLeap(config.get('maxLeap', 4)), MaxRepeats(config.get('maxRepeats', 2)),
+                            TonicCadence(tonics, fillable)]
+        self._phrase.clear()
+        self._states = None
+
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self._phrase = collections.deque()
+        self._states = None
+
+    def _getDurations(self):
+        """Return the candidate (ticks, weight) of each duration: 'durationWeights', or
+        the unit and dotted durations from shortestNote to longestNote (the units twice
+        as likely)"""
+        if self.durationWeights != None:
+            durations = zip(self.durationWeights.getItems(), self.durationWeights.getWeights())
+        else:
+            shortest = 2**(-self.minDurationPwr2)
+            longest = 2**(-self.maxDurationPwr2)
+            durations = []
+            for pwr2 in range(self.maxDurationPwr2, self.minDurationPwr2 + 1):
+                unit = 2**(-pwr2)
+                durations.append((unit, 2))
+                if unit/2 >= shortest and 1.5*unit <= longest:
+                    durations.append((1.5*unit, 1))
+        return tuple((int(round(duration*self.resolution)), weight) for duration, weight in durations
+                     if weight > 0 and duration*self.resolution >= 1)
+
+    def getNextNote(self):
+        if len(self._phrase) == 0:
+            self._phrase.extend(self.searchPhrase())
+        index, ticks = self._phrase.popleft()
+        note = self.getRangeTable()[index].clone()
+        note.setDuration(ticks/self.resolution)
+        return note
+
+    def searchPhrase(self):
+        """Return the (index, ticks) notes of the next phrase: a depth-first search which
+        backtracks when no note can follow, starting the phrase over (in a new random
+        order) after self.maxSteps steps."""
+        if self._states == None:
+            self._states = tuple(constraint.start() for constraint in self.constraints)
+        for restart in range(self.maxRestarts):
+            notes = []
+            stack = [(0, self._states, self._candidates(0, self._states))]
+            for step in range(self.maxSteps):
+                elapsed, states, candidates = stack[-1]
+                note = next(candidates, None)
+                if note == None:
+                    stack.pop()                 # Dead end: backtrack
+                    if len(stack) == 0:
+                        raise Error_Unsatisfiable("No phrase satisfies {}".format(
+                                                  [type(constraint).__name__ for constraint in self.constraints]))
+                    notes.pop()
+                    continue
+                index, ticks = note
+                notes.append(note)
+                elapsed += ticks
+                states = tuple(constraint.advance(state, index, ticks)
+                               for constraint, state in zip(self.constraints, states))
+                if elapsed == self.phraseTicks:
+                    self._states = states
+                    return notes
+                stack.append((elapsed, states, self._candidates(elapsed, states)))
+            _dbg("No phrase in {} steps (restart {})", self.maxSteps, restart)
+        raise Error_Unsatisfiable("No phrase found in {} restarts".format(self.maxRestarts))
+
+    def _candidates(self, elapsed, states):
+        """Yield the notes which may come next, in random order (durations weighted)"""
+        remaining = self.phraseTicks - elapsed
+        pitches = list(range(len(self.getRangeTable())))
+        self.random.shuffle(pitches)
+        # Weighted random order: sort by u**(1/weight), largest first
+        durations = sorted(self._durations, key = lambda d: -self.random.random()**(1/d[1]))
+        constraints = tuple(zip(self.constraints, states))
+        for ticks, weight in durations:
+            if ticks > remaining:
+                continue
+            for index in pitches:
+                for constraint, state in constraints:
+                    if not constraint.allows(state, index, ticks, remaining):
+                        break
+                else:
+                    yield (index, ticks)
+
+class Error_Unsatisfiable(Exception):
+    pass
+
+_dbg = debug.getLogger("constraint.py").dbg
+
+def _testConstraint(argv):
+    USAGE = "python3 {} [numMeasures] [configFile.ini]".format(argv[0])
+    import time
+    numMeasures = 16
+    config = muse.Configuration('*')
+    if len(argv) > 1:
+        numMeasures = int(argv[1])
+    if len(argv) > 2:
+        config = muse.Configuration(argv[2])
+    algorithm = MAConstraint()
+    algorithm.setConfig(config)
+    measureDuration = config.getMeasureDuration()
+    notes = []
+    total = 0
+    start = time.perf_counter()
+    while total < numMeasures*measureDuration:
+        note = algorithm.getNextNote()
+        total += note.getDuration()
+        notes.append(note)
+    elapsed = time.perf_counter() - start
+    print(' '.join(note.asLily() for note in notes[:64]))
+    print("{} measures ({} notes) in {:.3f} s".format(numMeasures, len(notes), elapsed))
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testConstraint(argv)
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+
+"""Bulk export of composed pieces as a dataset of arrays, for training jobs which
+would otherwise scrape .ly files.  exportDataset() composes numPieces pieces in worker
+processes (piece k seeded with muse.spawnSeed(seed, k), so the dataset is the same
+however many workers make it) and streams their notes into a directory of .npy files:
+
+    pitch.npy       int16, MIDI pitch of each note, -1 for a rest
+    duration.npy    float32, in whole notes
+    beat.npy        float32, where the note starts in its measure, in whole notes
+    voice.npy       uint8, the voice of the note
+    tie.npy         uint8, 1 if the note is tied over the barline into the next
+    offsets.npy     int64, numPieces + 1: piece k is notes offsets[k]:offsets[k + 1]
+    seeds.npy       uint64, the seed of each piece
+
+Voices follow each other within a piece, each split into measures as in the Score.
+The files are plain, uncompressed .npy, written without numpy, so numpy can map them
+(numpy.load(filename, mmap_mode = 'r')) and a Dataset maps them without numpy; either
+way piece k is read straight from the page cache, with no parsing.
+
+    python3 dataset.py <outputDirectory> <numPieces> [configFile.ini] [seed] [workers]
+    python3 dataset.py <datasetDirectory>"""
+
+import array, mmap, os, struct, sys
+import composer, debug, muse
+
+# Field name : (array type code, .npy descr)
+_FIELDS = {
+    'pitch'     : ('h', '<i2'),
+    'duration'  : ('f', '<f4'),
+    'beat'      : ('f', '<f4'),
+    'voice'     : ('B', '|u1'),
+    'tie'       : ('B', '|u1'),
+}
+_INDEX = {
+    'offsets'   : ('q', '<i8'),
+    'seeds'     : ('Q', '<u8'),
+}
+_NPYMAGIC = b'\x93NUMPY\x01\x00'
+_NPYHEADERSIZE = 128        # Fixed, so the shape can be filled in after streaming the data
+_REST = -1
+
+class _NpyWriter(object):
+    """Append-only writer of a one-dimensional .npy file"""
+    def __init__(self, filename, code, descr):
+        self.code = code
+        self.descr = descr
+        self.count = 0
+        self.fd = open(filename, 'wb')
+        self.fd.write(self._header())
+
+    def _header(self):
+        text = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(self.descr, self.count)
+        size = _NPYHEADERSIZE - len(_NPYMAGIC) - 2
+        return _NPYMAGIC + struct.pack('<H', size) + text.ljust(size - 1).encode('latin1') + b'\n'
+
+    def write(self, data):
+        """Append the bytes of an array.array of self.code (already little-endian)"""
+        self.fd.write(data)
+        self.count += len(data)//struct.calcsize(self.code)
+
+    def extend(self, values):
+        values = array.array(self.code, values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self.write(values.tobytes())
+
+    def close(self):
+        self.fd.seek(0)
+        self.fd.write(self._header())
+        self.fd.close()
+
+def _readNpy(filename):
+    """Map a one-dimensional .npy file written by _NpyWriter (or numpy) and return
+    (mmap, memoryviews to release before closing it, items)"""
+    try:
+        fd = open(filename, 'rb')
+    except IOError:
+        raise muse.Error_FileNotFound("Cannot open file {}".format(filename))
+    with fd:
+        prefix = fd.read(len(_NPYMAGIC) + 2)
+        if len(prefix) < len(_NPYMAGIC) + 2 or prefix[:6] != _NPYMAGIC[:6] or prefix[6] != 1:
+            raise Error_Dataset("{} is not a version 1 .npy file".format(filename))
+        size, = struct.unpack('<H', prefix[-2:])
+        import ast
+        header = ast.literal_eval(fd.read(size).decode('latin1'))
+        start = len(prefix) + size
+        codes = {descr: code for code, descr in list(_FIELDS.values()) + list(_INDEX.values())}
+        code = codes.get(header['descr'], None)
+        if code == None or header['fortran_order'] or len(header['shape']) != 1:
+            raise Error_Dataset("{}: not a one-dimensional {} array".format(filename, '/'.join(sorted(codes))))
+        count = header['shape'][0]
+        if count == 0:
+            return (None, [], array.array(code))
+        fileMap = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+    end = start + count*struct.calcsize(code)
+    if end > len(fileMap):
+        fileMap.close()
+        raise Error_Dataset("{} is truncated".format(filename))
+    whole = memoryview(fileMap)
+    data = whole[start:end]
+    if sys.byteorder == 'little' and start % struct.calcsize(code) == 0:
+        items = data.cast(code)
+        return (fileMap, [items, data, whole], items)
+    items = array.array(code, data)         # A private copy
+    if sys.byteorder != 'little':
+        items.byteswap()
+    data.release()
+    whole.release()
+    fileMap.close()
+    return (None, [], items)
+
+_composers = {}             # configFilename : Composer, one per worker process
+
+def _composePiece(configFilename, numMeasures, seed):
+    """Compose one piece and return (seed, {field : little-endian bytes}).  Runs in a
+    worker process for exportDataset(), so the notes cross back as bytes rather than
+    as pickled Notes."""
+    comp = _composers.get(configFilename, None)
+    if comp == None:
+        comp = composer.Composer(configFilename, None)
+        _composers[configFilename] = comp
+    if numMeasures != None:
+        comp.numMeasures = numMeasures
+    comp.setSeed(seed)
+    if comp.numVoices > 1:
+        score = comp.composeVoices(parallel = False)    # Already in a worker
+    else:
+        score = comp.composeScore()
+    fields = {name: array.array(code) for name, (code, descr) in _FIELDS.items()}
+    pitch = fields['pitch'].append
+    duration = fields['duration'].append
+    beat = fields['beat'].append
+    voice = fields['voice'].append
+    tie = fields['tie'].append
+    for number, measures in enumerate(score.getVoices()):
+        for measure in measures:
+            last = len(measure) - 1
+            for n, note in enumerate(measure):
+                pitch(_REST if note.isRest() else note.getMIDIByte())
+                duration(note.getDuration())
+                beat(note.getBeatNum())
+                voice(number)
+                tie(1 if n == last and measure.getTieLast() else 0)
+    if sys.byteorder != 'little':
+        for values in fields.values():
+            values.byteswap()
+    return (seed, {name: values.tobytes() for name, values in fields.items()})
+
+def _composePieces(jobs):
+    return [_composePiece(*job) for job in jobs]
+
+def exportDataset(directory, numPieces, configFilename = None, seed = None, workers = None,
+                  numMeasures = None):
+    """Compose 'numPieces' pieces from 'configFilename' (default the Composer's) into
+    the dataset 'directory' (see the module docstring) and return the number of notes
+    written.  Piece k has seed muse.spawnSeed(seed, k); 'seed' defaults to the
+    configuration's, or a fresh one.  'workers' processes compose (default one per
+    CPU; 1 composes in this process) while this process writes, so memory stays at
+    a few pieces however big the dataset."""
+    if configFilename == None:
+        configFilename = composer.Composer._defaultConfigFile
+    if seed == None:
+        seed = muse.Configuration(configFilename).get('seed', None)
+        if seed == None:
+            seed = muse.newSeed()
+    if workers == None:
+        workers = os.cpu_count() or 1
+    os.makedirs(directory, exist_ok = True)
+    writers = {name: _NpyWriter(os.path.join(directory, name + '.npy'), code, descr)
+               for name, (code, descr) in _FIELDS.items()}
+    seeds = []
+    offsets = [0]
+    jobs = [(configFilename, numMeasures, muse.spawnSeed(seed, k)) for k in range(numPieces)]
+    # A few chunks per worker: big enough to amortize the round trip, small enough to balance
+    chunkSize = max(1, min(64, numPieces//(4*workers)))
+    chunks = [jobs[n:n + chunkSize] for n in range(0, len(jobs), chunkSize)]
+    pool = None
+    if workers > 1 and len(chunks) > 1:
+        import concurrent.futures
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(workers)
+        except (OSError, NotImplementedError) as e:
+            _dbg("No process pool ({}); composing pieces one at a time", e)
+    try:
+        if pool != None:
+            with pool:
+                results = pool.map(_composePieces, chunks)
+                for pieces in results:
+                    _writePieces(writers, pieces, seeds, offsets)
+        else:
+            for chunk in chunks:
+                _writePieces(writers, _composePieces(chunk), seeds, offsets)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for name, values in (('offsets', offsets), ('seeds', seeds)):
+        code, descr = _INDEX[name]
+        writer = _NpyWriter(os.path.join(directory, name + '.npy'), code, descr)
+        writer.extend(values)
+        writer.close()
+    return offsets[-1]
+
+def _writePieces(writers, pieces, seeds, offsets):
+    for seed, fields in pieces:
+        for name, data in fields.items():
+            writers[name].write(data)
+        seeds.append(seed)
+        offsets.append(writers['pitch'].count)
+
+class Dataset(object):
+    """A dataset directory written by exportDataset(), memory-mapped read-only.
+    Fields are memoryviews (of ints and floats) onto the files' pages: getPiece(k)
+    slices them without copying."""
+    fields = tuple(_FIELDS)
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = []
+        self._arrays = {}
+        for name in tuple(_FIELDS) + tuple(_INDEX):
+            fileMap, views, values = _readNpy(os.path.join(directory, name + '.npy'))
+            if fileMap != None:
+                self._maps.append((fileMap, views))
+            self._arrays[name] = values
+        self.offsets = self._arrays['offsets']
+        self.numPieces = len(self.offsets) - 1
+        if self.numPieces < 0 or any(len(self._arrays[name]) != self.offsets[-1] for name in _FIELDS) or \
+           len(self._arrays['seeds']) != self.numPieces:
+            self.close()
+            raise Error_Dataset("{}: the fields and the offsets index disagree".format(directory))
+
+    def getField(self, name):
+        """Return field 'name' of every note of every piece"""
+        return self._arrays[name]
+
+    def getPiece(self, k):
+        """Return piece 'k' as {field : memoryview of its notes}"""
+        if not 0 <= k < self.numPieces:
+            raise IndexError("Piece {} of {}".format(k, self.numPieces))
+        start = self.offsets[k]
+        end = self.offsets[k + 1]
+        return {name: self._arrays[name][start:end] for name in _FIELDS}
+
+    def getSeed(self, k):
+        return self._arrays['seeds'][k]
+
+    def getNumNotes(self):
+        return self.offsets[-1]
+
+    def close(self):
+        """Unmap the files.  A map which still has slices from getPiece() in use stays
+        open until they are released."""
+        for fileMap, views in self._maps:
+            for view in views:
+                view.release()
+            try:
+                fileMap.close()
+            except BufferError:
+                pass
+        self._maps = []
+        self._arrays = {}
+
+    def __len__(self):
+        return self.numPieces
+
+    def __repr__(self):
+        return "Dataset({}: {} pieces, {} notes)".format(self.directory, self.numPieces, self.offsets[-1])
+
+class Error_Dataset(Exception):
+    pass
+
+_dbg = debug.getLogger("dataset.py").dbg
+
+def _testDataset(argv):
+    USAGE = "python3 {0} <outputDirectory> <numPieces> [configFile.ini] [seed] [workers]\n" \
+            "python3 {0} <datasetDirectory>".format(argv[0])
+    import time
+    if len(argv) < 2:
+        print(USAGE)
+        return
+    if len(argv) > 2:
+        configFilename = None
+        seed = None
+        workers = None
+        if len(argv) > 3:
+            configFilename = argv[3]
+        if len(argv) > 4:
+            seed = muse._seedParser(argv[4])
+        if len(argv) > 5:
+            workers = int(argv[5])
+        start = time.perf_counter()
+        numNotes = exportDataset(argv[1], int(argv[2]), configFilename, seed, workers)
+        print("{} notes in {:.2f} s".format(numNotes, time.perf_counter() - start))
+    dataset = Dataset(argv[1])
+    print(dataset)
+    if len(dataset) > 0:
+        pitches = dataset.getPiece(0)['pitch'].tolist()
+        print("piece 0 (seed {}): pitch {}".format(dataset.getSeed(0), pitches[:16]))
+    dataset.close()
+
+if __name__ == "__main__":
+    argv = sys.argv
+    _testDataset(argv)
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+"""Debug logging shared by every module.  A module takes a Logger by name and logs
+through it with the message's format string and arguments, not a formatted string:
+
+    _dbg = debug.getLogger("muse.py").dbg
+    _dbg("noteMin = {}; noteMax = {}", noteMin, noteMax)
+
+The message is formatted only if its level is enabled, so a disabled _dbg() costs a
+call and a branch.  Code that builds its arguments (joins, reprs) checks
+Logger.debugEnabled first.  Logging is off until a program turns it on:
+
+    debug.setLevel(debug.DEBUG)
+    debug.setHandler(debug.BufferedFileHandler("dbg.log"))
+
+Each record is one line, "[name key=value ...]\\tmessage": Logger.bind() makes a
+Logger which adds its context (e.g. a Composer's cfg and seed) to every line."""
+
+import atexit, sys, threading, time
+
+DEBUG = 10
+WARNING = 30
+OFF = 100
+
+_levelNames = {DEBUG: '', WARNING: 'WARNING: '}
+
+class Logger(object):
+    # Class attributes, so setLevel() reaches every Logger (bound ones too) at once
+    debugEnabled = False
+    warningEnabled = True
+    handler = None
+
+    def __init__(self, name, context = ()):
+        self.name = name
+        self.context = tuple(context)
+        self.prefix = "[{}]\t".format(' '.join([name] + ["{}={}".format(k, v) for k, v in self.context]))
+
+    def dbg(self, fmt, *args):
+        if self.debugEnabled:
+            self._emit(DEBUG, fmt, args)
+
+    def warning(self, fmt, *args):
+        if self.warningEnabled:
+            self._emit(WARNING, fmt, args)
+
+    def isEnabled(self, level):
+        return level >= _level
+
+    def bind(self, **context):
+        """Return a Logger of the same name which adds 'context' (key=value pairs,
+        in the order given) to every record"""
+        return Logger(self.name, self.context + tuple(context.items()))
+
+    def _emit(self, level, fmt, args):
+        handler = Logger.handler
+        if handler == None:
+            return
+        if len(args) > 0:
+            fmt = fmt.format(*args)
+        handler.emit(self.prefix + _levelNames.get(level, '') + fmt + '\n')
+
+    def __repr__(self):
+        return "Logger({}{})".format(self.name, ''.join(", {}={}".format(k, v) for k, v in self.context))
+
+_loggers = {}
+_level = WARNING
+
+def getLogger(name):
+    """Return the Logger 'name', the same one for every caller"""
+    logger = _loggers.get(name, None)
+    if logger == None:
+        logger = Logger(name)
+        _loggers[name] = logger
+    return logger
+
+def setLevel(level):
+    """Enable records of 'level' (DEBUG, WARNING) and above; OFF disables them all"""
+    global _level
+    _level = level
+    Logger.debugEnabled = level <= DEBUG
+    Logger.warningEnabled = level <= WARNING
+
+def getLevel():
+    return _level
+
+def setHandler(handler):
+    """Send records to 'handler' (an object with emit(line), flush() and close()), or
+    nowhere if None.  Closes the handler it replaces."""
+    old = Logger.handler
+    Logger.handler = handler
+    if old != None and old is not handler:
+        old.close()
+
+def getHandler():
+    return Logger.handler
+
+class StreamHandler(object):
+    """Writes each record to a file object (default stderr) as it comes"""
+    def __init__(self, stream = None):
+        self.stream = stream
+
+    def emit(self, line):
+        (self.stream or sys.stderr).write(line)
+
+    def flush(self):
+        (self.stream or sys.stderr).flush()
+
+    def close(self):
+        self.flush()
+
+class BufferedFileHandler(object):
+    """Collects records in memory and writes them to 'filename' every 'capacity'
+    records or 'flushInterval' seconds, whichever comes first, and at exit.  The
+    file is created (overwriting the last run's) when the first record is written,
+    so a run which logs nothing leaves it alone."""
+    def __init__(self, filename, capacity = 256, flushInterval = 1.0):
+        self.filename = filename
+        self.capacity = capacity
+        self.flushInterval = flushInterval
+        self.fd = None
+        self._lines = []
+        self._lastFlush = time.monotonic()
+        self._lock = threading.Lock()        # The composer's producer thread logs too
+        atexit.register(self.close)
+
+    def emit(self, line):
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) >= self.capacity or time.monotonic() - self._lastFlush >= self.flushInterval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._lastFlush = time.monotonic()
+        if len(self._lines) == 0:
+            return
+        if self.fd == None:
+            try:
+                self.fd = open(self.filename, 'w')
+            except IOError:
+                print("Cannot open file {}".format(self.filename))
+                self._lines = []
+                return
+        self.fd.write(''.join(self._lines))
+        self.fd.flush()
+        self._lines = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self.fd != None:
+                self.fd.close()
+                self.fd = None
+        atexit.unregister(self.close)
+
+def _testDebug(argv):
+    USAGE = "python3 {} [numRecords] [logFile]".format(argv[0])
+    numRecords = 100000
+    filename = "dbg.log"
+    if len(argv) > 1:
+        numRecords = int(argv[1])
+    if len(argv) > 2:
+        filename = argv[2]
+    log = getLogger(argv[0]).bind(test = 1)
+    for level in (OFF, DEBUG):
+        setLevel(level)
+        setHandler(BufferedFileHandler(filename))
+        start = time.perf_counter()
+        for n in range(numRecords):
+            log.dbg("record {} of {}", n, numRecords)
+        setHandler(None)
+        print("{:>8}: {:.3f} us/record".format("off" if level == OFF else "debug",
+              1e6*(time.perf_counter() - start)/numRecords))
+
+if __name__ == "__main__":
+    argv = sys.argv
+    _testDebug(argv)
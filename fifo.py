@@ -5,6 +5,12 @@
 # * Indexable (i.e. fifo[n] returns the nth item waiting in the buffer)
 #   Indexes go oldest-to-newest (i.e. 0 is the least-recently added item, -1 is the most-recently added)
 # * len(fifo) returns the number of items pending in the fifo
+# * Bulk operations: extend(items), getMany(n) and drain() copy at most two slices
+# * Iterating over a fifo walks the pending items oldest-to-newest without removing them
+# * BlockingFIFO is a thread-safe variant whose put/putMany/get wait (with optional timeouts)
+#   and which can be closed to signal the consumer that no more items are coming
+
+import itertools, threading
 
 class FIFO(object):
     def __init__(self, bufferDepth = 3, blockOnFull = True):
@@ -58,6 +64,65 @@ class FIFO(object):
             self._empty = True
         return item
 
+    def extend(self, items):
+        """Add each of 'items' in order, as add() would, using at most two slice copies.
+        Blocking Buffer:
+            adds only as many items as fit; returns the number added
+        Non-blocking Buffer:
+            adds all the items, forgetting the oldest as needed; returns len(items)"""
+        items = list(items)
+        count = len(items)
+        added = count
+        free = self._depth - self.getNumItems()
+        if count > free:
+            if self._blockOnFull:
+                count = added = free
+            elif count >= self._depth:
+                # Everything pending (and the start of 'items') is forgotten
+                items = items[count - self._depth:]
+                count = self._depth
+                self._getPtr = self._addPtr
+                self._empty = True
+            else:
+                self._getPtr = (self._getPtr + count - free) % self._depth
+        if count == 0:
+            return added
+        first = min(count, self._depth - self._addPtr)
+        self._buffer[self._addPtr:self._addPtr + first] = items[:first]
+        self._buffer[:count - first] = items[first:count]
+        self._addPtr = (self._addPtr + count) % self._depth
+        self._empty = False
+        return added
+
+    def getMany(self, count = None):
+        """Get up to 'count' items (all pending items if None) as a list, oldest first,
+        using at most two slice copies."""
+        pending = self.getNumItems()
+        if count == None or count > pending:
+            count = pending
+        if count <= 0:
+            return []
+        start = self._getPtr
+        end = start + count
+        if end <= self._depth:
+            items = self._buffer[start:end]
+        else:
+            items = self._buffer[start:] + self._buffer[:end - self._depth]
+        self._getPtr = end % self._depth
+        if self._getPtr == self._addPtr:
+            self._empty = True
+        return items
+
+    def drain(self):
+        """Get all pending items as a list, oldest first, leaving the buffer empty."""
+        return self.getMany()
+
+    def __iter__(self):
+        """Iterate over the pending items oldest-to-newest without removing them"""
+        end = self._getPtr + self.getNumItems()
+        return itertools.chain(itertools.islice(self._buffer, self._getPtr, min(end, self._depth)),
+                               itertools.islice(self._buffer, 0, max(end - self._depth, 0)))
+
     def isFull(self):
         """Return True if the buffer is full, else return False."""
         return (not self._empty) and (self._addPtr == self._getPtr)
@@ -115,8 +180,12 @@ class FIFO(object):
         if index > self._depth - 1:
             raise IndexError("Buffer index out of range.")
             return None
+        if index < 0:
+            index = self.getNumItems() + index
+            if index < 0:
+                raise IndexError("Buffer index out of range.")
         if index <= (self.getNumItems() - 1):
-            index = (index + self._depth - 1 - self._getPtr) % self._depth
+            index = (index + self._getPtr) % self._depth
             return index
         else:
             return None
@@ -132,6 +201,118 @@ class FIFO(object):
     def __repr__(self):
         return self.__str__()
 
+class BlockingFIFO(FIFO):
+    def __init__(self, bufferDepth = 3):
+        """A thread-safe bounded FIFO for a producer and a consumer thread.
+        put() waits while the buffer is full and get() waits while it is empty, each
+        with an optional timeout (put() then returns False, get() raises Error_Timeout,
+        since None may be an item).  close() tells both ends that no more items are
+        coming: put() then raises Error_Closed, and get() returns the items still
+        pending before raising Error_Closed.
+        Indexing is still oldest-to-newest, as for FIFO."""
+        super().__init__(bufferDepth, blockOnFull = True)
+        self._lock = threading.RLock()         # FIFO methods call each other
+        self._notEmpty = threading.Condition(self._lock)
+        self._notFull = threading.Condition(self._lock)
+        self._closed = False
+
+    def put(self, item, timeout = None):
+        """Add an item, waiting up to 'timeout' seconds (forever if None) for room.
+        Returns True if the item was added, False on timeout."""
+        with self._notFull:
+            if not self._notFull.wait_for(lambda: self._closed or not self.isFull(), timeout):
+                return False
+            if self._closed:
+                raise Error_Closed("put() on a closed FIFO")
+            FIFO.add(self, item)
+            self._notEmpty.notify()
+            return True
+
+    def add(self, item):
+        """Add an item if there is room, without waiting (see FIFO.add)"""
+        return self.put(item, timeout = 0)
+
+    def get(self, timeout = None):
+        """Get the next item, waiting up to 'timeout' seconds (forever if None) for one.
+        Raises Error_Timeout on timeout (None is an item like any other), and
+        Error_Closed once closed and empty."""
+        with self._notEmpty:
+            if not self._notEmpty.wait_for(lambda: self._closed or not self.isEmpty(), timeout):
+                raise Error_Timeout("get() found nothing in {} s".format(timeout))
+            if self.isEmpty():
+                raise Error_Closed("get() on a closed, empty FIFO")
+            item = FIFO.get(self)
+            self._notFull.notify()
+            return item
+
+    def putMany(self, items, timeout = None):
+        """Add all of 'items' in order, as many at a time as there is room for (see
+        FIFO.extend), waiting up to 'timeout' seconds (forever if None) whenever the
+        buffer is full.  Returns True once all are added, False on timeout (when only
+        some may have been)."""
+        items = list(items)
+        with self._notFull:
+            while items:
+                if not self._notFull.wait_for(lambda: self._closed or not self.isFull(), timeout):
+                    return False
+                if self._closed:
+                    raise Error_Closed("putMany() on a closed FIFO")
+                added = FIFO.extend(self, items)
+                items = items[added:]
+                self._notEmpty.notify()
+        return True
+
+    def extend(self, items):
+        """Add as many of 'items' as there is room for, without waiting (see FIFO.extend)"""
+        with self._lock:
+            if self._closed:
+                raise Error_Closed("extend() on a closed FIFO")
+            added = FIFO.extend(self, items)
+            if added:
+                self._notEmpty.notify_all()
+            return added
+
+    def getMany(self, count = None):
+        """Get up to 'count' pending items (all if None) without waiting (see FIFO.getMany)"""
+        with self._lock:
+            items = FIFO.getMany(self, count)
+            if items:
+                self._notFull.notify_all()
+            return items
+
+    def __iter__(self):
+        """Iterate over a snapshot of the pending items, oldest-to-newest"""
+        with self._lock:
+            return iter(list(FIFO.__iter__(self)))
+
+    def close(self):
+        """Signal that no more items will be put; wakes up all waiting threads"""
+        with self._lock:
+            self._closed = True
+            self._notEmpty.notify_all()
+            self._notFull.notify_all()
+
+    def isClosed(self):
+        return self._closed
+
+    def getNumItems(self):
+        with self._lock:
+            return FIFO.getNumItems(self)
+
+    def __getitem__(self, index):
+        with self._lock:
+            return FIFO.__getitem__(self, index)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            return FIFO.__setitem__(self, key, value)
+
+class Error_Closed(Exception):
+    pass
+
+class Error_Timeout(Exception):
+    pass
+
 if __name__ == "__main__":
     blockOnFull = input("Block FIFO on full buffer [T/F]: ?")
     if blockOnFull == '' or blockOnFull.lower()[0] == 'f':
@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+
+"""Grammar (L-system style) melodies.  A Grammar rewrites symbols into motifs of
+scale degrees and durations; MAGrammar plays its expansion in the configured key.
+Loaded on demand by muse.getAlgorithm() when 'algorithm = MAGrammar'.
+
+A grammar is a text file of rules, the first of which is the start symbol:
+
+    # Comments start with '#'
+    S -> A B A+4 S
+    A -> 0:1/8 2:1/8 4:1/4 | [2] 4:1/4 2:1/4
+    B -> r:1/4 A-1 7:1/2
+
+A terminal is <degree>:<duration> (or r:<duration> for a rest), where degree counts
+steps of the key from the tonic (0) and may be negative or above an octave.  A symbol
+may be transposed by a number of degrees (A+4, A-1).  Alternatives are separated by
+'|' and chosen at random, weighted by an optional leading [weight]."""
+
+import random
+import muse, pypond
+
+class Grammar(object):
+    maxDepth = 1000             # Symbols being expanded at once (not counting tail calls)
+    memoLimit = 4096            # Longest expansion memoized
+
+    _defaultRules = """
+        S -> P P' P P''
+        P -> M M+2 M+4 C | M M-1 M+1 C
+        P' -> M+4 M+2 M C' | M+3 M+2 M+1 C
+        P'' -> M M+3 M+5 C' | [2] M+4 M+2 M+1 C
+        M -> 0:1/8 1:1/8 2:1/4 | 2:1/8 1:1/8 0:1/4 | 0:1/4 r:1/8 2:1/8 | [2] 0:3/8 1:1/8
+        C -> 4:1/4 2:1/4 1:1/4 0:1/4
+        C' -> 2:1/4 1:1/4 0:1/2
+    """
+
+    def __init__(self, rules = None):
+        """'rules' is the text of a grammar (see the module docstring)"""
+        self.rules = {}             # name : (alternatives, WeightedSampler or None)
+        self.start = None
+        self._memo = {}             # name : tuple of terminals, or None if not memoizable
+        if rules == None:
+            rules = self._defaultRules
+        for line in rules.splitlines():
+            line = line.split('#')[0].strip()
+            if line != '':
+                self._parseRule(line)
+        if self.start == None:
+            raise Error_Grammar("Grammar has no rules")
+        for alternatives, sampler in self.rules.values():
+            for items in alternatives:
+                for item in items:
+                    if isinstance(item[0], str) and item[0] not in self.rules:
+                        raise Error_Grammar("No rule for symbol {}".format(item[0]))
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            fd = open(filename)
+        except IOError:
+            raise muse.Error_FileNotFound("Cannot open file {}".format(filename))
+        with fd:
+            return cls(fd.read())
+
+    def _parseRule(self, line):
+        name, sep, body = line.partition('->')
+        name = name.strip()
+        if sep == '' or not self._isName(name):
+            raise Error_Grammar("Not a rule: {}".format(line))
+        alternatives = []
+        weights = []
+        for text in body.split('|'):
+            words = text.split()
+            weight = 1
+            if words and words[0].startswith('[') and words[0].endswith(']'):
+                weight = muse._float(words.pop(0)[1:-1])
+            alternatives.append(tuple(self._parseItem(word) for word in words))
+            weights.append(weight)
+        if name in self.rules:
+            raise Error_Grammar("Two rules for {}".format(name))
+        sampler = None
+        if len(alternatives) > 1:
+            try:
+                sampler = muse.WeightedSampler(weights, tuple(alternatives))
+            except ValueError as e:
+                raise Error_Grammar("{}: {}".format(name, e))
+        self.rules[name] = (tuple(alternatives), sampler)
+        if self.start == None:
+            self.start = name
+
+    @staticmethod
+    def _isName(s):
+        return len(s) > 0 and s[0].isalpha() and all(c.isalnum() or c in "_'" for c in s)
+
+    def _parseItem(self, word):
+        """Return a terminal (degree, duration), degree None for a rest, or a symbol
+        (name, transpose)"""
+        degree, sep, duration = word.partition(':')
+        try:
+            if sep != '':
+                if degree == 'r':
+                    return (None, muse._float(duration))
+                return (int(degree), muse._float(duration))
+            for n in range(1, len(word)):
+                if word[n] in '+-':
+                    return (word[:n], int(word[n:]))
+            if self._isName(word):
+                return (word, 0)
+        except (ValueError, TypeError, SyntaxError, ZeroDivisionError):
+            pass
+        raise Error_Grammar("Not a terminal or symbol: {}".format(word))
+
+    def getDurations(self):
+        """Return the set of durations of the terminals of every rule"""
+        return {item[1] for alternatives, sampler in self.rules.values()
+                for items in alternatives for item in items if not isinstance(item[0], str)}
+
+    def choose(self, name, rng = random):
+        """Return the items of one of the alternatives for symbol 'name'"""
+        alternatives, sampler = self.rules[name]
+        if sampler == None:
+            return alternatives[0]
+        return sampler.sample(rng = rng)
+
+    def expand(self, name = None, rng = random):
+        """Lazily yield the (degree, duration) terminals of an expansion of symbol 'name'
+        (default the start symbol), choosing alternatives with 'rng'.  The expansion is
+        walked with an explicit stack, so it never recurses in Python and never holds
+        more than the symbols being expanded.  A symbol which ends an alternative
+        replaces its parent (a tail call), so endless right recursion (S -> A S) runs
+        in constant memory; memoized symbols are copied out of self._memo."""
+        if name == None:
+            name = self.start
+        stack = [(self.choose(name, rng), 0, 0)]        # (items, position, transpose)
+        while stack:
+            items, position, transpose = stack[-1]
+            if position == len(items):
+                stack.pop()
+                continue
+            stack[-1] = (items, position + 1, transpose)
+            first, second = items[position]
+            if not isinstance(first, str):
+                if first == None:
+                    yield (None, second)
+                else:
+                    yield (first + transpose, second)
+                continue
+            transpose += second
+            memo = self.getMemo(first)
+            if memo != None:
+                for degree, duration in memo:
+                    if degree == None:
+                        yield (None, duration)
+                    else:
+                        yield (degree + transpose, duration)
+                continue
+            if position + 1 == len(items):
+                stack.pop()                             # Tail call
+            if len(stack) >= self.maxDepth:
+                raise Error_Grammar("{} expands deeper than {} symbols".format(self.start, self.maxDepth))
+            stack.append((self.choose(first, rng), 0, transpose))
+
+    def getMemo(self, name):
+        """Return the whole expansion of symbol 'name' as a tuple of terminals if it is
+        always the same (no alternatives or recursion below it) and no longer than
+        self.memoLimit, otherwise None.  Worked out once per symbol, bottom up."""
+        pending = [name]
+        onStack = {name}
+        while pending:
+            top = pending[-1]
+            if top in self._memo:
+                pending.pop()
+                onStack.discard(top)
+                continue
+            alternatives, sampler = self.rules[top]
+            if sampler != None:
+                self._memo[top] = None
+                continue
+            missing = [first for first, second in alternatives[0]
+                       if isinstance(first, str) and first not in self._memo]
+            if any(symbol in onStack for symbol in missing):
+                self._memo[top] = None                  # Recursive, so endless
+                continue
+            if missing:
+                pending.append(missing[0])              # Depth first, so pending is a path
+                onStack.add(missing[0])
+                continue
+            memo = []
+            for first, second in alternatives[0]:
+                if not isinstance(first, str):
+                    memo.append((first, second))
+                    continue
+                sub = self._memo[first]
+                if sub == None or len(memo) + len(sub) > self.memoLimit:
+                    memo = None
+                    break
+                memo.extend((d if d == None else d + second, duration) for d, duration in sub)
+            if memo != None:
+                memo = tuple(memo)
+            self._memo[top] = memo
+        return self._memo[name]
+
+    def __repr__(self):
+        return "Grammar({} rules, start {})".format(len(self.rules), self.start)
+
+@muse.registerAlgorithm
+class MAGrammar(muse.MelodyAlgorithm):
+    """Play the expansion of the grammar in the file named by 'grammar' in the
+    configuration (or a built-in one), over and over.  Degree 0 is the tonic nearest
+    the middle of keyNoteMin..keyNoteMax; degrees beyond the range are folded back
+    into it by octaves."""
+    _grammars = {}              # filename : Grammar, shared by all instances
+
+    def __init__(self):
+        self.grammar = None
+        self._stream = None
+        self._degreeNotes = {}
+        super().__init__(None)
+
+    def setConfig(self, config):
+        super().setConfig(config)
+        filename = config.get('grammar', None)
+        grammar = MAGrammar._grammars.get(filename, None)
+        if grammar == None:
+            if filename == None:
+                grammar = Grammar()
+            else:
+                grammar = Grammar.load(filename)
+            MAGrammar._grammars[filename] = grammar
+        if grammar is not self.grammar:
+            self.grammar = grammar
+            self._stream = None
+        self._degreeNotes = {}
+
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self._stream = None
+
+    def getNextNote(self):
+        if self._stream == None:
+            self._stream = self.grammar.expand(rng = self.random)
+        item = next(self._stream, None)
+        if item == None:                        # The end of the piece; play it again
+            self._stream = self.grammar.expand(rng = self.random)
+            item = next(self._stream, None)
+            if item == None:
+                raise Error_Grammar("{} expands to nothing".format(self.grammar.start))
+        degree, duration = item
+        if degree == None:
+            return pypond.Rest(duration)
+        note = self.getDegreeNote(degree).clone()
+        note.setDuration(duration)
+        return note
+
+    def getDurations(self):
+        return list(self.grammar.getDurations())
+
+    def getDegreeNote(self, degree):
+        """Return the note of (tonic-relative) scale degree 'degree' from a table built
+        per key and range; treat it as read-only (clone it)"""
+        note = self._degreeNotes.get(degree, None)
+        if note == None:
+            table = self.getRangeTable()
+            numDegrees = len(self.key.getNotes())
+            minDegree = self.key.getScaleDegree(self.keyNoteMin)
+            tonics = [n for n in range(len(table)) if (minDegree + n) % numDegrees == 0]
+            if len(tonics) == 0:
+                tonics = [(-minDegree) % numDegrees]    # Tonic below or above the range
+            base = min(tonics, key = lambda n: abs(2*n - len(table) + 1))
+            index = base + degree
+            while index < 0:
+                index += numDegrees
+            while index >= len(table):
+                index -= numDegrees
+            if index < 0:                               # The range is narrower than an octave
+                index = 0
+            note = table[index]
+            self._degreeNotes[degree] = note
+        return note
+
+class Error_Grammar(Exception):
+    pass
+
+def _testGrammar(argv):
+    USAGE = "python3 {} [grammarFile] [numNotes]".format(argv[0])
+    grammar = Grammar()
+    numNotes = 32
+    if len(argv) > 1:
+        grammar = Grammar.load(argv[1])
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    print(grammar)
+    algorithm = MAGrammar()
+    algorithm.setConfig(muse.Configuration('*'))
+    algorithm.grammar = grammar
+    print(' '.join(algorithm.getNextNote().asLily() for n in range(numNotes)))
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testGrammar(argv)
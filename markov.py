@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+"""Markov chain melodies: MarkovModel, an order-k chain over (scale degree, duration)
+states which can be trained and saved, and MAMarkov, the MelodyAlgorithm which plays
+one.  Loaded on demand by muse.getAlgorithm() when 'algorithm = MAMarkov'."""
+
+import muse, pypond
+
+class MarkovModel(object):
+    """An order-k Markov chain over (scaleDegree, duration) states.  A scaleDegree is
+    zero-indexed within the key (see Key.getScaleDegree()), or None for a rest, so a
+    model plays in whatever key it is given.  Transition weights are stored sparsely
+    as {context : {nextState : weight}}, where a context is a tuple of the 'order'
+    previous state indices.
+
+    On disk a model is a small text file:
+
+        markov <order>
+        states <degree>:<duration> r:<duration> ...
+        <context state indices> > <next>:<weight> <next>:<weight> ...
+    """
+    _magic = "markov"
+    _rest = "r"
+
+    def __init__(self, order = 1):
+        if order < 1:
+            raise Error_InvalidModel("Markov order must be >= 1, not {}".format(order))
+        self.order = order
+        self.states = []            # (degree, duration), by state index
+        self._stateIndex = {}
+        self.counts = {}
+        self._tables = None
+
+    def getOrder(self):
+        return self.order
+
+    def getStates(self):
+        return self.states
+
+    def addState(self, degree, duration):
+        """Return the index of state (degree, duration), adding it if it is new"""
+        state = (degree, duration)
+        index = self._stateIndex.get(state, None)
+        if index == None:
+            index = len(self.states)
+            self.states.append(state)
+            self._stateIndex[state] = index
+        return index
+
+    def addTransition(self, context, nextState, weight = 1):
+        """Add 'weight' to the transition from 'context' (a tuple of 'order' state
+        indices) to state index 'nextState'"""
+        row = self.counts.setdefault(tuple(context), {})
+        row[nextState] = row.get(nextState, 0) + weight
+        self._tables = None
+
+    def train(self, states):
+        """Count the transitions of a sequence of (degree, duration) states"""
+        indices = [self.addState(degree, duration) for degree, duration in states]
+        for n in range(self.order, len(indices)):
+            self.addTransition(indices[n - self.order:n], indices[n])
+
+    def trainNotes(self, notes, key):
+        """Count the transitions of a sequence of pypond.Notes (and Rests) in 'key'.
+        Notes outside the key are skipped."""
+        states = []
+        for note in notes:
+            if note.isRest():
+                states.append((None, note.getDuration()))
+                continue
+            degree = key.getScaleDegree(note)
+            if degree != None:
+                states.append((degree, note.getDuration()))
+        self.train(states)
+
+    def getTables(self):
+        """Return (transitions, contexts, start): the muse.WeightedSampler of the next
+        state of each context, {context : sampler}, plus a sampler 'start' over the
+        tuple 'contexts' for (re)starting the chain.  Built once per model."""
+        if self._tables == None:
+            if len(self.counts) == 0:
+                raise Error_InvalidModel("Markov model has no transitions")
+            transitions = {}
+            contexts = tuple(self.counts)
+            for context in contexts:
+                row = self.counts[context]
+                transitions[context] = muse.WeightedSampler(tuple(row.values()), tuple(row))
+            start = muse.WeightedSampler([sum(self.counts[context].values()) for context in contexts])
+            self._tables = (transitions, contexts, start)
+        return self._tables
+
+    @classmethod
+    def stepwise(cls, numDegrees = 7, durations = ((1/8, 2), (1/4, 2), (1/2, 1))):
+        """A first order model of mostly stepwise motion through 'numDegrees' scale
+        degrees, with (duration, weight) rhythms.  Used when no model file is given."""
+        stepWeights = {0 : 1, 1 : 4, 2 : 2, 3 : 1, 4 : 1}
+        model = cls(1)
+        for degree in range(numDegrees):
+            for duration, weight in durations:
+                model.addState(degree, duration)
+        for n, (degree, duration) in enumerate(model.states):
+            nextDegrees = {(degree + step*sign) % numDegrees : weight
+                           for step, weight in stepWeights.items() for sign in (-1, 1)}
+            for nextDegree, stepWeight in nextDegrees.items():
+                for nextDuration, weight in durations:
+                    model.addTransition((n,), model.addState(nextDegree, nextDuration), stepWeight*weight)
+        return model
+
+    def save(self, filename):
+        with open(filename, 'w') as fd:
+            fd.write("{} {}\n".format(self._magic, self.order))
+            fd.write("states {}\n".format(' '.join(self._stateString(state) for state in self.states)))
+            for context, row in self.counts.items():
+                fd.write("{} > {}\n".format(' '.join(str(n) for n in context),
+                         ' '.join("{}:{}".format(n, muse._numberString(w)) for n, w in row.items())))
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            fd = open(filename)
+        except IOError:
+            raise muse.Error_FileNotFound("Cannot open file {}".format(filename))
+        with fd:
+            try:
+                magic, order = fd.readline().split()
+                if magic != cls._magic:
+                    raise ValueError("not a Markov model")
+                model = cls(int(order))
+                words = fd.readline().split()
+                if words[:1] != ["states"]:
+                    raise ValueError("missing states")
+                for word in words[1:]:
+                    model.addState(*cls._parseState(word))
+                for line in fd:
+                    if line.strip() == '':
+                        continue
+                    context, row = line.split('>')
+                    context = tuple(int(n) for n in context.split())
+                    if len(context) != model.order:
+                        raise ValueError("context {} is not of order {}".format(context, model.order))
+                    for item in row.split():
+                        n, weight = item.split(':')
+                        model.addTransition(context, int(n), muse._float(weight))
+            except (ValueError, TypeError) as e:
+                raise Error_InvalidModel("{}: {}".format(filename, e))
+        for context, row in model.counts.items():
+            if max(context + tuple(row)) >= len(model.states):
+                raise Error_InvalidModel("{}: no state {}".format(filename, max(context + tuple(row))))
+        return model
+
+    @classmethod
+    def _stateString(cls, state):
+        degree, duration = state
+        if degree == None:
+            degree = cls._rest
+        return "{}:{}".format(degree, muse._numberString(duration))
+
+    @classmethod
+    def _parseState(cls, s):
+        degree, duration = s.split(':')
+        if degree == cls._rest:
+            degree = None
+        else:
+            degree = int(degree)
+        return (degree, muse._float(duration))
+
+    def __repr__(self):
+        return "MarkovModel(order {}, {} states, {} contexts)".format(self.order, len(self.states),
+                                                                     len(self.counts))
+
+@muse.registerAlgorithm
+class MAMarkov(muse.MelodyAlgorithm):
+    """Order-k Markov chain melodies over (scale degree, duration) states, from the
+    model file named by 'markovModel' in the configuration (see MarkovModel), or a
+    stepwise model (with rhythms from 'durationWeights', if given) if none is given.  Each degree is played as the nearest note of
+    that degree to the previous note within keyNoteMin..keyNoteMax of the key."""
+    _models = {}                # filename : MarkovModel, shared by all instances
+
+    def __init__(self):
+        self.model = None
+        self.context = None
+        self._index = None
+        super().__init__(None)
+
+    def setConfig(self, config):
+        super().setConfig(config)
+        self._numDegrees = len(self.key.getNotes())
+        self._minDegree = self.key.getScaleDegree(self.keyNoteMin)
+        self._index = None
+        filename = config.get('markovModel', None)
+        if filename == None:
+            if self.durationWeights != None:
+                durations = list(zip(self.durationWeights.getItems(), self.durationWeights.getWeights()))
+            else:
+                durations = [(d, w) for d, w in ((1/8, 2), (1/4, 2), (1/2, 1))
+                             if self.shortestNote <= d <= self.longestNote]
+            if len(durations) == 0:
+                durations = [(self.shortestNote, 1)]
+            self.model = MarkovModel.stepwise(self._numDegrees, durations)
+        else:
+            model = MAMarkov._models.get(filename, None)
+            if model == None:
+                model = MarkovModel.load(filename)
+                MAMarkov._models[filename] = model
+            self.model = model
+        self.context = None
+
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self.context = None
+        self._index = None
+
+    def getNextNote(self):
+        transitions, contexts, start = self.model.getTables()
+        sampler = transitions.get(self.context, None)
+        if sampler == None:
+            # Start, or a context which never led anywhere in training: restart the chain
+            self.context = contexts[start.sample(rng = self.random)]
+            sampler = transitions[self.context]
+        state = sampler.sample(rng = self.random)
+        self.context = self.context[1:] + (state,)
+        degree, duration = self.model.states[state]
+        if degree == None:
+            return pypond.Rest(duration)
+        note = self.getNoteByDegree(degree)
+        note.setDuration(duration)
+        return note
+
+    def getDurations(self):
+        return list({duration for degree, duration in self.model.getStates()})
+
+    def getNoteByDegree(self, degree):
+        """Return (a copy of) the note of scale degree 'degree' in the range table
+        nearest to the previous one"""
+        table = self.getRangeTable()
+        if self._index == None:
+            self._index = len(table)//2
+        numDegrees = self._numDegrees
+        offset = (degree - self._minDegree - self._index) % numDegrees
+        up = self._index + offset
+        down = up - numDegrees
+        if down < 0 or (up < len(table) and offset <= numDegrees - offset):
+            index = up
+        else:
+            index = down
+        if index >= len(table):         # The range is narrower than an octave
+            index = len(table) - 1
+        self._index = index
+        return table[index].clone()
+
+class Error_InvalidModel(Exception):
+    pass
+
+def _testMarkov(argv):
+    USAGE = "python3 {} <model.mkv> [order] [numNotes]".format(argv[0])
+    if len(argv) < 2:
+        print(USAGE)
+        return
+    order = 1
+    numNotes = 32
+    if len(argv) > 2:
+        order = int(argv[2])
+    if len(argv) > 3:
+        numNotes = int(argv[3])
+    # Train a model of the given order on the default stepwise model's output, then save it
+    algorithm = MAMarkov()
+    algorithm.setConfig(muse.Configuration('*'))
+    notes = [algorithm.getNextNote() for n in range(16*numNotes)]
+    model = MarkovModel(order)
+    model.trainNotes(notes, algorithm.key)
+    model.save(argv[1])
+    print(MarkovModel.load(argv[1]))
+    algorithm.model = model
+    print(' '.join(algorithm.getNextNote().asLily() for n in range(numNotes)))
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testMarkov(argv)
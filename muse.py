@@ -4,16 +4,41 @@
 An algorithmic pseudo-random melody generator using pypond.py
 """
 
-import configparser
+import fractions
+import hashlib
+import importlib, importlib.util
+import itertools
+import os
+import pickle
 import re
 import pypond, theory
 import random
 import circular
+import rhythm
+import debug
 
 import math
 
-DEBUG = True
-LOGFILE = None
+class _LazyModule(object):
+    """Stands in for module 'name' until an attribute is first read, then imports it
+    and rebinds muse.<name> to the real module.  Keeps optional heavy imports (numpy
+    takes longer to import than everything else the composer needs) off the start-up
+    path of the runs which never use them."""
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        if globals().get(self._name, None) is self:
+            globals()[self._name] = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self._name)
+
+# numpy is optional: None if it is not installed, so 'numpy == None' needs no import
+numpy = _LazyModule('numpy') if importlib.util.find_spec('numpy') != None else None
+
 FILENAME = "muse.py"
 
 # This is a wacky forward declaration temporary fix 
@@ -28,9 +53,125 @@ def _float(s):
     if '/' in s:
         r = _eval(s)
         return r
-    return r
+    raise ValueError("could not convert {!r} to float".format(s))
+
+def spawnSeed(seed, *path):
+    """Derive a child seed from 'seed' and a spawn 'path', e.g. spawnSeed(seed, 2) for
+    voice 2 of a piece, or spawnSeed(seed, 5, 2) for voice 2 of the 5th piece of a batch.
+    Like numpy's SeedSequence.spawn(): every (seed, path) gives its own independent
+    stream, and the same (seed, path) always gives the same one."""
+    digest = hashlib.sha256(repr((seed,) + path).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+def newSeed():
+    """Return a fresh seed from the OS entropy pool"""
+    return random.SystemRandom().getrandbits(63)
+
+def _pathParser(s):
+    """Parse an optional filename ('None' or empty for none)"""
+    if s == None:
+        return None
+    s = s.strip()
+    if s == '' or s.lower() == 'none':
+        return None
+    return s
+
+def _boolParser(s):
+    """Parse a yes/no setting (True/False, yes/no, on/off, 1/0)"""
+    if isinstance(s, bool):
+        return s
+    return s.strip().lower() in ('true', 'yes', 'on', '1')
+
+def _number(s):
+    """Parse an int if possible, otherwise a float (or fraction, e.g. '1/8')"""
+    try:
+        return int(s)
+    except ValueError:
+        return _float(s)
+
+def _weightsParser(s):
+    """Parse an optional cfg.ini weight list (see WeightedSampler.fromString())"""
+    if s == None or isinstance(s, WeightedSampler):
+        return s
+    if s.strip() == '' or s.strip().lower() == 'none':
+        return None
+    return WeightedSampler.fromString(s)
+
+def _durationWeightsParser(s):
+    """Parse an optional cfg.ini weight list of durations, each of which must fall on
+    a tick grid (a sum of powers of two of a whole note, so no triplets)"""
+    sampler = _weightsParser(s)
+    if sampler != None:
+        for duration in sampler.getItems():
+            if duration <= 0 or rhythm.toTicks(duration, rhythm.gridResolution(duration)) == None:
+                raise Error_InvalidConfig("durationWeights item {} is not a duration on a tick grid "
+                                          "(a sum of powers of two of a whole note)".format(duration))
+    return sampler
+
+def _seedParser(s):
+    """Parse a seed (an integer, or 'None'/empty for a fresh seed per run)"""
+    if s == None or isinstance(s, int):
+        return s
+    s = s.strip()
+    if s == '' or s.lower() == 'none':
+        return None
+    return int(s, 0)
+
+# The melody algorithms by lowercase name.  A value is either the class, or a
+# 'module:Class' string naming an algorithm whose module is imported the first time
+# the algorithm is asked for (see getAlgorithm()), so selecting one algorithm never
+# pays for importing the others.
+_Algorithms = {
+    'mamarkov'      : "markov:MAMarkov",
+    'maconstraint'  : "constraint:MAConstraint",
+    'magrammar'     : "grammar:MAGrammar",
+    'mangram'       : "ngram:MANgram",
+}
+
+def registerAlgorithm(cls = None, name = None):
+    """Class decorator adding a MelodyAlgorithm to the registry under 'name' (default
+    the class name; matched case-insensitively), as @registerAlgorithm or
+    @registerAlgorithm(name = "...").  Modules named by 'module:Class' in the
+    configuration can register their algorithms the same way."""
+    def register(cls):
+        _Algorithms[(name or cls.__name__).lower()] = cls
+        return cls
+    if cls == None:
+        return register
+    return register(cls)
+
+def getAlgorithm(name):
+    """Return the MelodyAlgorithm class registered as 'name', or loaded from 'module:Class',
+    or None if there is no such algorithm.  Modules are only imported on first use and
+    the classes found are cached in the registry."""
+    key = name.strip()
+    cls = _Algorithms.get(key.lower(), None)
+    if cls == None:
+        if ':' not in key:
+            return None
+        spec = key
+    elif isinstance(cls, str):
+        spec = cls
+    else:
+        return cls
+    moduleName, sep, className = spec.partition(':')
+    try:
+        cls = getattr(importlib.import_module(moduleName.strip()), className.strip())
+    except (ImportError, AttributeError) as e:
+        _dbg("Cannot load melody algorithm {}: {}", spec, e)
+        return None
+    if not (isinstance(cls, type) and issubclass(cls, MelodyAlgorithm)):
+        return None
+    _Algorithms[key.lower()] = cls
+    return cls
+
+def getAlgorithmNames():
+    """Return the registered algorithm names, loaded or not"""
+    return sorted(_Algorithms)
 
 class MelodyAlgorithm(object):
+    _rangeTables = {}           # (key, keyNoteMin, keyNoteMax) : notes in range; see getRangeTable()
+
     def __init__(self, configuration = None):
         # Most/all of these get overwritten by a valid configuration.
         # These provide defaults in case the configuration doesn't
@@ -44,6 +185,10 @@ class MelodyAlgorithm(object):
         # rint*(2**(maxDur - minDur))
         self.lengthRange = (2**(-x) for x in (self.minDurationPwr2, self.maxDurationPwr2))
         self.lastNote = None
+        self._rangeTable = None
+        self.config = None
+        self.homeKey = None         # The configured key, which plantSeed() goes back to
+        self.plantSeed(None)
         if configuration != None:
             self.setConfig(configuration)
 
@@ -54,24 +199,29 @@ class MelodyAlgorithm(object):
         noteHighest = config.get('noteHighest', None)
         if noteHighest != None:
             self.maxPitch = noteHighest.getMIDIByte()
-        _dbg("self.minPitch = {}; = {}".format(self.minPitch, self.maxPitch))
+        _dbg("self.minPitch = {}; self.maxPitch = {}", self.minPitch, self.maxPitch)
         self.density = config.get('density', None)
         if self.density == None:
             self.density = 1.0
         #print("self.density = {}".format(self.density))
+        if config is not self.config:
+            self.homeKey = config.get('key')
         self.key = config.get('key')
         self.keyNoteMin = config.get('keyNoteMin')
         self.keyNoteMax = config.get('keyNoteMax')
         self.numRange = self.key.getNumNotesInRange(self.keyNoteMin, self.keyNoteMax)
-        print("keyNoteMin = {}; keyNoteMax = {}; self.numRange = {}".format(
-            self.keyNoteMin, self.keyNoteMax, self.numRange))
+        _dbg("keyNoteMin = {}; keyNoteMax = {}; self.numRange = {}", self.keyNoteMin, self.keyNoteMax, self.numRange)
         self.notesInRange = self.key.getNumNotesInRange(self.keyNoteMin, self.keyNoteMax)
         self.shortestNote = config.get('shortestNote')
         self.longestNote = config.get('longestNote')
         self.minDurationPwr2 = config._invLog2(self.shortestNote)
         self.maxDurationPwr2 = config._invLog2(self.longestNote)
         self.diatonicity = config.get('diatonicity')
+        self.durationWeights = config.get('durationWeights', None)
+        self.degreeWeights = config.get('degreeWeights', None)
         self.config = config
+        self._rangeTable = None
+        self._pitchSampler = None
 
     def reloadConfig(self):
         self.setConfig(self.config)
@@ -82,9 +232,17 @@ class MelodyAlgorithm(object):
 
     def getNoteInKey(self, n):
         """Get a note within the key by a float from 0 to 1, which will be
-        quantized to key notes within self.keyNoteMin and self.keyNoteMax"""
+        quantized to key notes within self.keyNoteMin and self.keyNoteMax
+        (weighted by scale degree if the configuration has 'degreeWeights')"""
+        table = self.getRangeTable()
+        if self.degreeWeights != None and 0 <= n < 1:
+            return table[self.getPitchSampler().choose(n)].clone()
         index = int(n*self.notesInRange)
-        return self.key.getNoteInRange(self.keyNoteMin, self.keyNoteMax, index)
+        if index < 0:
+            index = 0
+        elif index >= len(table):
+            index = len(table) - 1
+        return table[index].clone()
         """
         nint = int(n*self.numRange)
         minScaleDegree = self.key.getScaleDegree(self.keyNoteMin)
@@ -98,6 +256,71 @@ class MelodyAlgorithm(object):
         return note
         """
 
+    def getRangeTable(self):
+        """Return a tuple of the notes of self.key from self.keyNoteMin to self.keyNoteMax.
+        The tables are built once per (key, range) and shared by all algorithms; treat
+        the notes as read-only (clone them)."""
+        if self._rangeTable != None:
+            return self._rangeTable
+        tableKey = (str(self.key), str(self.keyNoteMin), str(self.keyNoteMax))
+        table = MelodyAlgorithm._rangeTables.get(tableKey, None)
+        if table == None:
+            table = tuple(self.key.getNoteInRange(self.keyNoteMin, self.keyNoteMax, index)
+                          for index in range(self.notesInRange))
+            MelodyAlgorithm._rangeTables[tableKey] = table
+        self._rangeTable = table            # Until the next setConfig()
+        return table
+
+    def getPitchSampler(self):
+        """Return a WeightedSampler of indices into the range table, each weighted by
+        the 'degreeWeights' weight of its (zero-indexed) scale degree"""
+        if self._pitchSampler == None:
+            table = self.getRangeTable()
+            numDegrees = len(self.key.getNotes())
+            minDegree = self.key.getScaleDegree(self.keyNoteMin)
+            weights = [self.degreeWeights.getWeight((minDegree + n) % numDegrees) for n in range(len(table))]
+            try:
+                self._pitchSampler = WeightedSampler(weights)
+            except ValueError:
+                raise Error_InvalidConfig("degreeWeights {} leave no notes between {} and {}".format(
+                                          self.degreeWeights, self.keyNoteMin, self.keyNoteMax))
+        return self._pitchSampler
+
+    def drawDuration(self):
+        """Draw a duration from 'durationWeights' if configured, otherwise a whole number
+        (at least one) of shortestNotes up to longestNote, all equally likely"""
+        if self.durationWeights != None:
+            return self.durationWeights.sample(rng = self.random)
+        rint = self.random.randint(1, 2**(self.minDurationPwr2 - self.maxDurationPwr2))
+        return rint*(2**(-self.minDurationPwr2))
+
+    def getDurations(self):
+        """Return the durations (whole notes) the algorithm plays, or enough of them to
+        find their grid: the 'durationWeights' items, or the shortestNote unit whose
+        whole numbers drawDuration() draws"""
+        if self.durationWeights != None:
+            return list(self.durationWeights.getItems())
+        return [2**(-self.minDurationPwr2)]
+
+    def getResolution(self):
+        """Return the resolution (ticks per whole note, see rhythm.py) which puts every
+        one of getDurations() on the tick grid, at least the configuration's.  Raises
+        Error_InvalidConfig if one cannot be (e.g. a triplet, 1/12)."""
+        durations = self.getDurations()
+        resolution = max(self.config.getResolution(), rhythm.gridResolution(*durations))
+        for duration in durations:
+            if rhythm.toTicks(duration, resolution) == None:
+                raise Error_InvalidConfig("Duration {} does not fit a tick grid (a sum of powers of two "
+                                          "of a whole note)".format(duration))
+        return resolution
+
+    def _drawDurations(self, count, rng):
+        """As drawDuration(), but a list of 'count' durations drawn with numpy Generator 'rng'"""
+        if self.durationWeights != None:
+            return self.durationWeights.sample(count, rng)
+        rints = rng.integers(1, 2**(self.minDurationPwr2 - self.maxDurationPwr2) + 1, count)
+        return (rints*(2**(-self.minDurationPwr2))).tolist()
+
     def changeParameters(self, changeDict):
         """Change parameters based on those of the changeDict object."""
         for key, value in changeDict.items():
@@ -105,12 +328,34 @@ class MelodyAlgorithm(object):
                 setattr(self, key, value)
 
     def plantSeed(self, seed):
-        """Seed any pseudo-random number generation."""
-        pass
+        """Seed any pseudo-random number generation.  Every algorithm draws from its
+        own random.Random, self.random, so the same seed reproduces the same notes
+        (None seeds from the OS entropy pool).  Also goes back to the configured key,
+        in the configuration too, so a key change from the last piece carries over to
+        neither the notes nor the next score.Score."""
+        self.seed = seed
+        self.random = random.Random(seed)
+        if self.config != None and self.key is not self.homeKey:
+            self.changeKey(self.homeKey)        # Don't start in the last piece's key
+
+    def getSeed(self):
+        return self.seed
 
     def getNextNote(self):
         pass
 
+    def getNextNotes(self, count, keys = None):
+        """Return a list of the next 'count' notes, the same notes as 'count' calls to
+        getNextNote().  If 'keys' is a list, the key the algorithm was in when it chose
+        each note is appended to it.  Algorithms which can draw many notes cheaply
+        override this."""
+        notes = []
+        for n in range(count):
+            notes.append(self.getNextNote())
+            if keys != None:
+                keys.append(getattr(self, 'key', None))
+        return notes
+
     def setNextNote(self):
         pass
 
@@ -119,6 +364,7 @@ class MelodyAlgorithm(object):
         note = self.getNextNote()
         return note.asLily()
 
+@registerAlgorithm
 class MAFixed(MelodyAlgorithm):
     #pattern = [1, 1/8, 1/2, 1/8 + 1/4, 1/16 + 1/2, 1/8, 1/16 + 1/8, 1/2, 1/4, 1, 1/2 + 1/4 + 1/16] 
     pattern = [1, 1, 1]
@@ -135,64 +381,253 @@ class MAFixed(MelodyAlgorithm):
         return pypond.Note('C4', dur)
 
 
+@registerAlgorithm
 class MARandom(MelodyAlgorithm):
+    blockSize = 4096            # Notes' worth of random numbers drawn at a time with numpy;
+                                # <= 1 (or no numpy) for one at a time
+
     def __init__(self):
+        self._block = iter(())
+        self._rng = None
         super().__init__(None)
 
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self._block = iter(())      # Don't use up numbers drawn from the old seed
+        self._rng = None
+
     def getNextNote(self):
+        if self.blockSize <= 1 or numpy == None:
+            return self.getNextNoteScalar()
+        try:
+            isRest, changeKey, nFourths, duration, pitch = next(self._block)
+        except StopIteration:
+            self._block = self._drawBlock(self.blockSize)
+            isRest, changeKey, nFourths, duration, pitch = next(self._block)
+        if changeKey:
+            self.changeKey(self.key.getNewByFourths(nFourths))
+        if isRest:
+            return pypond.Rest(duration)
+        note = self.getNoteInKey(pitch)
+        note.setDuration(duration)
+        return note
+
+    def getNextNotes(self, count, keys = None):
+        if self.blockSize <= 1 or numpy == None:
+            return super().getNextNotes(count, keys)
+        notes = []
+        while len(notes) < count:
+            start = len(notes)
+            for isRest, changeKey, nFourths, duration, pitch in itertools.islice(self._block, count - start):
+                if changeKey:
+                    self.changeKey(self.key.getNewByFourths(nFourths))
+                if isRest:
+                    note = pypond.Rest(duration)
+                else:
+                    note = self.getNoteInKey(pitch)
+                    note.setDuration(duration)
+                notes.append(note)
+                if keys != None:
+                    keys.append(self.key)
+            if len(notes) == start:
+                self._block = self._drawBlock(self.blockSize)
+        return notes
+
+    def _drawBlock(self, count):
+        """Draw the random numbers for the next 'count' notes at once with a numpy
+        Generator (seeded from self.random) and return an iterator of
+        (isRest, changeKey, nFourths, duration, pitch) per note, distributed exactly as
+        in getNextNoteScalar()."""
+        if self._rng == None:
+            self._rng = numpy.random.default_rng(self.random.getrandbits(64))
+        rng = self._rng
+        isRest = rng.random(count) > self.density
+        changeKey = numpy.abs(2*rng.random(count) - 1) >= self.diatonicity
+        nFourths = (12*(2*rng.random(count) - 1)).astype(int)  # Truncates toward 0, like int()
+        durations = self._drawDurations(count, rng)
+        pitches = rng.random(count)
+        # Lists, so each note reads Python scalars rather than indexing numpy arrays
+        return zip(isRest.tolist(), changeKey.tolist(), nFourths.tolist(), durations,
+                   pitches.tolist())
+
+    def getNextNoteScalar(self):
         isRest = False
         # Decide if rest or note
-        if random.random() > self.density:
+        if self.random.random() > self.density:
             isRest = True
         # Decide if we change key
-        r = 2*random.random() - 1 # A random number between -1 and +1
+        r = 2*self.random.random() - 1 # A random number between -1 and +1
         if abs(r) >= self.diatonicity:
             # Change key
-            r = 2*random.random() - 1 # Another random number
+            r = 2*self.random.random() - 1 # Another random number
             nFourths = int(12*r)
             newKey = self.key.getNewByFourths(nFourths)
             #print("Changing keys: {} -> {}".format(self.key, newKey))
             self.changeKey(newKey)
         # Get the next duration
-        rint = random.randint(1, 2**(self.minDurationPwr2 - self.maxDurationPwr2))
-        duration = rint*(2**(self.maxDurationPwr2 - self.minDurationPwr2))
+        duration = self.drawDuration()
         if isRest:
             rest = pypond.Rest(duration)
             return rest
         else:
             # Get a random pitch
-            note = self.getNoteInKey(random.random())
+            note = self.getNoteInKey(self.random.random())
             note.setDuration(duration)
             return note
 
+@registerAlgorithm
 class MAGaussMeander(MelodyAlgorithm):
+    """A random walk in pitch.  Each step is Gaussian with a standard deviation of
+    self.sigma of the range, and the walk is reflected back off noteLowest and
+    noteHighest rather than clamped to them.  With 'meanderInKey' in the configuration,
+    every pitch is snapped to the nearest note of the key."""
+    sigma = 0.1                 # Step standard deviation, as a fraction of the range
+    blockSize = 4096            # Steps drawn at a time with numpy; <= 1 (or no numpy) for one at a time
+    _pitchNotes = {}            # MIDI pitch : Note; see getPitchNote()
+
     def __init__(self):
+        self.position = None    # Where the walk is, in (fractional) MIDI pitch
+        self._block = iter(())
+        self._rng = None
+        self._snapTable = None
         super().__init__(None)
 
+    def setConfig(self, config):
+        super().setConfig(config)
+        self.inKey = config.get('meanderInKey', False)
+        self._snapTable = None
+        self._block = iter(())      # Drawn for the old range
+
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self.position = None
+        self._block = iter(())
+        self._rng = None
+
     def getNextNote(self):
-        mu = 0
-        sigma = 0.1
-        if self.lastNote == None:
-            lastpitch = (self.maxPitch + self.minPitch)//2
+        if self.blockSize <= 1 or numpy == None:
+            return self.getNextNoteScalar()
+        try:
+            position, duration = next(self._block)
+        except StopIteration:
+            self._block = self._drawBlock(self.blockSize)
+            position, duration = next(self._block)
+        return self._newNote(position, duration)
+
+    def getNextNotes(self, count, keys = None):
+        if self.blockSize <= 1 or numpy == None:
+            return super().getNextNotes(count, keys)
+        notes = []
+        while len(notes) < count:
+            steps = list(itertools.islice(self._block, count - len(notes)))
+            if len(steps) == 0:
+                self._block = self._drawBlock(self.blockSize)
+                continue
+            # The per-note work of _newNote(), with the lookups hoisted out of the loop
+            low, high = self._getBounds()
+            if self.inKey:
+                table = self.getRangeTable()
+                snap = self.getSnapTable()
+                for position, duration in steps:
+                    note = table[snap[int(round(position)) - low]].clone()
+                    note.setDuration(duration)
+                    notes.append(note)
+            else:
+                pitchNote = self.getPitchNote
+                for position, duration in steps:
+                    note = pitchNote(int(round(position))).clone()
+                    note.setDuration(duration)
+                    notes.append(note)
+            self.position = steps[-1][0]
+        if notes:
+            self.lastNote = notes[-1]
+        if keys != None:
+            keys.extend([getattr(self, 'key', None)]*len(notes))    # The walk never changes key
+        return notes
+
+    def getNextNoteScalar(self):
+        low, high = self._getBounds()
+        step = self.random.gauss(0, self.sigma*(high - low))
+        position = self._reflect(self._getPosition() + step, low, high)
+        return self._newNote(position, self.drawDuration())
+
+    def _drawBlock(self, count):
+        """Walk 'count' steps at once with a numpy Generator (seeded from self.random)
+        and return an iterator of (position, duration) per note.  Folding the free walk
+        into the range is the same as reflecting it step by step, since the steps
+        are symmetric."""
+        low, high = self._getBounds()
+        if self._rng == None:
+            self._rng = numpy.random.default_rng(self.random.getrandbits(64))
+        rng = self._rng
+        walk = self._getPosition() + numpy.cumsum(rng.normal(0, self.sigma*(high - low), count))
+        if high > low:
+            span = 2*(high - low)
+            walk = numpy.mod(walk - low, span)
+            walk = low + numpy.where(walk > high - low, span - walk, walk)
+        else:
+            walk[:] = low
+        return zip(walk.tolist(), self._drawDurations(count, rng))
+
+    def _newNote(self, position, duration):
+        self.position = position
+        pitch = int(round(position))
+        if self.inKey:
+            low, high = self._getBounds()
+            note = self.getRangeTable()[self.getSnapTable()[pitch - low]].clone()
         else:
-            lastpitch = self.lastNote.getMIDIByte()
-        pitch = lastpitch + int(self.boundedGauss(mu, sigma)*(self.maxPitch - self.minPitch))
-        #print("lastpitch = {}; pitch = {}".format(lastpitch, pitch))
-        rint = random.randint(0, 2**(self.minDurationPwr2 - self.maxDurationPwr2))
-        duration = rint*(2**(self.maxDurationPwr2 - self.minDurationPwr2))
-        note = pypond.Note.fromMIDIByte(pitch, duration = duration)
-        #note.setDuration(duration)
+            note = self.getPitchNote(pitch).clone()
+        note.setDuration(duration)
         self.lastNote = note
         return note
 
-    def boundedGauss(self, mu, sigma):
-        n = random.gauss(mu, sigma)
-        if n < -1:
-            n = -1
-        elif n > 1:
-            n = 1
-        #print("gauss = {}".format(n))
-        return n
+    def getPitchNote(self, pitch):
+        """Return the note of MIDI pitch 'pitch' from a table shared by all instances;
+        treat it as read-only (clone it)"""
+        note = MAGaussMeander._pitchNotes.get(pitch, None)
+        if note == None:
+            note = pypond.Note.fromMIDIByte(pitch)
+            MAGaussMeander._pitchNotes[pitch] = note
+        return note
+
+    def _getBounds(self):
+        return (min(self.minPitch, self.maxPitch), max(self.minPitch, self.maxPitch))
+
+    def _getPosition(self):
+        if self.position == None:
+            low, high = self._getBounds()
+            self.position = (low + high)/2
+        return self.position
+
+    @staticmethod
+    def _reflect(x, low, high):
+        """Fold 'x' back into [low, high] as if reflected off the bounds"""
+        if high <= low:
+            return low
+        span = 2*(high - low)
+        y = (x - low) % span
+        if y > high - low:
+            y = span - y
+        return low + y
+
+    def getSnapTable(self):
+        """Return a tuple of the index in the range table (see getRangeTable()) of the
+        nearest note of the key to each MIDI pitch from minPitch to maxPitch"""
+        if self._snapTable == None:
+            low, high = self._getBounds()
+            pitches = [note.getMIDIByte() for note in self.getRangeTable()]
+            self._snapTable = tuple(min(range(len(pitches)), key = lambda n: abs(pitches[n] - pitch))
+                                    for pitch in range(low, high + 1))
+        return self._snapTable
+
+def _numberString(x):
+    """Write a duration or weight compactly and exactly, e.g. 0.1875 as 3/16"""
+    if x == int(x):
+        return str(int(x))
+    fraction = fractions.Fraction(x).limit_denominator(1 << 16)
+    if float(fraction) == x:
+        return str(fraction)
+    return repr(x)
 
 def _getIntervalsModal(intervals, scaleDegree):
     l = len(intervals)
@@ -257,6 +692,7 @@ class _KeyQuality(object):
 
 
 class Key(object):
+    _qualities = _KeyQuality        # For theory.py, which does not import muse
     _intervalsMajor = circular.Circular((0, 2, 4, 5, 7, 9, 11)) # wwhwwwh
     _intervalsMinor = circular.Circular((0, 2, 3, 5, 6, 8, 10)) # Aeolian
     _intervalsDWH   = circular.Circular((0, 2, 3, 5, 6, 8, 9, 11))
@@ -464,10 +900,10 @@ class Key(object):
         """Get a note within the key between 'noteMin' and 'noteMax' by index
         'index' which can range from 0 to self.getNumNotesInRange(noteMin, noteMax)."""
         if index <= 0:
-            return noteMin
+            return noteMin.copy()
         nmax = self.getNumNotesInRange(noteMin, noteMax)
         if index > nmax - 1:
-            return noteMax
+            return noteMax.copy()
         iv = self.getIntervals()
         minsd = self.getScaleDegree(noteMin)
         stepsTotal = 0
@@ -665,7 +1101,7 @@ class _TimeSignature(object):
                 majorBeat = 4
             return self.newFromArgs(beatsPerMeasure, majorBeat)
 
-    def newFromArgs(self, beatsPerMeasure, majorBeat):
+    def newFromArgs(self, beatsPerMeasure, majorBeat, groups = None):
         try:
             self.beatsPerMeasure = int(beatsPerMeasure)
             self.majorBeat = int(majorBeat)
@@ -673,15 +1109,46 @@ class _TimeSignature(object):
             raise Error_IntegerParse("Cannot parse one of {} or {} as int".format(
                                      beatsPerMeasure, majorBeat))
             return False
+        self.explicitGroups = groups != None
+        if groups == None:
+            groups = self._defaultGroups(self.beatsPerMeasure, self.majorBeat)
+        self.groups = groups
         return True
 
     def newFromString(self, s):
+        """E.g. '6/8' or, with explicit beat groups, '2+2+3/8'"""
         if '/' in s:
             delim = '/'
         elif '\\' in s:
             delim = '\\'
         beatsPerMeasure, majorBeat = s.split(delim)
-        return self.newFromArgs(beatsPerMeasure, majorBeat)
+        groups = None
+        if '+' in beatsPerMeasure:
+            try:
+                groups = tuple(int(group) for group in beatsPerMeasure.split('+'))
+            except ValueError:
+                raise Error_IntegerParse("Cannot parse beat groups {} as ints".format(beatsPerMeasure))
+            beatsPerMeasure = sum(groups)
+        return self.newFromArgs(beatsPerMeasure, majorBeat, groups)
+
+    @staticmethod
+    def _defaultGroups(beatsPerMeasure, majorBeat):
+        """Return the beat groups (a tuple of group lengths in major beats) of a time
+        signature, or None if the measure is a single group with a binary hierarchy.
+            2/4, 4/4, 2/2, 4/8, ...     None
+            3/4, 5/4, 3/2               1 + 1 + ...         (simple meters: the beat)
+            6/8, 9/8, 12/16             3 + 3 + ...         (compound meters)
+            5/8, 7/8, 11/8              2 + ... + 2 + 3     (irregular meters)
+        """
+        if beatsPerMeasure & (beatsPerMeasure - 1) == 0:
+            return None
+        if majorBeat < 8:
+            return (1,)*beatsPerMeasure
+        if beatsPerMeasure % 3 == 0:
+            return (3,)*(beatsPerMeasure//3)
+        if beatsPerMeasure % 2:
+            return (2,)*(beatsPerMeasure//2 - 1) + (3,)
+        return (2,)*(beatsPerMeasure//2)
 
     def getBeatsPerMeasure(self):
         return self.beatsPerMeasure
@@ -692,42 +1159,51 @@ class _TimeSignature(object):
     def getMeasureDuration(self):
         return self.beatsPerMeasure/self.majorBeat
 
+    def getBeatGroups(self):
+        """Return the beat (and beam) groups as a tuple of lengths in major beats,
+        e.g. (2, 2, 3) for 7/8; or None for a single binary group (e.g. 4/4)"""
+        return self.groups
+
+    def getGroupDurations(self):
+        """As getBeatGroups(), in whole notes, e.g. (0.25, 0.25, 0.375) for 7/8"""
+        if self.groups == None:
+            return None
+        return tuple(group/self.majorBeat for group in self.groups)
+
+    def isIrregular(self):
+        """True if the beat groups are not all the same length (e.g. 7/8 = 2+2+3)"""
+        return self.groups != None and len(set(self.groups)) > 1
+
     def asLily(self):
-        """Return the time signature string in GNU Lilypond syntax"""
-        # Currently the same as __str__(), but may change in the future
+        """Return the time signature string in GNU Lilypond syntax.  Groupings lilypond
+        wouldn't guess (explicit or irregular) are given as a beat structure,
+        e.g. '2,2,3 7/8'"""
+        if self.explicitGroups or self.isIrregular():
+            return "{} {}/{}".format(','.join(str(group) for group in self.groups),
+                                     self.getBeatsPerMeasure(), self.getMajorBeat())
         return "{}/{}".format(self.getBeatsPerMeasure(), self.getMajorBeat())
 
     def __repr__(self):
         return self.__str__()
 
     def __str__(self):
+        if self.explicitGroups:
+            return "{}/{}".format('+'.join(str(group) for group in self.groups), self.getMajorBeat())
         return "{}/{}".format(self.getBeatsPerMeasure(), self.getMajorBeat())
 
 
 def _AlgorithmParser(algorithm):
-    """Parse the string 'algorithm' and match it to a Python class which
-    inherits from MelodyAlgorithm; returning an instance of the class or
-    None if no match is found."""
-    # TODO. Consider using importlib.import_module('userlib') for a dynamic import of a user library
-    # in 'userlib.py' and using getattr(importlib.import_module('userlib'), 'someClass') to try to
-    # get the class from the user library without importing the whole library
-    # For now, we'll just use the globals() dict
-    #print("_AlgorithmParser looking for {}".format(algorithm))
-    for item in globals().items():
-        #print(item[0])
-        if algorithm.lower() == item[0].lower():    # If 'algorithm' matches any item in globals (non case sensitive)
-            #print("name match: {} = {}".format(algorithm, item[0]))
-            cls = item[1]       # Then let's see if it's a subclass of MelodyAlgorithm
-            if issubclass(cls, MelodyAlgorithm):    # If it is,
-                #print("Is subclass!")
-                return cls()                        # Return an instance of the class
-            #else:
-            #    print("... is not subclass")
-    return None                                     # if no match is found, return None
+    """Parse the string 'algorithm' (a registered name, or 'module:Class') and return
+    an instance of the MelodyAlgorithm it names, or None if there is no such algorithm."""
+    cls = getAlgorithm(algorithm)
+    if cls == None:
+        print("No melody algorithm {}".format(algorithm))
+        return None
+    return cls()
 
 def _clefParser(*args, **kwargs):
     """Wrapper function. Namespace hell."""
-    theory.TheoryClass._clefParser(*args, **kwargs)
+    return theory.TheoryClass._clefParser(*args, **kwargs)
 
 class Configuration(object):
     _FilenameForceDefaults = '*'
@@ -741,11 +1217,35 @@ class Configuration(object):
         'timeSignature'     : (_TimeSignature, "4/4"),
         'algorithm'         : (_AlgorithmParser, "MARandom"),
         'numMeasures'       : (int, 8),
+        'voices'            : (int, 1),
+        'seed'              : (_seedParser, None),
+        'markovModel'       : (_pathParser, None),
+        'grammar'           : (_pathParser, None),
+        'ngramModel'        : (_pathParser, None),
+        'meanderInKey'      : (_boolParser, "False"),
+        'durationWeights'   : (_durationWeightsParser, None),   # e.g. 1/16:1 1/8:2 3/8:1
+        'degreeWeights'     : (_weightsParser, None),   # e.g. 0:3 2:2 4:2 1:1 3:1 5:1 6:1
+        'maxLeap'           : (int, 4),     # MAConstraint rules: in steps of the key,
+        'maxRepeats'        : (int, 2),     # notes in a row,
+        'phraseMeasures'    : (int, 4),     # and measures per phrase (ending on the tonic)
         'density'           : (_float, 1.0),
         'shortestNote'      : (_float, 1/64),
         'longestNote'       : (_float, 1),
         'diatonicity'       : (_float, 1)
     }
+    # A snapshot of the parsed configuration is pickled next to each .ini (cfg.ini ->
+    # cfg.ini.pickle) and loaded instead of parsing it again while the .ini is unchanged.
+    # A plain text line ahead of the pickle says which .ini it was made from, and is
+    # checked first, so a stale or foreign snapshot is never unpickled.  Still, only use
+    # snapshots in directories you trust: unpickling can run code.
+    snapshots = True
+    _snapshotExt = ".pickle"
+    _snapshotVersion = 2        # Bump when the parsed values change shape
+    # Settings whose parsed values are never changed in place, so Configurations can share
+    # them; see shareParsedValues()
+    _sharedNames = frozenset(('clef', 'noteLowest', 'noteHighest', 'key', 'timeSignature',
+                              'durationWeights', 'degreeWeights'))
+    _shared = None              # (name, text) : parsed value, while sharing
     def __init__(self, filename = None):
         self.filename = filename
         if filename != None:
@@ -753,8 +1253,7 @@ class Configuration(object):
                 items = self.useDefaults()
             else:
                 items = self.readIni()
-            _dbg("{} read {} items; used defaults for {} items".format(
-                  self.__str__(), items[0], items[1]))
+            _dbg("{} read {} items; used defaults for {} items", self, items[0], items[1])
         else:
             _dbg("{} uninitialized.  Call self.readIni(filename) or \
                   self.useDefaults() before using.")
@@ -762,12 +1261,134 @@ class Configuration(object):
     def readIni(self, filename = None):
         if filename == None:
             filename = self.filename
+        if self.snapshots:
+            items = self.loadSnapshot(filename)
+            if items != None:
+                return items
+        import configparser             # Only a cfg without a current snapshot is parsed
         config = configparser.ConfigParser()
         t = config.read(filename)
         if len(t) == 0:
             raise Error_FileNotFound("Cannot open file {}".format(filename))
             return False
-        return self._populateConfig(config)
+        items = self._populateConfig(config)
+        if self.snapshots:
+            self.saveSnapshot(filename, items)
+        return items
+
+    @classmethod
+    def fromStrings(cls, values, name = None):
+        """Return a Configuration of the settings in dict 'values' ({name : text}, as in
+        the [DEFAULT] section of a cfg), with the defaults for the rest"""
+        config = cls()
+        config.filename = name or "--STRINGS--"
+        config._populateConfig({"DEFAULT": values})
+        return config
+
+    @classmethod
+    def shareParsedValues(cls, share = True):
+        """Parse each distinct text of the settings in _sharedNames (the key, range, time
+        signature and weights) once, and derive each key range once, for every
+        Configuration made from now on (until shareParsedValues(False)), which then
+        share the parsed objects.  For batches of many configurations which differ in a
+        few settings; the shared values must not be changed in place."""
+        if share:
+            if cls._shared == None:
+                Configuration._shared = {}
+        else:
+            Configuration._shared = None
+
+    def clone(self):
+        """Return a copy of the configuration with its own settings (so changeKey() on
+        one leaves the other alone) and its own algorithm instance, without parsing
+        anything again"""
+        other = Configuration()
+        other.filename = self.filename
+        other.config = dict(self.config)
+        other._configStrings = dict(self._configStrings)
+        other.config['algorithm'] = self._ConfigCalls['algorithm'][0](self._configStrings['algorithm'])
+        return other
+
+    def __getstate__(self):
+        """Pickle without the algorithm instance (it holds a generator); it is made anew
+        from its name when unpickled"""
+        state = dict(self.__dict__)
+        if state.get('config', None) != None:
+            state['config'] = dict(state['config'])
+            state['config']['algorithm'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.__dict__.get('config', None) != None:
+            self.config['algorithm'] = self._ConfigCalls['algorithm'][0](self._configStrings['algorithm'])
+
+    def _getSnapshotStamp(self, filename):
+        """Return what a snapshot of .ini 'filename' is valid for, as the line which
+        heads the snapshot (bytes): the version, a hash of the settings and their
+        defaults, the .ini's mtime, size and sha256, or None if it cannot be read"""
+        try:
+            stat = os.stat(filename)
+            with open(filename, 'rb') as fd:
+                text = fd.read()
+        except OSError:
+            return None
+        schema = repr(sorted((name, repr(default)) for name, (parser, default) in self._ConfigCalls.items()))
+        return "muse-snapshot {} {} {} {} {}\n".format(self._snapshotVersion,
+               hashlib.sha256(schema.encode()).hexdigest(), stat.st_mtime_ns, stat.st_size,
+               hashlib.sha256(text).hexdigest()).encode('ascii')
+
+    def loadSnapshot(self, filename):
+        """Load the snapshot of .ini 'filename' if it is still valid (same version,
+        settings, modification time, size and hash) and return (userCount,
+        defaultCount) as _populateConfig(), otherwise None.  Its header line is
+        compared before anything is unpickled.  The algorithm is not pickled but made
+        anew from its name."""
+        stamp = self._getSnapshotStamp(filename)
+        if stamp == None:
+            return None
+        try:
+            with open(filename + self._snapshotExt, 'rb') as fd:
+                if fd.readline(len(stamp)) != stamp:    # Before unpickling anything
+                    _dbg("Snapshot of {} is stale", filename)
+                    return None
+                snapshot = pickle.load(fd)
+        except OSError:
+            return None
+        except Exception as e:             # Corrupt, or pickled by code which has since changed
+            _dbg("Ignoring snapshot of {}: {}", filename, e)
+            return None
+        if not isinstance(snapshot, tuple) or len(snapshot) != 3:
+            _dbg("Ignoring snapshot of {}: not a configuration", filename)
+            return None
+        self.config, self._configStrings, items = snapshot
+        self.config['algorithm'] = self._ConfigCalls['algorithm'][0](self._configStrings['algorithm'])
+        return items
+
+    def saveSnapshot(self, filename, items):
+        """Pickle the parsed configuration of .ini 'filename' next to it, if the
+        directory is writable.  Written to a temporary file and renamed, so processes
+        starting together never read half a snapshot."""
+        stamp = self._getSnapshotStamp(filename)
+        if stamp == None:
+            return False
+        config = dict(self.config)
+        del config['algorithm']             # An instance with state; rebuilt on loading
+        target = filename + self._snapshotExt
+        temp = "{}.{}.tmp".format(target, os.getpid())
+        try:
+            with open(temp, 'wb') as fd:
+                fd.write(stamp)
+                pickle.dump((config, self._configStrings, items), fd, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, target)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            _dbg("Cannot save snapshot of {}: {}", filename, e)
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return False
+        return True
 
     def _populateConfig(self, config):
         """Add items from INI config dict to self.config using the callables in
@@ -782,6 +1403,7 @@ class Configuration(object):
         defaultCount = 0
         if len(config) > 0:
             config = config["DEFAULT"]
+        shared = Configuration._shared
         for item in self._ConfigCalls.items():
             val = config.get(item[0], None)     # Check for a value in the user config
             if val == None:
@@ -789,8 +1411,15 @@ class Configuration(object):
                 defaultCount += 1
             else:
                 userCount += 1
-            self.config[item[0]] = item[1][0](val)  # Add to self.config using the corresponding callable
-            _dbg("config({}) = {}".format(item[0], val))
+            if shared != None and item[0] in self._sharedNames:
+                value = shared.get((item[0], val), None)
+                if value == None:
+                    value = item[1][0](val)
+                    shared[(item[0], val)] = value
+                self.config[item[0]] = value
+            else:
+                self.config[item[0]] = item[1][0](val)  # Add to self.config using the corresponding callable
+            _dbg("config({}) = {}", item[0], val)
             self._configStrings[item[0]] = val      # Add the string name to self._configStrings
         # = =  Add derived quantities = = 
         self.addDerivedQuantities()
@@ -799,9 +1428,18 @@ class Configuration(object):
     def addDerivedQuantities(self):
         noteMin = self.config.get('noteLowest')
         noteMax = self.config.get('noteHighest')
-        _dbg("noteMin = {}; noteMax = {}".format(noteMin, noteMax))
+        _dbg("noteMin = {}; noteMax = {}", noteMin, noteMax)
         #print("noteMin = {}; noteMax = {}".format(noteMin, noteMax))
-        keyNoteMin, keyNoteMax = self.getKeyNoteRange(noteMin, noteMax)
+        shared = Configuration._shared
+        if shared == None:
+            keyNoteMin, keyNoteMax = self.getKeyNoteRange(noteMin, noteMax)
+        else:
+            rangeKey = ('keyNoteRange', str(self.config.get('key')), str(noteMin), str(noteMax))
+            keyRange = shared.get(rangeKey, None)
+            if keyRange == None:
+                keyRange = self.getKeyNoteRange(noteMin, noteMax)
+                shared[rangeKey] = keyRange
+            keyNoteMin, keyNoteMax = keyRange
         self.config['keyNoteMin'] = keyNoteMin
         self.config['keyNoteMax'] = keyNoteMax
         #print("keyNoteMin = {}; keyNoteMax = {}".format(keyNoteMin, keyNoteMax))
@@ -819,11 +1457,11 @@ class Configuration(object):
 
     def getKeyNoteRange(self, noteMin, noteMax):
         key = self.config.get('key')
-        _dbg("key = {}".format(key))
+        _dbg("key = {}", key)
         mint, minlow, minhigh = key.isInKey(noteMin)
         maxt, maxlow, maxhigh = key.isInKey(noteMax)
-        _dbg("noteMin = {}; in key? {}".format(noteMin, mint))
-        _dbg("noteMax = {}; in key? {}".format(noteMax, maxt))
+        _dbg("noteMin = {}; in key? {}", noteMin, mint)
+        _dbg("noteMax = {}; in key? {}", noteMax, maxt)
         if not mint:
             noteMin = minhigh
         if not maxt:
@@ -839,6 +1477,9 @@ class Configuration(object):
     def getMeasureDuration(self):
         return self.config['timeSignature'].getMeasureDuration()
 
+    def getGroupDurations(self):
+        return self.config['timeSignature'].getGroupDurations()
+
     def get(self, key, defaultVal = None):
         if self.config == None:
             raise Error_InvalidConfig("Configuration.config = None!")
@@ -854,54 +1495,62 @@ class Configuration(object):
 
     @staticmethod
     def _invLog2(x):
+        """Return n such that 2**(-n) is the longest unit duration <= x (e.g. 4 for 1/16,
+        0 for a whole note, -1 for a breve)."""
         y = 0
-        inv = 1/x
-        while inv > 1:
-            inv /= 2
+        while 2.0**-y > x:
             y += 1
+        while 2.0**(1 - y) <= x:
+            y -= 1
         return y
 
+    def getResolution(self):
+        """Return the rhythmic resolution (ticks per whole note, see rhythm.py) needed
+        for the configured shortest note."""
+        return rhythm.getResolution(self.config.get('shortestNote', None))
+
 class Randomer():
     x0 = math.sqrt(2*math.log(2))
     def __init__(self):
         pass
 
     @staticmethod
-    def coinToss(heads = None, tails = None):
+    def coinToss(heads = None, tails = None, rng = random):
         """A custom-weighted random binary choice.  Returns True on 'heads'
         and False on 'tails'.  If 'heads' is given, 'tails' is ignored.
         'heads' + 'tails' = 1.0
+        'rng' is the random.Random to draw from (e.g. an algorithm's own)
         """
         if heads != None:
             heads = _float(heads)
             tails = 1.0 - heads
         elif tails != None:
             tails = _float(tails)
-            heads = 1.0 - heads
+            heads = 1.0 - tails
         else:
             heads = 0.5
             tails = 0.5
-        n = random.random()
+        n = rng.random()
         if n < heads:
             return True
         else:
             return False
 
     @staticmethod
-    def randArray(array):
+    def randArray(array, rng = random):
         """Select a random element of 'array' and return it. Like picking a
         card from a deck."""
-        n = random.randint(0, len(array) - 1)
+        n = rng.randint(0, len(array) - 1)
         return array[n]
 
     @classmethod
-    def boundedGauss(cls, begin, end, center = None, order = 0):
+    def boundedGauss(cls, begin, end, center = None, order = 0, rng = random):
         """This function is kinda weak right now.  'order' must be an integer
         and the probability rapidly peaks. Try something else.
         order = odd polynomial order
         If order == 0, linear function, equal probability.
         As order -> +inf, probability becomes peaked around the center."""
-        x = 2*random.random() - 1     # Rand number between -1 and 1
+        x = 2*rng.random() - 1     # Rand number between -1 and 1
         order = int((order + 1)*2 - 1)
         y = x**order                    # A weighted random number between -1 and 1
         yp = 5.5 + 4.5*y                # A weighted random number between 1 and 10
@@ -912,6 +1561,112 @@ class Randomer():
         #print("x = {:.4}\torder = {}\ty = {:.4}\tr = {:.4}".format(x, order, y, r))
         return r
 
+class WeightedSampler(object):
+    """Weighted random choice among 'items' (by default the indices of 'weights') by
+    Walker's alias method, in Vose's construction: O(n) set-up, then O(1) per draw
+    from a single uniform random number, however many items there are.  Item i is
+    drawn with probability weights[i]/sum(weights)."""
+    def __init__(self, weights, items = None):
+        size = len(weights)
+        total = sum(weights)
+        if size == 0 or total <= 0 or min(weights) < 0:
+            raise ValueError("WeightedSampler needs non-negative weights, at least one positive")
+        if items == None:
+            items = range(size)
+        if len(items) != size:
+            raise ValueError("WeightedSampler has {} items but {} weights".format(len(items), size))
+        self.items = tuple(items)
+        self.weights = tuple(weights)
+        scaled = [w*size/total for w in weights]
+        self.prob = [1.0]*size          # Leftovers keep their whole column
+        self.alias = list(range(size))
+        small = [n for n, p in enumerate(scaled) if p < 1]
+        large = [n for n, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1     # Give s's spare room to l
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+        self.size = size
+        self._arrays = None
+
+    @classmethod
+    def fromString(cls, s):
+        """Parse a cfg.ini weight list of space-separated item:weight pairs, e.g.
+        "1/16:1 1/8:2 1/4:2".  Items are ints where possible, otherwise floats."""
+        items = []
+        weights = []
+        for word in s.split():
+            item, sep, weight = word.partition(':')
+            if sep == '':
+                raise Error_InvalidConfig("Weight list item '{}' is not item:weight".format(word))
+            items.append(_number(item))
+            weights.append(_float(weight))
+        try:
+            return cls(weights, items)
+        except ValueError as e:
+            raise Error_InvalidConfig("Weight list '{}': {}".format(s, e))
+
+    def getItems(self):
+        return self.items
+
+    def getWeights(self):
+        return self.weights
+
+    def getWeight(self, item, defaultVal = 0):
+        """Return the weight of 'item', or 'defaultVal' if it is not one of the items"""
+        try:
+            return self.weights[self.items.index(item)]
+        except ValueError:
+            return defaultVal
+
+    def choose(self, u):
+        """Return the item for the uniform random number 0 <= u < 1"""
+        u *= self.size
+        n = int(u)
+        if n == self.size:              # Rounding, for u a hair under 1
+            n -= 1
+        if u - n < self.prob[n]:
+            return self.items[n]
+        return self.items[self.alias[n]]
+
+    def sample(self, k = None, rng = random):
+        """Draw an item from random.Random (or numpy Generator) 'rng', or a list of 'k'
+        items if 'k' is given.  With numpy, large batches are drawn as arrays."""
+        if k == None:
+            return self.choose(rng.random())
+        if numpy == None:
+            return [self.choose(rng.random()) for n in range(k)]
+        if not isinstance(rng, numpy.random.Generator):
+            if k < self._batchMin:
+                return [self.choose(rng.random()) for n in range(k)]
+            rng = numpy.random.default_rng(rng.getrandbits(64))
+        prob, alias = self._getArrays()
+        u = rng.random(k)*self.size
+        n = numpy.minimum(u.astype(numpy.intp), self.size - 1)
+        picks = numpy.where(u - n < prob[n], n, alias[n])
+        items = self.items
+        return [items[p] for p in picks.tolist()]
+
+    _batchMin = 64              # Smaller batches from a random.Random are drawn one at a time
+
+    def _getArrays(self):
+        if self._arrays == None:
+            self._arrays = (numpy.array(self.prob), numpy.array(self.alias, dtype = numpy.intp))
+        return self._arrays
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "WeightedSampler({})".format(' '.join("{}:{}".format(_numberString(i), _numberString(w))
+                                                     for i, w in zip(self.items, self.weights)))
+
 def _eval(s):
     """A safer version of eval, primarily for evaluating simple arithmetic expressions in
     string form."""
@@ -928,11 +1683,8 @@ class Error_InvalidConfig(Exception):
 class Error_FileNotFound(Exception):
     pass
 
-def _dbg(*args, **kwargs):
-    if DEBUG:
-        if LOGFILE != None:
-            print("[{}]\t".format(FILENAME), file = LOGFILE, end = '')
-            print(*args, **kwargs, file = LOGFILE)
+_log = debug.getLogger(FILENAME)
+_dbg = _log.dbg
 
 def _testTimeSignature(args):
     USAGE = "python3 {} <key>".format(argv[0])
@@ -947,6 +1699,8 @@ def _testTimeSignature(args):
         print(USAGE)
         return
     print("Time Signature : {}".format(timeSig))
+    print("Beat groups    : {}".format(timeSig.getBeatGroups()))
+    print("Lilypond       : {}".format(timeSig.asLily()))
 
 def _testConfiguration(args):
     USAGE = "python3 {} <configFileName.ini>".format(args[0])
@@ -0,0 +1,420 @@
+#!/usr/bin/python3
+
+"""Corpus-trained n-gram melodies.  An NgramTrainer counts the n-grams of
+(interval, duration) states in a directory of GNU Lilypond files (such as the
+Composer's own output) and saves them as a compact binary model; an NgramModel maps
+that file into memory read-only, so opening even a large model costs no parsing and
+no private memory, and every process playing it shares the same pages.  MANgram plays
+a model, and is loaded on demand by muse.getAlgorithm() when 'algorithm = MANgram'.
+
+    python3 ngram.py train <lilyDirectory> <model.ngm> [order] [resolution]
+    python3 ngram.py <model.ngm> [numNotes]
+
+A state is the interval in semitones from the previous pitch (or a rest) and a
+duration in ticks of 1/resolution whole notes.  The model file is little-endian:
+
+    header          magic, version, order, resolution, numStates, numContexts,
+                    numTransitions
+    intervals       int16 per state (_REST for a rest)
+    ticks           uint16 per state
+    keys            uint64 per context, sorted: its 'order' state indices as the
+                    digits of a base-numStates number, the oldest first
+    contextProb     float32 per context  } an alias table (see muse.WeightedSampler)
+    contextAlias    uint32 per context   } for restarting in proportion to counts
+    offsets         uint32 per context, plus one: the context's transitions
+    next            uint32 per transition: the state that follows
+    prob, alias     float32, uint32 per transition: each context's alias table
+
+Each section starts on an 8-byte boundary."""
+
+import array, bisect, mmap, os, re, struct, sys
+import muse, pypond
+
+_MAGIC = b'MUSENGRM'
+_VERSION = 1
+_HEADER = struct.Struct('<8s6I')
+_REST = -32768                  # The interval of a rest
+_SECTIONS = (                   # name, array type code, count ('states', 'contexts', ...)
+    ('intervals', 'h', 'states'),
+    ('ticks', 'H', 'states'),
+    ('keys', 'Q', 'contexts'),
+    ('contextProb', 'f', 'contexts'),
+    ('contextAlias', 'I', 'contexts'),
+    ('offsets', 'I', 'offsets'),
+    ('next', 'I', 'transitions'),
+    ('prob', 'f', 'transitions'),
+    ('alias', 'I', 'transitions'),
+)
+
+# Lilypond note names (Dutch) and the commands whose arguments are not notes
+_LILYNOTE = re.compile(r"([a-g])((?:is|es|s)*)([',]*)((?:\\breve|\\longa|\d+)?)(\.*)")
+_LILYREST = re.compile(r"[rRs]((?:\\breve|\\longa|\d+)?)(\.*)")
+_LILYSKIP = re.compile(r'%[^\n]*|"[^"]*"|\\(?:clef|key|time|version|bar)\b[^\n]*')
+_LILYPITCHES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+
+def parseLily(text, resolution = 256):
+    """Return the voices of GNU Lilypond source 'text' as lists of (pitch, ticks):
+    MIDI pitch (None for a rest) and duration in 1/resolution whole notes.  Notes tied
+    to the same pitch are merged.  Each '\\new Voice' starts a new list.  Only the plain
+    note entry the Composer writes is understood (absolute pitches, no chords)."""
+    voices = [[]]
+    duration = 1/4              # Lilypond repeats the last duration when none is given
+    tied = False
+    for token in _LILYSKIP.sub(' ', text).split():
+        tie = '~' in token          # c'8~ or with a beam or slur too, c'8[~
+        token = token.strip('[]()~')
+        if token == '\\new':
+            voices.append([])
+            tied = False
+            continue
+        if tie and token == '':
+            tied = True             # A tie apart from its note: c'4 ~ c'4
+            continue
+        match = _LILYNOTE.fullmatch(token)
+        if match != None:
+            letter, accidentals, octaves, length, dots = match.groups()
+            pitch = 12*(pypond._LILYMIDDLEOCTAVE + 1 + octaves.count("'") - octaves.count(',')) + \
+                    _LILYPITCHES[letter] + 2*accidentals.count('is') - accidentals.count('s')
+        else:
+            match = _LILYREST.fullmatch(token)
+            if match == None:
+                continue                # A command or a brace
+            length, dots = match.groups()
+            pitch = None
+        if length != '':
+            duration = _lilyDuration(length)
+        ticks = max(1, int(round(duration*(2 - 0.5**len(dots))*resolution)))
+        voice = voices[-1]
+        if tied and pitch != None and voice and voice[-1][0] == pitch:
+            voice[-1] = (pitch, voice[-1][1] + ticks)
+        else:
+            voice.append((pitch, ticks))
+        tied = tie
+    return [voice for voice in voices if voice]
+
+def _lilyDuration(length):
+    if length == '\\breve':
+        return 2
+    if length == '\\longa':
+        return 4
+    return 1/int(length)
+
+def getStates(voice):
+    """Return the (interval, ticks) states of a voice of (pitch, ticks) from
+    parseLily().  The first note has no interval, so it only sets the pitch."""
+    states = []
+    last = None
+    for pitch, ticks in voice:
+        ticks = min(ticks, 0xffff)
+        if pitch == None:
+            states.append((_REST, ticks))
+        elif last == None:
+            last = pitch
+        else:
+            states.append((pitch - last, ticks))
+            last = pitch
+    return states
+
+class NgramTrainer(object):
+    """Counts of (interval, ticks) n-grams: how often each state followed each context
+    of 'order' states"""
+    def __init__(self, order = 2, resolution = 256):
+        if order < 1:
+            raise Error_InvalidModel("An n-gram model needs order 1 or more")
+        self.order = order
+        self.resolution = resolution
+        self.states = []            # (interval, ticks)
+        self._stateIndex = {}       # (interval, ticks) : index in self.states
+        self.counts = {}            # context (tuple of state indices) : {next state : count}
+        self.numFiles = 0
+
+    def getStates(self):
+        return self.states
+
+    def addState(self, state):
+        index = self._stateIndex.get(state, None)
+        if index == None:
+            index = len(self.states)
+            self.states.append(state)
+            self._stateIndex[state] = index
+        return index
+
+    def train(self, states):
+        """Count the n-grams of a sequence of (interval, ticks) states"""
+        indices = [self.addState(state) for state in states]
+        order = self.order
+        for n in range(order, len(indices)):
+            nexts = self.counts.setdefault(tuple(indices[n - order:n]), {})
+            nexts[indices[n]] = nexts.get(indices[n], 0) + 1
+
+    def trainLily(self, text):
+        for voice in parseLily(text, self.resolution):
+            self.train(getStates(voice))
+
+    def trainDirectory(self, path):
+        """Train on every .ly file under directory 'path'; return the number of files"""
+        count = 0
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.ly'):
+                    with open(os.path.join(root, name)) as fd:
+                        self.trainLily(fd.read())
+                    count += 1
+        self.numFiles += count
+        return count
+
+    def save(self, filename):
+        """Write the model file (see the module docstring) for NgramModel"""
+        numStates = len(self.states)
+        if len(self.counts) == 0:
+            raise Error_InvalidModel("No {}-grams to save; train on longer melodies".format(self.order + 1))
+        if numStates**self.order > 2**64:
+            raise Error_InvalidModel("{} states of order {} do not fit 64-bit context keys".format(
+                                     numStates, self.order))
+        keyed = []
+        for context, nexts in self.counts.items():
+            key = 0
+            for index in context:
+                key = key*numStates + index
+            keyed.append((key, nexts))
+        keyed.sort(key = lambda item: item[0])
+        sections = {name: array.array(code) for name, code, count in _SECTIONS}
+        for interval, ticks in self.states:
+            sections['intervals'].append(interval)
+            sections['ticks'].append(ticks)
+        totals = []
+        offset = 0
+        for key, nexts in keyed:
+            sections['keys'].append(key)
+            sections['offsets'].append(offset)
+            nextStates = sorted(nexts)
+            sampler = muse.WeightedSampler([nexts[state] for state in nextStates])
+            sections['next'].extend(nextStates)
+            sections['prob'].extend(sampler.prob)
+            sections['alias'].extend(sampler.alias)
+            totals.append(sum(nexts.values()))
+            offset += len(nextStates)
+        sections['offsets'].append(offset)
+        sampler = muse.WeightedSampler(totals)
+        sections['contextProb'].extend(sampler.prob)
+        sections['contextAlias'].extend(sampler.alias)
+        if sys.byteorder != 'little':
+            for values in sections.values():
+                values.byteswap()
+        with open(filename, 'wb') as fd:
+            fd.write(_HEADER.pack(_MAGIC, _VERSION, self.order, self.resolution, numStates,
+                                  len(keyed), offset))
+            for name, code, count in _SECTIONS:
+                data = sections[name].tobytes()
+                fd.write(data + b'\0'*(-len(data) % 8))
+
+    def __repr__(self):
+        return "NgramTrainer(order {}, {} states, {} contexts, {} files)".format(
+               self.order, len(self.states), len(self.counts), self.numFiles)
+
+class NgramModel(object):
+    """A read-only model file from NgramTrainer.save(), memory-mapped: its tables are
+    memoryviews straight onto the file's pages, so opening it costs O(1) time and
+    memory and the pages are shared by every process which opens the same file.
+    Contexts are found by binary search of the sorted keys."""
+    def __init__(self, filename):
+        try:
+            fd = open(filename, 'rb')
+        except IOError:
+            raise muse.Error_FileNotFound("Cannot open file {}".format(filename))
+        with fd:
+            try:
+                self._map = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError:          # An empty file
+                raise Error_InvalidModel("{} is not an n-gram model".format(filename))
+        self.filename = filename
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise Error_InvalidModel("{} is not an n-gram model".format(filename))
+        magic, version, self.order, self.resolution, self.numStates, self.numContexts, \
+            self.numTransitions = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION:
+            self._map.close()
+            raise Error_InvalidModel("{} is not a version {} n-gram model".format(filename, _VERSION))
+        counts = {'states': self.numStates, 'contexts': self.numContexts,
+                  'offsets': self.numContexts + 1, 'transitions': self.numTransitions}
+        views = []
+        whole = memoryview(self._map)
+        offset = _HEADER.size
+        for name, code, count in _SECTIONS:
+            size = counts[count]*struct.calcsize(code)
+            if offset + size > len(self._map):
+                for view in views:
+                    view.release()
+                whole.release()
+                self._map.close()
+                raise Error_InvalidModel("{} is truncated".format(filename))
+            if sys.byteorder == 'little':
+                view = whole[offset:offset + size].cast(code)
+            else:
+                view = array.array(code, whole[offset:offset + size])     # A private copy
+                view.byteswap()
+            views.append(view)
+            setattr(self, name, view)
+            offset += size + (-size % 8)
+        self._views = views + [whole]
+        self._modulus = self.numStates**(self.order - 1)
+
+    def getOrder(self):
+        return self.order
+
+    def getResolution(self):
+        return self.resolution
+
+    def getState(self, index):
+        """Return state 'index' as (interval, ticks), interval None for a rest"""
+        interval = self.intervals[index]
+        if interval == _REST:
+            interval = None
+        return (interval, self.ticks[index])
+
+    def findContext(self, key):
+        """Return the index of the context with key 'key', or None if it never led
+        anywhere in training"""
+        n = bisect.bisect_left(self.keys, key)
+        if n < self.numContexts and self.keys[n] == key:
+            return n
+        return None
+
+    def getStartKey(self, u):
+        """Return the key of a context drawn (in proportion to its count) by the
+        uniform random number 0 <= u < 1"""
+        u *= self.numContexts
+        n = min(int(u), self.numContexts - 1)
+        if u - n >= self.contextProb[n]:
+            n = self.contextAlias[n]
+        return self.keys[n]
+
+    def getNextState(self, context, u):
+        """Return the index of the state which follows context index 'context', drawn by
+        the uniform random number 0 <= u < 1"""
+        first = self.offsets[context]
+        size = self.offsets[context + 1] - first
+        u *= size
+        n = min(int(u), size - 1)
+        if u - n >= self.prob[first + n]:
+            n = self.alias[first + n]
+        return self.next[first + n]
+
+    def shiftKey(self, key, state):
+        """Return the key of the context 'key' followed by 'state' (dropping its oldest)"""
+        return (key % self._modulus)*self.numStates + state
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __repr__(self):
+        return "NgramModel({}: order {}, {} states, {} contexts, {} transitions)".format(
+               self.filename, self.order, self.numStates, self.numContexts, self.numTransitions)
+
+@muse.registerAlgorithm
+class MANgram(muse.MelodyAlgorithm):
+    """Melodies from the n-gram model file named by 'ngramModel' in the configuration
+    (see NgramTrainer).  Intervals are played from the previous pitch, starting in the
+    middle of keyNoteMin..keyNoteMax and folded back into that range by octaves; the
+    notes are chromatic, as trained, rather than in the configured key."""
+    _models = {}                # filename : NgramModel, shared (and mapped once) by all instances
+
+    def __init__(self):
+        self.model = None
+        self._key = None
+        self._pitch = None
+        super().__init__(None)
+
+    def setConfig(self, config):
+        super().setConfig(config)
+        filename = config.get('ngramModel', None)
+        if filename == None:
+            raise muse.Error_InvalidConfig("MANgram needs an 'ngramModel' file (see ngram.py)")
+        model = MANgram._models.get(filename, None)
+        if model == None:
+            model = NgramModel(filename)
+            MANgram._models[filename] = model
+        self.model = model
+        self._minPitch = self.keyNoteMin.getMIDIByte()
+        self._maxPitch = self.keyNoteMax.getMIDIByte()
+        self._key = None
+        self._pitch = None
+
+    def plantSeed(self, seed):
+        super().plantSeed(seed)
+        self._key = None
+        self._pitch = None
+
+    def getDurations(self):
+        resolution = self.model.getResolution()
+        return [ticks/resolution for ticks in set(self.model.ticks)]
+
+    def getNextNote(self):
+        model = self.model
+        context = None
+        if self._key != None:
+            context = model.findContext(self._key)
+        if context == None:
+            # Start, or a context which never led anywhere in training: restart the chain
+            self._key = model.getStartKey(self.random.random())
+            context = model.findContext(self._key)
+        state = model.getNextState(context, self.random.random())
+        self._key = model.shiftKey(self._key, state)
+        interval, ticks = model.getState(state)
+        duration = ticks/model.getResolution()
+        if interval == None:
+            return pypond.Rest(duration)
+        if self._pitch == None:
+            self._pitch = (self._minPitch + self._maxPitch)//2
+        self._pitch = self._fold(self._pitch + interval)
+        return pypond.Note.fromMIDIByte(self._pitch, duration)
+
+    def _fold(self, pitch):
+        """Return 'pitch' moved by octaves into minPitch..maxPitch (clamped, if the
+        range is narrower than an octave)"""
+        while pitch > self._maxPitch:
+            pitch -= 12
+        while pitch < self._minPitch:
+            pitch += 12
+        return min(pitch, self._maxPitch)
+
+class Error_InvalidModel(Exception):
+    pass
+
+def _testNgram(argv):
+    USAGE = "python3 {0} train <lilyDirectory> <model.ngm> [order] [resolution]\n" \
+            "python3 {0} <model.ngm> [numNotes]".format(argv[0])
+    if len(argv) > 3 and argv[1] == 'train':
+        order = 2
+        resolution = 256
+        if len(argv) > 4:
+            order = int(argv[4])
+        if len(argv) > 5:
+            resolution = int(argv[5])
+        trainer = NgramTrainer(order, resolution)
+        trainer.trainDirectory(argv[2])
+        print(trainer)
+        trainer.save(argv[3])
+        print(NgramModel(argv[3]))
+        return
+    if len(argv) < 2:
+        print(USAGE)
+        return
+    numNotes = 32
+    if len(argv) > 2:
+        numNotes = int(argv[2])
+    config = muse.Configuration('*')
+    config.config['ngramModel'] = argv[1]
+    algorithm = MANgram()
+    algorithm.setConfig(config)
+    print(algorithm.model)
+    print(' '.join(algorithm.getNextNote().asLily() for n in range(numNotes)))
+
+if __name__ == "__main__":
+    argv = sys.argv
+    _testNgram(argv)
@@ -0,0 +1,516 @@
+#!/usr/bin/python3
+
+"""The Orchestrator: formats single measures of pypond.Notes as GNU Lilypond strings"""
+
+import muse, pypond, rhythm, timing
+
+class Orchestrator():
+    """The composer does the work of grabbing notes from the algorithm and chopping
+    them up at measure (bar) lines, but does no formatting.  The composer passes Note objects
+    (and/or Rest objects) to the Orchestrator in single-measure chunks, with each Note already
+    associated with its beat in the measure.  It is then the Orchestrator's job to format
+    the measure according to common notation standards and practice, and then hand the formatted
+    measure string back to the composer to write it to the output file (and take credit for it)."""
+    _tables = {}    # (measureDuration, resolution) : _DecompositionTable
+    def __init__(self):
+        pass
+
+    @classmethod
+    def processMeasure(cls, measure, tieLastNote = False, homeKey = None, measureDuration = None,
+                       resolution = rhythm.DEFAULT_RESOLUTION, groups = None):
+        """Single-pass algorithm: lilyTokens() walks the measure once, combining adjacent
+        rests, decomposing each note into tied basis notes and emitting the GNU Lilypond
+        tokens as it goes; the tokens are joined into the returned string.
+        'measure' is only read, never modified.
+
+        'homeKey' is the key that is in use at the top of the piece (see cfg).
+        'measureDuration' and 'resolution' (ticks per whole note) select the decomposition
+        table; if 'measureDuration' is None, the duration of the notes in 'measure' is used.
+        'groups' are the beat groups in whole notes (see muse._TimeSignature.getGroupDurations);
+        notes are split at group boundaries and beamed within groups.
+        """
+        if not isinstance(homeKey, muse.Key):
+            try:
+                homeKey = muse.Key(homeKey)
+            except Exception as e:
+                print(e)
+                homeKey = None
+        if measureDuration == None:
+            measureDuration = sum(note.getDuration() for note in measure)
+        table = cls.getTable(measureDuration, resolution, groups)
+        return ' '.join(cls.lilyTokens(measure, table, tieLastNote))
+
+    @classmethod
+    def lilyTokens(cls, measure, table = None, tieLast = False):
+        """Generator yielding the GNU Lilypond tokens of 'measure' in one pass.
+        Runs of rests are accumulated and emitted as a single (decomposed) rest;
+        each note is looked up in 'table' (a _DecompositionTable) and written as
+        its tied basis notes.  If tieLast, the last note is tied into the next measure.
+        If the table has beat groups, flagged notes within a group are explicitly beamed."""
+        if table == None:
+            table = cls.getTable(1)
+        events = cls._events(measure, table, tieLast)
+        if table.getGroups() == None:
+            for body, tie, group in events:
+                yield body + tie
+        else:
+            yield from cls._beamTokens(events)
+
+    @classmethod
+    def _events(cls, measure, table, tieLast = False):
+        """Yield (body, tie, beamGroup) for each token of 'measure', where 'body' is the
+        note and duration, 'tie' the tie string (or '') and 'beamGroup' the index of the
+        beam group of a flagged note (None if the note is not to be beamed)."""
+        restBeat = None
+        restDuration = 0
+        last = len(measure) - 1
+        for n, note in enumerate(measure):
+            if note.isRest():
+                if restDuration == 0:
+                    restBeat = note.getBeatNum()
+                restDuration += note.getDuration()
+                continue
+            if restDuration:
+                yield from cls._restEvents(restBeat, restDuration, table)
+                restDuration = 0
+            yield from cls._noteEvents(note, table, tieLast and n == last)
+        if restDuration:
+            yield from cls._restEvents(restBeat, restDuration, table)   # Rests are never tied
+
+    @staticmethod
+    def _noteEvents(note, table, tie = False):
+        beat = note.getBeatNum()
+        if beat == None:
+            durations = None
+        else:
+            durations = table.lookupLily(beat, note.getDuration())
+        if timing.enabled:
+            if durations == None:
+                timing.count('off-grid notes')
+            elif len(durations) > 1:
+                timing.count('decomposed notes')
+        if durations == None:
+            # Off the table's grid: let the note write itself
+            if tie and not note.getTie():
+                note = note.clone()
+                note.setTie(True)
+            yield (note.asLily(), '', None)
+            return
+        pitch = note.asLilyPitch()
+        lilyTie = pypond.LilySyntax.lilyTie
+        last = len(durations) - 1
+        for n, (duration, group) in enumerate(durations):
+            if n < last or tie:
+                yield (pitch + duration, lilyTie, group)
+            else:
+                yield (pitch + duration, '', group)
+
+    @staticmethod
+    def _restEvents(beat, duration, table):
+        if beat == None:
+            durations = None
+        else:
+            durations = table.lookupLily(beat, duration)
+        if durations == None:
+            rest = pypond.Rest(duration)
+            rest.setBeatNum(beat)
+            yield (rest.asLily(), '', None)
+            return
+        for duration, group in durations:
+            yield ('r' + duration, '', None)            # Rests break the beam
+
+    @staticmethod
+    def _beamTokens(events):
+        """Join runs of two or more events in the same beam group with explicit
+        beams '[' ... ']', looking ahead one event."""
+        beamOpen = False
+        previous = None
+        for event in events:
+            if previous != None:
+                body, tie, group = previous
+                if group != None and group == event[2]:
+                    yield body + ('' if beamOpen else '[') + tie
+                    beamOpen = True
+                else:
+                    yield body + (']' if beamOpen else '') + tie
+                    beamOpen = False
+            previous = event
+        if previous != None:
+            body, tie, group = previous
+            yield body + (']' if beamOpen else '') + tie
+
+    @classmethod
+    def processMeasureMultiPass(cls, measure, tieLastNote = False, measureDuration = None,
+                                resolution = rhythm.DEFAULT_RESOLUTION):
+        """The original multi-pass algorithm, kept as a reference for processMeasure():
+        1. Combine adjacent rests.
+        2. Replace notes with lists of tied notes from self.decomposeNotes
+        3. Flatten note list and join into Lilypond-formatted string.
+        'measure' (a list) is modified in place."""
+        if measureDuration == None:
+            measureDuration = sum(note.getDuration() for note in measure)
+        table = cls.getTable(measureDuration, resolution)
+        measure = cls.combineRests(measure)
+        #measure = cls.optimizeEnharmonics(measure, homeKey)
+        measure = cls.expand(measure, table)
+        return cls.stringify(measure, tieLast = tieLastNote)
+
+    @classmethod
+    def combineRests(cls, measure):
+        """Step through the list of pypond.Notes making up a measure. If the note is
+        a rest and the next note is also a rest, replace the first with a new rest
+        with a duration the sum of the two. Delete the second rest.
+        """
+        # We need a separate index which gets decremented whenever we combine/delete
+        # a rest so we can continue to combine if there are further rests.
+        m = 0
+        for n in range(len(measure)):
+            #print('n = {}; m = {}, len = {}'.format(n, m, len(measure)))
+            if  measure[m].isRest():
+                if m < len(measure) - 1:
+                    if measure[m+1].isRest():
+                        measure[m] += measure[m+1]  # Combine
+                        del measure[m+1]            # Remove 2nd note
+                        m -= 1
+            m += 1
+        return measure
+
+    @classmethod
+    def optimizeEnharmonics(cls, measure, key = None):
+        """For each note in the measure, determine the best enharmonic equivalent
+        for this particular case."""
+        if key == None:
+            # Could also try to filter out double-sharps and double-flats
+            return measure
+        for n in range(len(measure)):
+            measure[n] = key.getBestEnharmonic(measure[n])
+        return measure
+
+    @classmethod
+    def expand(cls, measure, table = None):
+        """Replace each note with a list of tied basis notes if needed, returning
+        the expanded (nested-list) measure."""
+        for n in range(len(measure)):
+            measure[n] = cls.decomposeNote(measure[n], table)
+        return measure
+
+    @classmethod
+    def stringify(cls, measure, tieLast = False):
+        """Assume measure is nested-list.  Flatten it first, then convert each note
+        in the measure to a string in GNU Lilypond format, concatenate the strings
+        in order, and return the resulting string."""
+        measure = cls._flattenList(measure, depth = 1)
+        if tieLast:
+            if hasattr(measure[-1], 'setTie'):
+                measure[-1].setTie(True)
+        for n in range(len(measure)):
+            if hasattr(measure[n], 'asLily'):
+                measure[n] = measure[n].asLily()
+            else:
+                measure[n] = ''
+        return ' '.join(measure)
+
+    @classmethod
+    def decomposeNote(cls, note, table = None):
+        """Returns a list of notes representing input 'note' decomposed into unit notes
+        (2**(-n)), possibly dotted, with beats and ties set accordingly.
+
+        The decomposition itself is looked up in a _DecompositionTable (see
+        rhythm.decompose() for the algorithm); 'table' defaults to the
+        table for a whole-note measure at 1/64 resolution.  Notes that do not fall on
+        the table's grid are returned undecomposed."""
+        alignBeat = note.getBeatNum()
+        if alignBeat == None:
+            return (note)
+        if table == None:
+            table = cls.getTable(1)
+        segments = table.lookup(alignBeat, note.getDuration())
+        if segments == None:
+            return [note]
+        notelist = []
+        for duration, dot, tie in segments:
+            newNote = note.clone()
+            newNote.setDuration(duration)
+            newNote.setDot(dot)
+            newNote.setTie(tie)
+            newNote.setBeatNum(alignBeat)
+            notelist.append(newNote)
+            if dot:
+                alignBeat += 1.5*duration
+            else:
+                alignBeat += duration
+        return notelist
+
+    @classmethod
+    def getTable(cls, measureDuration, resolution = rhythm.DEFAULT_RESOLUTION, groups = None):
+        """Return the _DecompositionTable for measures of 'measureDuration' (whole notes)
+        at 'resolution' ticks per whole note, split into beat 'groups' (whole notes),
+        building it the first time it's asked for."""
+        if groups != None:
+            groups = tuple(groups)
+        tableKey = (measureDuration, resolution, groups)
+        table = cls._tables.get(tableKey, None)
+        if timing.enabled:
+            timing.count('table cache hits' if table != None else 'table builds')
+        if table == None:
+            table = _DecompositionTable(measureDuration, resolution, groups)
+            cls._tables[tableKey] = table
+        return table
+
+    @staticmethod
+    def parseBeat(duration, resolution = rhythm.DEFAULT_RESOLUTION, longest = 1):
+        """Returns [n1, n2, n4, n8, n16, n32, n64] where nX is (either 0 or 1)
+        the number of the 'X'th unit duration in the decomposition of
+        'duration'.  The 'X'th unit duration means, e.g.:
+            2nd = 1/2 = half note
+            16th = 1/16 = sixteenth note
+            etc...
+        The window runs from unit 'longest' (e.g. 2 for a breve) down to 1/resolution.
+        """
+        return rhythm.parse(int(duration*resolution), resolution, longest)
+
+    @staticmethod
+    def _flattenList(l, depth = 1):
+        if not hasattr(l, '__len__'):
+            return l
+        n = 0
+        passes = 0
+        while True:
+            while True:
+                if hasattr(l[n], '__len__'):        # If the nth member is a list-like object
+                    todel = n
+                    for m in range(len(l[todel])):
+                        l.insert(1+todel+m, l[todel][m])
+                        n += 1
+                    del l[todel]
+                    n -= 1
+                n += 1
+                if n >= len(l):
+                    break
+            n = 0
+            passes += 1
+            if passes == depth:
+                break
+        return l
+
+    @staticmethod
+    def _setBeatNums(measure):
+        beat = 0
+        for n in range(len(measure)):
+            measure[n].setBeatNum(beat)
+            beat += measure[n].getDuration()
+        return measure
+
+    @staticmethod
+    def _printMeasure(measure, measureDuration = 1):
+        import diagnostics      # diagnostics imports composer, which imports us
+        print(diagnostics.prettyMeasure(measure, measureDuration))
+
+class _DecompositionTable(object):
+    _beamLimit = 1/4            # Notes shorter than this have flags, and so can be beamed
+
+    def __init__(self, measureDuration, resolution = rhythm.DEFAULT_RESOLUTION, groups = None):
+        """The decomposition of each (alignment beat, duration) pair that fits within a
+        measure of 'measureDuration' whole notes, on a grid of 'resolution' ticks per
+        whole note (a power of two), worked out the first time it is looked up.
+        'groups' optionally splits the measure into beat groups (durations in whole
+        notes, e.g. (1/4, 1/4, 3/8) for 7/8); notes are then split at group boundaries.
+        self.table maps the (alignTick, durationTick) pairs looked up so far to a tuple of
+        (duration, dot, tie) segments with 'duration' in whole notes; self.lily maps the
+        same keys to the segments' (GNU Lilypond duration string, beam group) pairs.
+        A measure has O(measureTicks**2) pairs, but a piece only uses a few of them."""
+        self.resolution = resolution
+        self.measureTicks = int(round(measureDuration*resolution))
+        self.groups = groups
+        self.bounds = None          # [(startTick, endTick), ...] of each beat group
+        self.groupOf = None         # Index into self.bounds of the group of each tick
+        if groups != None:
+            self.bounds = []
+            start = 0
+            for group in groups:
+                end = start + int(round(group*resolution))
+                self.bounds.append((start, end))
+                start = end
+            self.groupOf = tuple(n for n, (start, end) in enumerate(self.bounds)
+                                 for tick in range(start, end))
+        self.table = {}
+        self.lily = {}
+
+    def getGroups(self):
+        return self.groups
+
+    def lookup(self, alignBeat, duration):
+        """Return the segments for a note of 'duration' starting at 'alignBeat' (both in
+        whole notes), or None if the note is not on this table's grid."""
+        alignTick = alignBeat*self.resolution
+        durationTick = duration*self.resolution
+        if alignTick % 1 or durationTick % 1:
+            return None
+        key = (int(alignTick), int(durationTick))
+        segments = self.table.get(key, None)
+        if segments == None and self._fill(key):
+            segments = self.table[key]
+        return segments
+
+    def lookupLily(self, alignBeat, duration):
+        """As lookup(), but return a tuple of (GNU Lilypond duration string, beam group)
+        pairs, e.g. ('4.', None) or ('16', 2), for the segments; every segment but the last
+        is tied to the next.  The beam group is None unless the segment can be beamed."""
+        alignTick = alignBeat*self.resolution
+        durationTick = duration*self.resolution
+        key = (int(alignTick), int(durationTick))
+        durations = self.lily.get(key, None)
+        if durations == None:
+            if alignTick % 1 or durationTick % 1 or not self._fill(key):
+                return None
+            return self.lily[key]
+        if alignTick % 1 or durationTick % 1:
+            return None
+        return durations
+
+    def _fill(self, key):
+        """Decompose the note (alignTick, durationTick) = 'key' into self.table and
+        self.lily.  Returns False if it does not fit in the measure."""
+        alignTick, durationTick = key
+        if not (0 <= alignTick < self.measureTicks and 0 < durationTick <= self.measureTicks - alignTick):
+            return False
+        segments = self.decompose(alignTick, durationTick)
+        self.table[key] = segments
+        self.lily[key] = self._lilySegments(alignTick, segments)
+        return True
+
+    def decompose(self, alignTick, durationTick):
+        """Returns a tuple of (duration, dot, tie) segments (see rhythm.decompose)"""
+        if self.groups == None:
+            segments = rhythm.decompose(alignTick, durationTick, self.resolution)
+        else:
+            segments = self._decomposeGroups(alignTick, durationTick)
+        last = len(segments) - 1
+        return tuple((unit/self.resolution, dot, n < last) for n, (unit, dot) in enumerate(segments))
+
+    def _decomposeGroups(self, alignTick, durationTick):
+        """Split the note at beat group boundaries and decompose each piece aligned to the
+        start of its group.  A note covering whole groups is written as one unit (possibly
+        dotted) where it can be, e.g. a dotted half note filling a measure of 6/8."""
+        res = self.resolution
+        segments = []
+        tick = alignTick
+        end = alignTick + durationTick
+        while tick < end:
+            n = self.groupOf[tick]
+            start, stop = self.bounds[n]
+            if tick != start or stop > end:
+                # Part of a group.  One that runs to the end of the group is written as a
+                # single unit if it can be, e.g. the quarter note of 'c8 c4' in 6/8.
+                piece = rhythm.decompose(tick - start, min(stop, end) - tick, res)
+                if stop <= end and len(piece) > 1:
+                    whole = rhythm.decompose(0, stop - tick, res)
+                    if len(whole) == 1:
+                        piece = whole
+                segments += piece
+                tick = min(stop, end)
+                continue
+            last = n
+            while last + 1 < len(self.bounds) and self.bounds[last + 1][1] <= end:
+                last += 1
+            for m in range(last, n, -1):
+                merged = rhythm.decompose(0, self.bounds[m][1] - tick, res)
+                if len(merged) == 1:
+                    stop = self.bounds[m][1]
+                    break
+            else:
+                merged = rhythm.decompose(0, stop - tick, res)
+            segments += merged
+            tick = stop
+        return segments
+
+    def _lilySegments(self, alignTick, segments):
+        """Returns a tuple of (Lilypond duration string, beam group) for the segments of
+        a note starting at 'alignTick'"""
+        lily = []
+        tick = alignTick
+        for duration, dot, tie in segments:
+            group = None
+            if self.groups != None and duration < self._beamLimit:
+                group = self.groupOf[tick]
+            lily.append((rhythm.lilyDuration(duration) + (pypond.LilySyntax.lilyDot if dot else ''), group))
+            tick += int(round(duration*(1.5 if dot else 1)*self.resolution))
+        return tuple(lily)
+
+def _testOrchestratorDecomposeNote(args):
+    USAGE = "python3 {} <noteDuration> [beat]".format(args[0])
+    if len(args) > 1:
+        duration = eval(args[1])
+    else:
+        print(USAGE)
+        return
+    if len(args) > 2:
+        beat = eval(args[2])
+    else:
+        beat = 0
+    note = pypond.Note("C4", duration)
+    note.setBeatNum(beat)
+    noteList = Orchestrator.decomposeNote(note)
+    print("Name\tBeat\tDuration")
+    for note in noteList:
+        print("{}\t{:.4f}\t{:.4f}".format(note.getNoteName(), note.getBeatNum(), note.getDuration()))
+    return
+
+def _testOrchestratorCombineRests(args):
+    USAGE = "python3 {}".format(args[0])
+    testMeasure = [None]*6
+    for n in range(len(testMeasure)):
+        testMeasure[n] = pypond.Rest(1/8)
+    testMeasure[3] = pypond.Note("C4")
+    testMeasure[3].setDuration(1/8 + 1/4)
+    def setBeatNums(measure):
+        beat = 0
+        for n in range(len(measure)):
+            measure[n].setBeatNum(beat)
+            beat += measure[n].getDuration()
+        return measure
+    testMeasure = setBeatNums(testMeasure)
+    def printMeasure(measure):
+        print("Note\tBeat\tDuration")
+        for note in measure:
+            print("{}\t{:.4f}\t{:.4f}".format(note.getNoteName(),
+                  note.getBeatNum(), note.getDuration()))
+    printMeasure(testMeasure)
+    testMeasure = Orchestrator.combineRests(testMeasure)
+    printMeasure(testMeasure)
+    return
+
+def _testOrchestratorFlattenList(args):
+    l = [0, 1, 2, [3, [4, 5], 6, 7], 8, 9, [10, 11], [12]]
+    print(l)
+    l = Orchestrator._flattenList(l,2)
+    print(l)
+    return
+
+def _testOrchestratorStringify(args):
+    measure = [pypond.Note('C4', 1/4), [pypond.Rest(1/8), pypond.Rest(1/4)],
+               pypond.Note('Eb3', 1/2)]
+    lilystring = Orchestrator.stringify(measure, tieLast = True)
+    print(lilystring)
+
+def _testOrchestratorProcessMeasure(args):
+    USAGE = "python3 {} <lilyNote> ...".format(args[0])
+    if len(args) > 1:
+        measure = []
+        for arg in args[1:]:
+            measure.append(pypond.Note.fromLily(arg))
+        measure = Orchestrator._setBeatNums(measure)
+        Orchestrator._printMeasure(measure)
+        lilystring = Orchestrator.processMeasure(measure)
+        print(lilystring)
+    else:
+        print(USAGE)
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testOrchestratorDecomposeNote(argv)
+    #_testOrchestratorCombineRests(argv)
+    #_testOrchestratorFlattenList(argv)
+    #_testOrchestratorStringify(argv)
+    #_testOrchestratorProcessMeasure(argv)
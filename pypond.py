@@ -13,9 +13,9 @@
 import sys
 import circular
 import re
+import rhythm
+import debug
 
-DEBUG = True
-LOGFILE = None
 FILENAME = "pypond.py"
 
 _LILYFLAT = 'es'
@@ -80,6 +80,8 @@ class LilySyntax():
     kwTimeSignature = "\\time"
     kwKeyMajor = "\\major"
     kwKeyMinor = "\\minor"
+    kwNewVoice = "\\new Voice"
+    kwVoices = ("\\voiceOne", "\\voiceTwo", "\\voiceThree", "\\voiceFour")
     headerString = '\\version "2.20.0"\n{\n  '
     footerString = '\n  \\bar "|."\n}'
     lilyTie = "~ "
@@ -150,7 +152,7 @@ class Note(object):
         if duration != None:
             self.setDuration(duration)
         if not self.checkValid():
-            _dbg("Warning!  This Note object is no good: {}".format(self.__repr__()))
+            _log.warning("This Note object is no good: {!r}", self)
         #self.noteString = self.getNoteLetter() + self.getAccidentalString() + str(self.getOctave())
         #print("__init__ : self = {}".format(self))
 
@@ -259,7 +261,7 @@ class Note(object):
 
         On the first pass (LS-to-MS), we don't need to worry about dotting notes."""
         # Hmmm... didn't seem to get it right.  Poke further into this
-        _dbg("  -   -   -   -   -   -   -   - alignBeat = {}".format(alignBeat))
+        _dbg("  -   -   -   -   -   -   -   - alignBeat = {}", alignBeat)
         if alignBeat == None:
             alignBeat = self.getBeatNum()
             if alignBeat == None:
@@ -268,8 +270,8 @@ class Note(object):
             return ""
         duration = self.duration        # Need a shallow copy since we'll be modifying this
         nBeats = self.parseBeatLength(alignBeat)
-        _dbg("parsed beat = {}{}{}{}{}{}{}".format(*nBeats))
-        _dbg("old duration = {}".format(duration))
+        _dbg("parsed beat = {}{}{}{}{}{}{}", *nBeats)
+        _dbg("old duration = {}", duration)
         ll = []
         tieSymbol = ""
         for n in range(len(nBeats)):    # Walk the beat parse
@@ -282,8 +284,9 @@ class Note(object):
                     tieSymbol = self._lilyTie
                     alignBeat += ddur   # Give that duration to the alignBeat
                     nBeats = self.parseBeatLength(alignBeat)    # then parse the beat again
-        _dbg("After walk up: {}".format("".join(ll)))
-        _dbg("new duration = {}".format(duration))
+        if _log.debugEnabled:
+            _dbg("After walk up: {}", "".join(ll))
+        _dbg("new duration = {}", duration)
         # Now we walk down the parsed remainder of the note duration
         nNotes = self.parseBeatLength(duration)
         candot = False                  # Note dotting
@@ -299,17 +302,14 @@ class Note(object):
                     tieSymbol = self._lilyTie # Once the first symbol has been added to lily list, set the tie symbol
             else:
                 candot = False      # The next note cannot be a dot
-        _dbg("After walk down: {}".format("".join(ll)))
+        if _log.debugEnabled:
+            _dbg("After walk down: {}", "".join(ll))
         return "".join(ll)
 
     def _isBasisDuration(self):
-        """Returns True if the note is a basis note (whole, half, quarter, eighth, 1/16, 1/32, 1/64)
+        """Returns True if the note is a basis note (longa, breve, whole, half, quarter, ...)
         Returns False if the note is a combination of basis notes."""
-        invdur = 1/self.getDurationNoDot()
-        if invdur % 1 > 0:
-            return False
-        else:
-            return True
+        return rhythm.isUnitDuration(self.getDurationNoDot())
 
     @staticmethod
     def _invLog2(x):
@@ -342,42 +342,43 @@ class Note(object):
         if self.duration == None:
             return ""
         if self._isBasisDuration():
-            return int(1/self.getDurationNoDot())
+            return rhythm.lilyDuration(self.getDurationNoDot())
         length = self.duration # non-reciprocal units
-        nNotes = self.parseBeatLength(length)
-        nNotes = [x for x in nNotes]    # Need to convert tuple to a list to modify contents
+        resolution = rhythm.gridResolution(length, alignBeat)
+        longest = rhythm.LONGA
+        nNotes = self.parseBeatLength(length, resolution, longest)   # nNotes[n] is a unit of longest/2**n
         #print("1: {}\n1/2: {}\n1/4: {}\n1/8: {}\n1/16: {}\n1/32: {}\n1/64: {}".format(
         #      nNotes[0], nNotes[1], nNotes[2], nNotes[3], nNotes[4], nNotes[5], nNotes[6]))
         ll = []
         candot = False
         tieSymbol = ""                  # This will be populated later (this hack is to work around the dotted note)
         if alignBeat != None:           # If we're considering the alignment beat,
-            nBeats = self.parseBeatLength(alignBeat)    # Parse the alignment beat count
+            nBeats = self.parseBeatLength(alignBeat, resolution, longest)    # Parse the alignment beat count
             shortestBeat = 0
             for n in range(len(nBeats)):    # Find the shortest non-zero beat duration
                 if nBeats[-(n+1)] > 0:      # i.e. if we're on beat 2.5 of 4/4 (alignBeat = 1/4 + 1/4 + 1/8 = 1/2 + 1/8,
                     shortestBeat = len(nBeats) - (n + 1)    # the shortest beat is 1/8
                     if nNotes[shortestBeat] > 0:    # If the note duration includes this shortest beat, let's start with that one
-                        ll.append(str(2**shortestBeat))  # Append it to the lily list
+                        ll.append(rhythm.lilyDuration(longest/2**shortestBeat))  # Append it to the lily list
                         nNotes[shortestBeat] = 0    # Then blank it out of the loop
                         tieSymbol = self._lilyTie # Set the tie symbol for subsequent items in the list
         
-        for n in range(len(nNotes)):    # Walk through the breakdown of the note duration, starting from whole notes
+        for n in range(len(nNotes)):    # Walk through the breakdown of the note duration, starting from the longest
             if nNotes[n] > 0:           # If a duration exists,
                 if candot:              # If the last duration exists, we can dot it!
                     candot = False      # Then we turn off dotting so we don't end up with double-dots
                     ll.append('.')      # (those are silly)
                 else:
                     candot = True       # The next note can be a dot if present
-                    durationInt = 2**n  # 4 for quarter note, 8 for eighth note, etc...
-                    ll.append("{}{}".format(tieSymbol, str(durationInt)))
+                    durationString = rhythm.lilyDuration(longest/2**n)  # '4' for quarter note, '8' for eighth note, etc...
+                    ll.append("{}{}".format(tieSymbol, durationString))
                     tieSymbol = self._lilyTie # Once the first symbol has been added to lily list, set the tie symbol
             else:
                 candot = False      # The next note cannot be a dot
         return "".join(ll)
 
     @staticmethod
-    def parseBeatLength(length):
+    def parseBeatLength(length, resolution = rhythm.DEFAULT_RESOLUTION, longest = 1):
         """Parse a beat length into number of whole notes, half notes, quarter notes, etc...
         The beat length should be 1/2 or a half note, 1/4 for a quarter note (non-reciprocal
         units).
@@ -394,8 +395,11 @@ class Note(object):
         16 = 1/4 note
         32 = 1/2 note
         64 = whole note
-        Any other number is simply a combination of these."""
-        return [int(x) for x in "{:07b}".format(int(length*64))]
+        Any other number is simply a combination of these.
+
+        The window is configurable: 'resolution' sets the LS bit (1/resolution) and 'longest'
+        the MS bit (e.g. longest = 2 adds a leading nBreve).  See rhythm.parse()."""
+        return rhythm.parse(int(length*resolution), resolution, longest)
 
     def _getLilyTie(self):
         if self.getTie():
@@ -411,13 +415,18 @@ class Note(object):
 
     def asLily(self):
         """Return a string of the GNU lilypad representation of the note."""
-        n = self.getNoteName()[0].lower()
-        a = self._getLilyAccidental()
-        o = self._getLilyOctave()
         d = self._getLilyDuration()
         s = self._getLilyDot()
         t = self._getLilyTie()
-        return "{}{}{}{}{}{}".format(n, a, o, d, s, t)
+        return "{}{}{}{}".format(self.asLilyPitch(), d, s, t)
+
+    def asLilyPitch(self):
+        """Return the GNU lilypond pitch (name, accidental and octave) of the note,
+        i.e. asLily() without the duration, dot or tie."""
+        n = self.getNoteName()[0].lower()
+        a = self._getLilyAccidental()
+        o = self._getLilyOctave()
+        return "{}{}{}".format(n, a, o)
 
     def asLilyNoteName(self):
         n = self.getNoteLetter().lower()
@@ -432,15 +441,18 @@ class Note(object):
         self.beatDuration = dur
 
     def getDurationDecomposed(self, reciprocal = True):
-        nBeats = self.parseBeatLength(self.getDuration())
+        duration = self.getDuration()
+        resolution = rhythm.gridResolution(duration)
         s = []
-        for n in range(len(nBeats)):
-            if nBeats[n]:
-                m = 2**n
-                if not reciprocal:
-                    s.append("1/{}".format(m))
+        for unit in rhythm.units(int(duration*resolution)):
+            unit = unit/resolution
+            if not reciprocal:
+                if unit >= 1:
+                    s.append(str(int(unit)))
                 else:
-                    s.append(str(m))
+                    s.append("1/{}".format(int(1/unit)))
+            else:
+                s.append(rhythm.lilyDuration(unit))
         return "+".join(s)
 
     def setTempo(self, tempoBPM):
@@ -456,7 +468,7 @@ class Note(object):
             #          self.beatDuration, self.tempo))
             return None
         if duration == 0:
-            _dbg("Invalid duration {}".format(duration))
+            _dbg("Invalid duration {}", duration)
             return None
         return (1000 * 60 * self.beatDuration * duration) / self.tempo
 
@@ -594,7 +606,7 @@ class Note(object):
             _dbg("Empty notestring")
             return None
         if notestring[0].lower() not in notenames:
-            _dbg("Note name not valid: {}".format(notestring[0]))
+            _dbg("Note name not valid: {}", notestring[0])
             return None
         if len(notestring) > 1:
             n = 1
@@ -618,7 +630,7 @@ class Note(object):
             _dbg("Empty lilystring")
             return None
         if lilystring[0].lower() not in notenames:
-            _dbg("Note name not valid: {}".format(lilystring[0]))
+            _dbg("Note name not valid: {}", lilystring[0])
             return None
         if lilystring[0] == 'r':
             return 'r'
@@ -727,7 +739,7 @@ class Note(object):
                 return _DEFAULT_OCTAVE
         oct = _int(notestring[index:])
         if oct == None:
-            _dbg("Cannot interpret octave from notestring {}".format(notestring))
+            _dbg("Cannot interpret octave from notestring {}", notestring)
         return oct
 
     @classmethod
@@ -915,6 +927,13 @@ class Note(object):
         newnote.setOctave(self.getOctave())
         return newnote
 
+    def clone(self):
+        """Return a shallow copy of the note with all attributes (pitch, duration, beat,
+        tie, dot...) intact.  Much cheaper than copy() since nothing is re-parsed."""
+        newnote = self.__class__.__new__(self.__class__)
+        newnote.__dict__.update(self.__dict__)
+        return newnote
+
     def copyRhythmParams(self, note):
         """Set this note's rhythmic parameters to those of 'note'.
         These include:
@@ -1095,11 +1114,8 @@ class Rest(Note):
         """No octave index associated with a Rest"""
         return 0
 
-def _dbg(*args, **kwargs):
-    if DEBUG:
-        if LOGFILE != None:
-            print("[{}]\t".format(FILENAME), file = LOGFILE, end = '')
-            print(*args, **kwargs, file = LOGFILE)
+_log = debug.getLogger(FILENAME)
+_dbg = _log.dbg
 
 def _isDigit(c):
     if isinstance(c, int):
@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+
+"""Renderers which turn a score.Score into an output format.  Each renderer
+streams its output from the same Score, so writing several formats costs a
+single composition."""
+
+import heapq, json, struct
+import muse, pypond, theory, timing
+from orchestrator import Orchestrator
+
+class Renderer(object):
+    """Base class for all renderers.  Subclasses implement stream(), a generator
+    which yields the output in chunks (str, or bytes if 'binary' is True)."""
+    ext = None
+    binary = False
+    def __init__(self, score):
+        self.score = score
+
+    def stream(self):
+        return iter(())
+
+    def write(self, fd = None):
+        """Write the rendered score to file object 'fd'.  If 'fd' == None, print it."""
+        for chunk in self.stream():
+            if fd == None:
+                print(chunk, end = '')
+            else:
+                fd.write(chunk)
+
+    def writeFile(self, filename):
+        """Render the score to file 'filename'.  Returns True on success."""
+        if self.binary:
+            mode = 'wb'
+        else:
+            mode = 'w'
+        try:
+            fd = open(filename, mode)
+        except IOError:
+            print("Cannot open file {}".format(filename))
+            return False
+        self.write(fd)
+        fd.close()
+        return True
+
+class LilyRenderer(Renderer):
+    """Render a Score in GNU Lilypond format, one measure at a time via the Orchestrator."""
+    ext = "ly"
+    headerString = pypond.LilySyntax.headerString
+    footerString = pypond.LilySyntax.footerString
+    indent = 4*" "
+    measuresPerLine = 4
+
+    def stream(self):
+        yield self.headerString
+        yield self.getClefLily() + self.getKeyLily() + self.getTimeSignatureLily()
+        yield "\n"
+        voices = self.score.getVoices()
+        if len(voices) == 1:
+            yield from self.streamMeasures(voices[0], self.indent)
+        else:
+            # Simultaneous voices on the one staff: << \new Voice { \voiceOne ... } ... >>
+            yield "{}<<\n".format(self.indent)
+            for n, measures in enumerate(voices):
+                if n < len(pypond.LilySyntax.kwVoices):
+                    command = " " + pypond.LilySyntax.kwVoices[n]
+                else:
+                    command = ""
+                yield "{}{} {{{}\n".format(self.indent, pypond.LilySyntax.kwNewVoice, command)
+                yield from self.streamMeasures(measures, 2*self.indent)
+                yield "\n{}}}\n".format(self.indent)
+            yield "{}>>\n".format(self.indent)
+        yield "\n"
+        yield self.footerString
+
+    def streamMeasures(self, measures, indent):
+        """Yield the measures of one voice, self.measuresPerLine to a line"""
+        homeKey = self.score.getKey()
+        measureDuration = self.score.getMeasureDuration()
+        resolution = self.score.getResolution()
+        groups = self.score.getGroupDurations()
+        lineMeasureCount = 0
+        for measure in measures:
+            if timing.enabled:
+                start = timing.now()
+            lily = Orchestrator.processMeasure(measure.getNotes(), measure.getTieLast(),
+                                               homeKey = homeKey, measureDuration = measureDuration,
+                                               resolution = resolution, groups = groups)
+            if timing.enabled:
+                timing.addTime('write/orchestrate', start)
+            yield indent + lily
+            if lineMeasureCount == self.measuresPerLine - 1:
+                lineMeasureCount = 0
+                yield "{}% Measure {}\n".format(indent, measure.getNumber() + 1)
+            else:
+                lineMeasureCount += 1
+
+    def getClefLily(self):
+        """Get the clef command in GNU Lilypond format"""
+        clef = self.score.getClef()
+        if clef == None:
+            return ""
+        clefstring = theory.TheoryClass._getClefString(clef)
+        if clefstring == None:
+            return ""
+        return "{}{} {}\n".format(self.indent, pypond.LilySyntax.kwClef, clefstring)
+
+    def getKeyLily(self):
+        """Get the key signature command in GNU Lilypond format"""
+        key = self.score.getKey()
+        if key == None:
+            return ""
+        keyString = key.getKeyLily()
+        if keyString == None:
+            return ""
+        return "{}{} {}\n".format(self.indent, pypond.LilySyntax.kwKey, keyString)
+
+    def getTimeSignatureLily(self):
+        """Get the time signature command in GNU Lilypond format"""
+        time = self.score.getTimeSignature()
+        if time == None:
+            return ""
+        timeString = time.asLily()
+        if timeString == None:
+            return ""
+        return "{}{} {}\n".format(self.indent, pypond.LilySyntax.kwTimeSignature, timeString)
+
+class MIDIRenderer(Renderer):
+    """Render a Score as a single-track (format 0) Standard MIDI File, one channel
+    per voice."""
+    ext = "mid"
+    binary = True
+    ticksPerQuarter = 480
+    tempoBPM = 120
+    velocity = 80
+    channel = 0
+    drumChannel = 9
+
+    def stream(self):
+        track = b''.join(self._trackEvents())
+        yield b'MThd' + struct.pack(">LHHH", 6, 0, 1, self.ticksPerQuarter)
+        yield b'MTrk' + struct.pack(">L", len(track))
+        yield track
+
+    def _ticks(self, duration):
+        """Convert a duration in whole notes to MIDI ticks"""
+        return int(round(4*self.ticksPerQuarter*duration))
+
+    def _trackEvents(self):
+        """Yield the encoded (delta-time + event) bytes of the track in order"""
+        yield _varLen(0) + self._tempoEvent()
+        timeSignature = self.score.getTimeSignature()
+        if timeSignature != None:
+            yield _varLen(0) + self._timeSignatureEvent(timeSignature)
+        keyChanges = [(0, self.score.getKey())]
+        for measureNum, beatNum, key in self.score.getKeyChanges():
+            tick = self._ticks(measureNum*self.score.getMeasureDuration() + beatNum)
+            keyChanges.append((tick, key))
+        # Merge the key changes and the notes of every voice in time order; at the same
+        # tick, note-offs go first, then key changes, then note-ons.
+        streams = [self._keyEvents(keyChanges)]
+        for voice, measures in enumerate(self.score.getVoices()):
+            streams.append(self._noteEvents(measures, self._voiceChannel(voice)))
+        lastTick = 0
+        for tick, order, event in heapq.merge(*streams):
+            yield _varLen(tick - lastTick) + event
+            lastTick = tick
+        yield _varLen(0) + b'\xff\x2f\x00'      # End of track
+
+    _orderOff = 0
+    _orderKey = 1
+    _orderOn = 2
+
+    def _keyEvents(self, keyChanges):
+        """Yield (absoluteTick, order, event) for each key change"""
+        for tick, key in keyChanges:
+            event = self._keySignatureEvent(key)
+            if event != None:
+                yield (tick, self._orderKey, event)
+
+    def _voiceChannel(self, voice):
+        """Each voice gets its own MIDI channel, skipping the General MIDI drum channel"""
+        channel = (self.channel + voice) % 15
+        if channel >= self.drumChannel:
+            channel += 1
+        return channel
+
+    def _noteEvents(self, measures, channel = 0):
+        """Yield (absoluteTick, order, event) for all the notes of one voice.  Notes tied
+        over a barline are merged into a single MIDI note."""
+        on = 0x90 | channel
+        off = 0x80 | channel
+        tick = 0
+        pending = None              # [pitch, startTick, endTick] of a note tied into the next measure
+        for measure in measures:
+            lastIndex = len(measure) - 1
+            for n, note in enumerate(measure):
+                duration = self._ticks(note.getDuration())
+                if note.isRest():
+                    pitch = None
+                else:
+                    pitch = note.getMIDIByte()
+                if pending != None:
+                    if pending[0] == pitch:
+                        pending[2] += duration  # Continue the tied note
+                        tick += duration
+                        if not (n == lastIndex and measure.getTieLast()):
+                            yield (pending[2], self._orderOff, bytes((off, pitch, 0)))
+                            pending = None
+                        continue
+                    yield (pending[2], self._orderOff, bytes((off, pending[0], 0)))
+                    pending = None
+                if pitch != None:
+                    yield (tick, self._orderOn, bytes((on, pitch, self.velocity)))
+                    if n == lastIndex and measure.getTieLast():
+                        pending = [pitch, tick, tick + duration]
+                    else:
+                        yield (tick + duration, self._orderOff, bytes((off, pitch, 0)))
+                tick += duration
+        if pending != None:
+            yield (pending[2], self._orderOff, bytes((off, pending[0], 0)))
+
+    def _tempoEvent(self):
+        usPerQuarter = int(60000000/self.tempoBPM)
+        return b'\xff\x51\x03' + usPerQuarter.to_bytes(3, 'big')
+
+    @staticmethod
+    def _timeSignatureEvent(timeSignature):
+        denominator = timeSignature.getMajorBeat()
+        return b'\xff\x58\x04' + bytes((timeSignature.getBeatsPerMeasure(),
+                                        denominator.bit_length() - 1, 24, 8))
+
+    @staticmethod
+    def _keySignatureEvent(key):
+        """Returns the key signature meta-event for a major or minor 'key', or None
+        if the key cannot be represented by a MIDI key signature."""
+        if key == None:
+            return None
+        quality = key.getQuality()
+        if quality not in (muse._KeyQuality.major, muse._KeyQuality.minor):
+            return None
+        sharps = sum(note.getAccidental() for note in key.getNotes())
+        if abs(sharps) > 7:
+            return None
+        minor = int(quality == muse._KeyQuality.minor)
+        return b'\xff\x59\x02' + struct.pack(">bB", sharps, minor)
+
+class JSONRenderer(Renderer):
+    """Render a Score as JSON.  Pitches are note strings (None for rests), durations
+    and beat numbers are in whole notes.  The measures of all voices are listed voice
+    by voice, each marked with its voice number."""
+    ext = "json"
+
+    def stream(self):
+        score = self.score
+        header = {
+            'clef'          : theory.TheoryClass._getClefString(score.getClef()),
+            'key'           : self._str(score.getKey()),
+            'timeSignature' : self._str(score.getTimeSignature()),
+            'keyChanges'    : [[m, b, self._str(k)] for m, b, k in score.getKeyChanges()],
+            'voices'        : score.getNumVoices(),
+            'seed'          : score.getSeed(),
+        }
+        yield json.dumps(header)[:-1] + ', "measures": ['
+        sep = "\n"
+        for measures in score.getVoices():
+            for measure in measures:
+                yield sep + json.dumps(self.measureAsDict(measure))
+                sep = ",\n"
+        yield "\n]}\n"
+
+    @classmethod
+    def measureAsDict(cls, measure):
+        return {
+            'number'    : measure.getNumber(),
+            'voice'     : measure.getVoice(),
+            'tieLast'   : measure.getTieLast(),
+            'notes'     : [cls.noteAsDict(note) for note in measure],
+        }
+
+    @staticmethod
+    def noteAsDict(note):
+        if note.isRest():
+            pitch = None
+            midi = None
+        else:
+            pitch = note.getNoteString()
+            midi = note.getMIDIByte()
+        return {'pitch' : pitch, 'midi' : midi, 'duration' : note.getDuration(),
+                'beat' : note.getBeatNum()}
+
+    @staticmethod
+    def _str(item):
+        if item == None:
+            return None
+        return str(item)
+
+_Renderers = {
+    LilyRenderer.ext    : LilyRenderer,
+    MIDIRenderer.ext    : MIDIRenderer,
+    JSONRenderer.ext    : JSONRenderer,
+}
+
+def getRenderer(ext):
+    """Return the Renderer class for file extension 'ext' (e.g. 'ly', 'mid', 'json')
+    or None if there is no such renderer."""
+    return _Renderers.get(ext.lower().strip('.'), None)
+
+def _varLen(value):
+    """Encode a non-negative integer as a MIDI variable-length quantity"""
+    buf = [value & 0x7f]
+    value >>= 7
+    while value:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    return bytes(reversed(buf))
+
+def _testRender(argv):
+    USAGE = "python3 {} <configFile.ini> [ly|mid|json]".format(argv[0])
+    if len(argv) > 1:
+        import composer
+        comp = composer.Composer(argv[1], None)
+    else:
+        print(USAGE)
+        return
+    if len(argv) > 2:
+        ext = argv[2]
+    else:
+        ext = LilyRenderer.ext
+    renderer = getRenderer(ext)
+    if renderer == None:
+        print(USAGE)
+        return
+    score = comp.composeScore()
+    if renderer.binary:
+        print(b''.join(renderer(score).stream()))
+    else:
+        renderer(score).write()
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testRender(argv)
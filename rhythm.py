@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+"""Rhythm arithmetic on integer ticks.
+
+A duration (in whole notes, e.g. 0.25 for a quarter note) is represented as an integer
+number of ticks at a power-of-two 'resolution' (ticks per whole note).  Each set bit of
+the tick count is then a unit (power-of-two) duration, so decomposing a rhythm is a
+walk over set bits: the cost is logarithmic in the duration, and widening the window
+(finer resolution or longer notes) does not slow down the common case.
+
+Unit durations run from the longa (4 whole notes) down to 1/resolution."""
+
+import math
+
+DEFAULT_RESOLUTION = 64     # 1/64 notes, the historical pypond window
+BREVE = 2                   # Durations in whole notes
+LONGA = 4
+
+_MAXRESOLUTION = 1 << 20
+
+_LILYBREVE = "\\breve"
+_LILYLONGA = "\\longa"
+
+def getResolution(shortest = None):
+    """Return the resolution (ticks per whole note) needed to represent durations
+    down to 'shortest' (in whole notes).  Never less than DEFAULT_RESOLUTION."""
+    resolution = DEFAULT_RESOLUTION
+    if shortest == None or shortest <= 0:
+        return resolution
+    while resolution*shortest < 1:
+        resolution <<= 1
+    return resolution
+
+def gridResolution(*durations):
+    """Return the smallest resolution (never less than DEFAULT_RESOLUTION) that puts
+    every one of 'durations' (whole notes) on the tick grid."""
+    resolution = DEFAULT_RESOLUTION
+    for duration in durations:
+        if duration == None:
+            continue
+        while (duration*resolution) % 1 and resolution < _MAXRESOLUTION:
+            resolution <<= 1
+    return resolution
+
+def toTicks(duration, resolution = DEFAULT_RESOLUTION):
+    """Return 'duration' (whole notes) as an integer number of ticks, or None if it
+    does not fall on the grid of 'resolution'."""
+    ticks = duration*resolution
+    if ticks % 1:
+        return None
+    return int(ticks)
+
+def isUnit(ticks):
+    """True if 'ticks' is a single unit (power-of-two) duration"""
+    return ticks > 0 and not (ticks & (ticks - 1))
+
+def isUnitDuration(duration):
+    """True if 'duration' (whole notes) is a power of two, e.g. 4, 2, 1, 1/2, ... 1/1024"""
+    if duration == None or duration <= 0:
+        return False
+    return math.frexp(duration)[0] == 0.5
+
+def parse(ticks, resolution = DEFAULT_RESOLUTION, longest = 1):
+    """Returns [nLongest, ..., nWhole, nHalf, nQuarter, ..., n(1/resolution)], where each
+    nX is 0 or 1: the bits of 'ticks' from the unit 'longest' (whole notes) down to
+    1/resolution.  With the defaults this is the 7-bit [n1, n2, n4, n8, n16, n32, n64]."""
+    longestTicks = int(longest*resolution)
+    nbits = longestTicks.bit_length()
+    return [(ticks >> (nbits - 1 - n)) & 1 for n in range(nbits)]
+
+def units(ticks):
+    """Yield the unit durations (in ticks) making up 'ticks', largest first"""
+    while ticks:
+        unit = 1 << (ticks.bit_length() - 1)
+        yield unit
+        ticks ^= unit
+
+def decompose(alignTick, durationTick, resolution = DEFAULT_RESOLUTION, longest = LONGA):
+    """Decompose a note of 'durationTick' ticks starting 'alignTick' ticks into the measure
+    (or beat group) into unit durations.  Returns a list of [unitTicks, dotted] segments.
+
+    First walk from LS-to-MS through the set bits of the alignment and 'fill in the holes'
+    taking from the note duration.  Once the alignment has rounded out (or the note is too
+    short to fill the next hole), walk down MS-to-LS the set bits of the remaining duration.
+    On the second pass, a unit immediately following another dots it (once; double-dots are
+    silly).  Durations longer than the unit 'longest' are written as repeated 'longest'
+    units."""
+    longestTicks = int(longest*resolution)
+    segments = []
+    while durationTick:                         # LS-to-MS
+        hole = alignTick & -alignTick           # Lowest set bit of the alignment
+        if hole == 0 or hole > longestTicks or hole > durationTick:
+            break
+        segments.append([hole, False])          # Borrow the hole from the note
+        durationTick -= hole
+        alignTick += hole                       # and give it to the alignment
+    while durationTick > 2*longestTicks - 1:    # Too long for a single (dotted) unit
+        segments.append([longestTicks, False])
+        durationTick -= longestTicks
+    candot = False
+    last = 0
+    for unit in units(durationTick):            # MS-to-LS
+        if candot and unit == last >> 1:
+            segments[-1][1] = True
+            candot = False
+        else:
+            segments.append([unit, False])
+            candot = True
+        last = unit
+    return segments
+
+def lilyDuration(duration):
+    """Return the GNU Lilypond duration string for unit duration 'duration' (whole
+    notes), e.g. 4 -> '\\longa', 2 -> '\\breve', 1 -> '1', 0.125 -> '8'"""
+    if duration >= LONGA:
+        return _LILYLONGA
+    if duration >= BREVE:
+        return _LILYBREVE
+    return str(int(round(1/duration)))
+
+def _testDecompose(argv):
+    USAGE = "python3 {} <duration> [alignBeat] [resolution]".format(argv[0])
+    if len(argv) > 1:
+        duration = eval(argv[1])
+    else:
+        print(USAGE)
+        return
+    align = 0
+    resolution = DEFAULT_RESOLUTION
+    if len(argv) > 2:
+        align = eval(argv[2])
+    if len(argv) > 3:
+        resolution = int(argv[3])
+    segments = decompose(toTicks(align, resolution), toTicks(duration, resolution), resolution)
+    print(" ~ ".join(lilyDuration(unit/resolution) + ('.' if dot else '') for unit, dot in segments))
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testDecompose(argv)
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+"""An in-memory intermediate representation (IR) of a composed piece.
+The Composer builds a Score exactly once; any number of renderers (see render.py)
+can then read it to produce output files without composing again."""
+
+import rhythm
+
+class Measure(object):
+    def __init__(self, notes, tieLast = False, number = None, voice = 0):
+        """A single measure's worth of pypond.Notes (and/or Rests), in order, each
+        already associated with its beat number within the measure.
+        tieLast = True if the last note is tied over the barline to the first note
+                  of the next measure.
+        number  = the (zero-indexed) position of the measure within the piece.
+        voice   = the (zero-indexed) voice the measure belongs to."""
+        self.notes = tuple(notes)
+        self.tieLast = tieLast
+        self.number = number
+        self.voice = voice
+
+    def getNotes(self):
+        return self.notes
+
+    def getTieLast(self):
+        return self.tieLast
+
+    def getNumber(self):
+        return self.number
+
+    def getVoice(self):
+        return self.voice
+
+    def getDuration(self):
+        """Return the total duration of the notes in the measure"""
+        return sum(note.getDuration() for note in self.notes)
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __iter__(self):
+        yield from self.notes
+
+    def __getitem__(self, index):
+        return self.notes[index]
+
+    def __repr__(self):
+        return "Measure({}, {}, voice {})".format(self.number, list(self.notes), self.voice)
+
+class Score(object):
+    def __init__(self, clef = None, key = None, timeSignature = None, resolution = None):
+        """clef            = clef encoding (see theory.TheoryClass._clefParser)
+        key             = muse.Key in use at the top of the piece
+        timeSignature   = muse._TimeSignature
+        resolution      = ticks per whole note needed for the shortest note (see rhythm.py)"""
+        self.clef = clef
+        self.key = key
+        self.timeSignature = timeSignature
+        if resolution == None:
+            resolution = rhythm.DEFAULT_RESOLUTION
+        self.resolution = resolution
+        self.seed = None            # The seed the piece was composed with, if known
+        self.measures = []          # The measures and key changes of the first voice
+        self.keyChanges = []
+        self.voices = [self.measures]
+        self.voiceKeyChanges = [self.keyChanges]
+
+    @classmethod
+    def fromConfig(cls, config, resolution = None):
+        """Create an empty Score with the clef, key and time signature of a
+        muse.Configuration, and its resolution unless 'resolution' is given"""
+        if resolution == None:
+            resolution = config.getResolution()
+        return cls(config.get('clef', None), config.get('key', None),
+                   config.get('timeSignature', None), resolution)
+
+    def getClef(self):
+        return self.clef
+
+    def getKey(self):
+        return self.key
+
+    def getTimeSignature(self):
+        return self.timeSignature
+
+    def getResolution(self):
+        return self.resolution
+
+    def getSeed(self):
+        return self.seed
+
+    def setSeed(self, seed):
+        self.seed = seed
+
+    def getMeasureDuration(self):
+        if self.timeSignature == None:
+            return 1
+        return self.timeSignature.getMeasureDuration()
+
+    def getGroupDurations(self):
+        """Beat groups of the time signature in whole notes, or None (see muse._TimeSignature)"""
+        if self.timeSignature == None:
+            return None
+        return self.timeSignature.getGroupDurations()
+
+    def getMeasures(self, voice = 0):
+        return self.voices[voice]
+
+    def getNumMeasures(self):
+        return len(self.measures)
+
+    def addMeasure(self, notes, tieLast = False, voice = 0):
+        """Append a measure of notes to the end of 'voice' and return the new Measure"""
+        measures = self.voices[voice]
+        measure = Measure(notes, tieLast, len(measures), voice)
+        measures.append(measure)
+        return measure
+
+    def getKeyChanges(self, voice = 0):
+        """Returns a list of (measureNum, beatNum, key) in order of appearance"""
+        return self.voiceKeyChanges[voice]
+
+    def addKeyChange(self, measureNum, beatNum, key, voice = 0):
+        """Record that 'key' is in effect from beat 'beatNum' of measure 'measureNum'"""
+        self.voiceKeyChanges[voice].append((measureNum, beatNum, key))
+
+    def getNumVoices(self):
+        return len(self.voices)
+
+    def getVoices(self):
+        """Returns a list of the Measures of each voice"""
+        return self.voices
+
+    def addVoice(self, measures = (), keyChanges = ()):
+        """Add a voice to the score, filled with 'measures' and 'keyChanges' if given
+        (e.g. those of a single-voice Score composed separately).  Returns the index
+        of the new voice."""
+        voice = len(self.voices)
+        self.voices.append([])
+        self.voiceKeyChanges.append(list(keyChanges))
+        for measure in measures:
+            self.addMeasure(measure.getNotes(), measure.getTieLast(), voice)
+        return voice
+
+    def __len__(self):
+        return len(self.measures)
+
+    def __iter__(self):
+        """Iterate over the measures of the first voice"""
+        yield from self.measures
+
+    def __repr__(self):
+        return "Score({}, {}, {} measures, {} voices)".format(self.key, self.timeSignature,
+                                                           len(self.measures), len(self.voices))
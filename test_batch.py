@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+"""A test module for batch.py and the muse.Configuration support for it"""
+
+import json, os, pickle, shutil, tempfile
+import batch, composer, muse, render
+
+_SWEEP = """
+[DEFAULT]
+key = CM, GM, DM
+numMeasures = 2
+
+[dense]
+density = 0.75, 1.0
+
+[meander]
+algorithm = MAGaussMeander
+meanderInKey = yes
+"""
+
+def testExpandSweep():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'sweep.ini')
+        with open(filename, 'w') as fd:
+            fd.write(_SWEEP)
+        jobs = batch.expandSweep(filename)
+        assert [(section, n) for section, n, settings in jobs] == \
+               [('dense', n) for n in range(6)] + [('meander', n) for n in range(3)]
+        assert sorted((s['key'], s['density']) for section, n, s in jobs if section == 'dense') == \
+               sorted((key, density) for key in ('CM', 'GM', 'DM') for density in ('0.75', '1.0'))
+        assert all(s['algorithm'] == 'MAGaussMeander' and s['numMeasures'] == '2'
+                   for section, n, s in jobs if section == 'meander')
+        records = batch.runBatch(filename, directory, seed = 5, workers = 1)
+        with open(os.path.join(directory, 'batch.json')) as fd:
+            assert json.load(fd)['jobs'] == records
+        # Each job is the piece the Composer makes from its settings
+        record = records[4]
+        assert record['seed'] == muse.spawnSeed(5, 'dense', 4)
+        comp = composer.Composer(muse.Configuration.fromStrings(record['settings']), 'unused.ly')
+        with open(os.path.join(directory, record['files'][0])) as fd:
+            assert fd.read() == ''.join(render.LilyRenderer(comp.composeScore()).stream())
+    finally:
+        shutil.rmtree(directory)
+
+def testSharedConfiguration():
+    muse.Configuration.shareParsedValues()
+    try:
+        a = muse.Configuration.fromStrings({'key': 'GM', 'density': '0.5'})
+        b = muse.Configuration.fromStrings({'key': 'GM', 'density': '1.0'})
+    finally:
+        muse.Configuration.shareParsedValues(False)
+    assert a.get('key') is b.get('key') and a.get('keyNoteMin') is b.get('keyNoteMin')
+    assert a.get('density') == 0.5 and b.get('density') == 1.0
+    assert a.get('algorithm') is not b.get('algorithm')
+    c = muse.Configuration.fromStrings({'key': 'GM'})
+    assert c.get('key') is not a.get('key') and str(c.get('key')) == str(a.get('key'))
+    # Clones and pickles get their own algorithm, and their own key to change
+    clone = a.clone()
+    assert type(clone.get('algorithm')) is type(a.get('algorithm')) and clone.get('algorithm') is not a.get('algorithm')
+    clone.changeKey(muse.Key('DM'))
+    assert str(a.get('key')) == str(muse.Key('GM'))
+    copy = pickle.loads(pickle.dumps(a))
+    assert str(copy.get('key')) == str(a.get('key')) and isinstance(copy.get('algorithm'), muse.MARandom)
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+"""A test module for composer.py and friends (orchestrator.py, score.py, render.py)"""
+
+import io, json
+import composer, muse, pypond, render, rhythm
+from orchestrator import Orchestrator
+
+def _newComposer(numMeasures = 8):
+    comp = composer.Composer('*', 'test_composer_output.ly')
+    comp.numMeasures = numMeasures
+    return comp
+
+def testScoreRenderers():
+    comp = _newComposer()
+    score = comp.composeScore()
+    assert len(score) == comp.numMeasures
+    for measure in score:
+        assert abs(measure.getDuration() - comp.measureDuration) < 1e-9
+    # Every format renders from the one composition
+    lily = io.StringIO()
+    render.LilyRenderer(score).write(lily)
+    lily = lily.getvalue()
+    assert lily.startswith(render.LilyRenderer.headerString)
+    assert "% Measure {}".format(comp.numMeasures) in lily
+    parsed = json.loads(''.join(render.JSONRenderer(score).stream()))
+    assert len(parsed['measures']) == len(score)
+    for jmeasure, measure in zip(parsed['measures'], score):
+        assert [n['duration'] for n in jmeasure['notes']] == [n.getDuration() for n in measure]
+    midi = b''.join(render.MIDIRenderer(score).stream())
+    assert midi.startswith(b'MThd')
+    assert midi.endswith(b'\xff\x2f\x00')
+    # Rendering does not consume or alter the score
+    again = io.StringIO()
+    render.LilyRenderer(score).write(again)
+    assert again.getvalue() == lily
+
+def testDecompositionTable():
+    table = Orchestrator.getTable(1)
+    assert table is Orchestrator.getTable(1)            # Built once per measure and resolution
+    assert table.lookup(0, 3/8) == ((0.25, True, False),)
+    assert table.lookup(1/8, 1/4) == ((0.125, False, True), (0.125, False, False))
+    assert table.lookup(0, 1/128) == None               # Off the 1/64 grid
+    assert table.lookup(1/2, 5/8) == None               # Runs past the barline
+    for alignTick, durationTick in ((0, 64), (1, 63), (3, 13), (17, 29), (40, 21), (63, 1)):
+        segments = table.lookup(alignTick/64, durationTick/64)
+        total = sum(d*(1.5 if dot else 1) for d, dot, tie in segments)
+        assert total*64 == durationTick
+        assert [tie for d, dot, tie in segments] == [True]*(len(segments) - 1) + [False]
+        assert len(table.lookupLily(alignTick/64, durationTick/64)) == len(segments)
+    # Decomposed as they are looked up, so a fine grid costs no more to set up
+    fine = Orchestrator.getTable(1, 1 << 20)
+    assert fine.lookup(3/16, 1/4) == table.lookup(3/16, 1/4) == ((0.0625, False, True), (0.125, True, False))
+    assert len(fine.table) == 1
+
+def testRhythmBeyondWholeAndSixtyFourth():
+    table = Orchestrator.getTable(2, 256)               # 4/2 time at 1/256 resolution
+    assert table.lookup(0, 2) == ((2.0, False, False),)
+    assert table.lookup(0, 3) == None                   # Longer than the measure
+    assert table.lookup(1/256, 3/256) == ((1/256, False, True), (1/128, False, False))
+    note = pypond.Note('C4', 2)
+    assert note.asLily() == "c'\\breve"
+    assert pypond.Note('C4', 3/128).asLily() == "c'64."
+    assert rhythm.getResolution(1/16) == 64
+    assert rhythm.getResolution(1/512) == 512
+    assert rhythm.decompose(0, 7*64) == [[256, True], [64, False]]  # longa. ~ 1
+
+def testFusedProcessMeasure():
+    comp = _newComposer(16)
+    score = comp.composeScore()
+    measureDuration = score.getMeasureDuration()
+    for measure in score:
+        notes = list(measure.getNotes())
+        fused = Orchestrator.processMeasure(notes, measure.getTieLast(), measureDuration = measureDuration)
+        assert notes == list(measure.getNotes())        # Input left untouched
+        multi = Orchestrator.processMeasureMultiPass([note.clone() for note in notes], measure.getTieLast(),
+                                                     measureDuration = measureDuration)
+        assert fused == multi
+    measure = Orchestrator._setBeatNums([pypond.Rest(1/8), pypond.Rest(1/8), pypond.Note('C4', 3/8),
+                                         pypond.Rest(1/64)] + [pypond.Note('D4', 1/64) for n in range(23)])
+    fused = Orchestrator.processMeasure(measure, True)
+    assert fused == Orchestrator.processMeasureMultiPass([note.clone() for note in measure], True)
+    assert fused.startswith("r4 c'4~  c'8 r64 d'64")
+    assert fused.endswith("d'64~ ")
+
+def testTimeSignatureGroups():
+    def lily(timeSignature, durations):
+        measure = Orchestrator._setBeatNums([pypond.Note('C4', d) for d in durations])
+        return Orchestrator.processMeasure(measure, measureDuration = timeSignature.getMeasureDuration(),
+                                           groups = timeSignature.getGroupDurations())
+    common = muse._TimeSignature('4/4')
+    assert common.getBeatGroups() == None
+    assert lily(common, [1/8]*8) == " ".join(["c'8"]*8)         # Unchanged; lilypond beams
+    compound = muse._TimeSignature('6/8')
+    assert compound.getBeatGroups() == (3, 3)
+    assert lily(compound, [3/4]) == "c'2."
+    assert lily(compound, [1/4]*3) == "c'4 c'8~  c'8 c'4"
+    assert lily(compound, [1/8]*6) == "c'8[ c'8 c'8] c'8[ c'8 c'8]"
+    irregular = muse._TimeSignature('7/8')
+    assert irregular.getBeatGroups() == (2, 2, 3)
+    assert irregular.asLily() == "2,2,3 7/8"
+    assert lily(irregular, [7/8]) == "c'2~  c'4."
+    explicit = muse._TimeSignature('3+2+2/8')
+    assert explicit.getBeatGroups() == (3, 2, 2)
+    assert str(explicit) == "3+2+2/8"
+    assert explicit.asLily() == "3,2,2 7/8"
+    assert lily(explicit, [1/8]*7) == "c'8[ c'8 c'8] c'8[ c'8] c'8[ c'8]"
+    assert muse._TimeSignature('3/4').getBeatGroups() == (1, 1, 1)
+
+def testMeasureBufferRecycles():
+    buf = composer.MeasureBuffer(3/4, 1/64)
+    notes = [pypond.Note('C4', 1/4), pypond.Note('D4', 1/8), pypond.Note('E4', 1/4)]
+    assert [buf.add(note) for note in notes] == [False, False, False]
+    remainder = buf.add(pypond.Note('F4', 1/4))
+    assert remainder.getDuration() == 1/8 and remainder.getNoteName() == 'F'
+    assert buf.isMeasureFull()
+    view = buf.getMeasure()
+    assert len(view) == 4 and view[-1].getDuration() == 1/8
+    first = tuple(view)
+    assert buf.add(remainder) == False
+    assert buf.getMeasure() is view                     # Same storage, handed out again
+    assert len(view) == 1 and view[0] is remainder
+    assert [note.getNoteName() for note in first] == ['C', 'D', 'E', 'F']
+    assert buf.getTotal() == 0
+
+def testDurationGrid():
+    # 3/128 needs a finer grid than shortestNote's 1/64: every measure still adds up
+    config = muse.Configuration.fromStrings({'shortestNote': '1/16', 'durationWeights': '3/128:1 1/16:1',
+                                             'numMeasures': '4'})
+    comp = composer.Composer(config, 'unused.ly')
+    assert comp.resolution == 128
+    for measure in comp.composeScore():
+        assert sum(note.getDuration() for note in measure) == comp.measureDuration
+    try:
+        composer.MeasureBuffer(1, 1/64).add(pypond.Note('C4', 1/12))
+    except muse.Error_InvalidConfig:
+        pass
+    else:
+        assert False
+    comp.algorithm.durationWeights = muse.WeightedSampler([1], [1/12])
+    try:
+        comp.algorithm.getResolution()
+    except muse.Error_InvalidConfig:
+        return
+    assert False
+
+def testThreadedComposition():
+    def notes(score):
+        return [(n.getNoteString(), n.getDuration()) for measure in score for n in measure if not n.isRest()]
+    comp = _newComposer()
+    comp.setSeed(17)
+    sequential = comp.composeScore()
+    comp = _newComposer()
+    comp.setSeed(17)
+    threaded = comp.composeScoreThreaded(bufferDepth = 8)
+    assert len(threaded) == len(sequential)
+    assert notes(threaded) == notes(sequential)
+
+def testPolyphony():
+    def notes(measures):
+        return [(n.getNoteString(), n.getDuration()) for measure in measures for n in measure]
+    scores = []
+    for parallel in (True, False):
+        comp = _newComposer(4)
+        comp.setSeed(23)
+        scores.append(comp.composeVoices(3, parallel = parallel))
+    score = scores[0]
+    assert score.getNumVoices() == 3
+    for voice, measures in enumerate(score.getVoices()):
+        assert len(measures) == 4                       # Barlines line up
+        for measure in measures:
+            assert measure.getVoice() == voice
+            assert abs(measure.getDuration() - comp.measureDuration) < 1e-9
+        assert notes(measures) == notes(scores[1].getMeasures(voice))   # Parallel == sequential
+    assert notes(score.getMeasures(0)) != notes(score.getMeasures(1))   # Independently seeded
+    lily = ''.join(render.LilyRenderer(score).stream())
+    assert "<<" in lily and "\\new Voice { \\voiceThree" in lily
+    parsed = json.loads(''.join(render.JSONRenderer(score).stream()))
+    assert parsed['voices'] == 3
+    assert [m['voice'] for m in parsed['measures']] == [0]*4 + [1]*4 + [2]*4
+    midi = b''.join(render.MIDIRenderer(score).stream())
+    assert b'\x92' in midi                              # Third voice plays on channel 3
+
+def testVoicesFromConfigInMemory():
+    import concurrent.futures
+    def notes(measures):
+        return [(n.getNoteString(), n.getDuration()) for measure in measures for n in measure]
+    comp = _newComposer(4)
+    comp.config.changeKey(muse.Key('F#M'))              # Not in the file: the workers see it too
+    comp.algorithm.setConfig(comp.config)
+    comp.setSeed(29)
+    try:
+        score = comp.composeVoices(3)
+        pool = comp._pool
+        assert pool != None and comp.composeVoices(3) and comp._pool is pool   # Kept for the next piece
+    finally:
+        comp.close()
+    assert comp._pool == None
+    key = comp.config.get('key')
+    for measures in score.getVoices():
+        assert all(key.isInKey(n)[0] for measure in measures for n in measure if not n.isRest())
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        threaded = comp.composeVoices(3, pool = pool)   # The caller's pool
+    assert [notes(measures) for measures in threaded.getVoices()] == [notes(measures) for measures in score.getVoices()]
+
+def testSeededComposition():
+    def notes(score):
+        return [(n.getNoteString(), n.getDuration()) for measures in score.getVoices() for measure in measures
+                for n in measure]
+    scores = []
+    for seed in (31, 31, 32):
+        comp = _newComposer()
+        comp.setSeed(seed)
+        scores.append(comp.composeScore())
+    assert notes(scores[0]) == notes(scores[1])         # (config, seed) reproduces the piece
+    assert notes(scores[0]) != notes(scores[2])
+    assert scores[0].getSeed() == 31
+    assert json.loads(''.join(render.JSONRenderer(scores[2]).stream()))['seed'] == 32
+
+def testRecomposeAfterKeyChange():
+    def notes(score):
+        return [(n.getNoteString(), n.getDuration()) for measure in score for n in measure]
+    def keyChanges(score):
+        return [(m, offset, str(key)) for m, offset, key in score.getKeyChanges()]
+    config = muse.Configuration.fromStrings({'key': 'CM', 'diatonicity': '0.5', 'numMeasures': '4'})
+    comp = composer.Composer(config, 'unused.ly')
+    comp.setSeed(37)
+    first = comp.composeScore()
+    assert len(first.getKeyChanges()) > 0               # The piece leaves C major...
+    second = comp.composeScore()                        # ...but the next one starts in it again
+    assert notes(second) == notes(first) and keyChanges(second) == keyChanges(first)
+    assert str(second.getKey()) == str(first.getKey()) == str(config.get('key')) == 'Cmaj'
+
+def testStartupImports():
+    import subprocess, sys
+    # The command-line entry points import the rarely used modules where they use them
+    lazy = ('numpy', 'subprocess', 'concurrent.futures', 'configparser', 'render', 'diagnostics', 'chord')
+    code = "import sys, composer; print(sorted(m for m in {!r} if m in sys.modules))".format(lazy)
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'[]'
+    code = "import sys, muse; muse.Key('GM').getNewByFifths(1); print('numpy' in sys.modules)"
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'False'
+    if muse.numpy != None:
+        assert muse.numpy.random.default_rng(1).random() < 1
+        assert muse.numpy is sys.modules['numpy']       # Rebound to the module on first use
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+"""A test module for constraint.py"""
+
+import constraint, rhythm
+from test_muse import _newAlgorithm
+
+def testConstraintRules():
+    algorithm = _newAlgorithm(constraint.MAConstraint, seed = 9)
+    table = [str(note) for note in algorithm.getRangeTable()]
+    tonic = algorithm.key.getTonic().getNoteName()
+    phraseDuration = 4*algorithm.config.getMeasureDuration()
+    total = 0
+    last = None
+    repeats = 0
+    for n in range(3000):
+        note = algorithm.getNextNote()
+        index = table.index(str(note))                  # In key and in range
+        if last != None:
+            assert abs(index - last) <= 4               # maxLeap
+        if index == last:
+            repeats += 1
+        else:
+            repeats = 1
+        assert repeats <= 2                             # maxRepeats
+        last = index
+        before = total
+        total += note.getDuration()
+        assert int(before/phraseDuration) == int(total/phraseDuration) or total % phraseDuration == 0
+        if total % phraseDuration == 0:
+            assert note.getNoteName() == tonic          # Cadence on the tonic
+
+def testConstraintDefaultDurations():
+    algorithm = _newAlgorithm(constraint.MAConstraint, seed = 9)
+    assert algorithm.durationWeights == None
+    for n in range(500):
+        units = list(rhythm.units(int(algorithm.getNextNote().getDuration()*algorithm.resolution)))
+        assert len(units) == 1 or (len(units) == 2 and units[1] == units[0] >> 1)     # Unit or dotted
+
+def testConstraintUnsatisfiable():
+    algorithm = _newAlgorithm(constraint.MAConstraint, seed = 9)
+    algorithm.constraints[:2] = [constraint.MaxLeap(0), constraint.MaxRepeats(1)]
+    try:
+        algorithm.getNextNote()
+    except constraint.Error_Unsatisfiable:
+        return
+    assert False
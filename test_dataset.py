@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+"""A test module for dataset.py"""
+
+import os, shutil, tempfile
+import composer, dataset, muse
+
+def testExportDataset():
+    directory = tempfile.mkdtemp()
+    try:
+        single = os.path.join(directory, 'single')
+        pooled = os.path.join(directory, 'pooled')
+        numNotes = dataset.exportDataset(single, 6, '*', seed = 11, workers = 1, numMeasures = 2)
+        assert dataset.exportDataset(pooled, 6, '*', seed = 11, workers = 2, numMeasures = 2) == numNotes
+        for name in os.listdir(single):                 # The same dataset however it is made
+            with open(os.path.join(single, name), 'rb') as a, open(os.path.join(pooled, name), 'rb') as b:
+                assert a.read() == b.read()
+        data = dataset.Dataset(single)
+        assert len(data) == 6 and data.getNumNotes() == numNotes
+        assert data.getSeed(2) == muse.spawnSeed(11, 2)
+        # Piece k is the piece the Composer makes with its seed
+        comp = composer.Composer('*', 'unused.ly')
+        comp.numMeasures = 2
+        comp.setSeed(data.getSeed(2))
+        notes = [note for measure in comp.composeScore() for note in measure]
+        piece = data.getPiece(2)
+        assert piece['pitch'].tolist() == [-1 if n.isRest() else n.getMIDIByte() for n in notes]
+        assert piece['duration'].tolist() == [n.getDuration() for n in notes]
+        assert abs(sum(piece['duration']) - 2*comp.measureDuration) < 1e-6
+        assert piece['beat'][0] == 0 and set(piece['voice'].tolist()) == {0}
+        if muse.numpy != None:
+            offsets = muse.numpy.load(os.path.join(single, 'offsets.npy'), mmap_mode = 'r')
+            pitch = muse.numpy.load(os.path.join(single, 'pitch.npy'), mmap_mode = 'r')
+            assert pitch[offsets[2]:offsets[3]].tolist() == piece['pitch'].tolist()
+        del piece
+        data.close()
+    finally:
+        shutil.rmtree(directory)
+
+def testKeyChangesAcrossPieces():
+    directory = tempfile.mkdtemp()
+    try:
+        # Each worker composes several pieces with one Composer; a key change must not
+        # carry over from one piece to the next
+        filename = os.path.join(directory, 'modulating.ini')
+        with open(filename, 'w') as fd:
+            fd.write("[DEFAULT]\nkey = CM\ndiatonicity = 0.5\nnumMeasures = 2\n")
+        single = os.path.join(directory, 'single')
+        pooled = os.path.join(directory, 'pooled')
+        numNotes = dataset.exportDataset(single, 6, filename, seed = 13, workers = 1)
+        assert dataset.exportDataset(pooled, 6, filename, seed = 13, workers = 3) == numNotes
+        for name in os.listdir(single):
+            with open(os.path.join(single, name), 'rb') as a, open(os.path.join(pooled, name), 'rb') as b:
+                assert a.read() == b.read()
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+"""A test module for debug.py"""
+
+import io, os, shutil, tempfile
+import debug
+
+class _Counted(object):
+    formatted = 0
+    def __format__(self, spec):
+        _Counted.formatted += 1
+        return "counted"
+
+def testLevelsAndContext():
+    stream = io.StringIO()
+    log = debug.getLogger("test.py")
+    assert debug.getLogger("test.py") is log
+    level = debug.getLevel()
+    debug.setHandler(debug.StreamHandler(stream))
+    try:
+        debug.setLevel(debug.WARNING)
+        log.dbg("not {}", _Counted())                   # Disabled: never formatted
+        assert _Counted.formatted == 0 and stream.getvalue() == ''
+        log.warning("kept {}", 1)
+        debug.setLevel(debug.DEBUG)
+        log.bind(seed = 5, voice = 0).dbg("{} and {}", _Counted(), 'more')
+        debug.setLevel(debug.OFF)
+        log.warning("dropped")
+    finally:
+        debug.setHandler(None)
+        debug.setLevel(level)
+    assert stream.getvalue() == "[test.py]\tWARNING: kept 1\n[test.py seed=5 voice=0]\tcounted and more\n"
+
+def testBufferedFileHandler():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'dbg.log')
+        handler = debug.BufferedFileHandler(filename, capacity = 3, flushInterval = 3600)
+        handler.flush()
+        assert not os.path.exists(filename)             # Nothing logged, no file
+        for n in range(4):
+            handler.emit("line {}\n".format(n))
+        with open(filename) as fd:
+            assert fd.read() == "line 0\nline 1\nline 2\n"
+        handler.close()
+        with open(filename) as fd:
+            assert fd.read() == ''.join("line {}\n".format(n) for n in range(4))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+"""A test module for fifo.py"""
+
+import threading
+import fifo
+
+def testFIFOIndexing():
+    buf = fifo.FIFO(3)
+    for item in 'abc':
+        buf.add(item)
+    assert buf.get() == 'a'
+    buf.add('d')                                        # Wraps around
+    assert [buf[0], buf[1], buf[-1]] == ['b', 'c', 'd']
+    buf[0] = 'B'
+    buf[-1] = 'D'
+    assert [buf[0], buf[1], buf[2]] == ['B', 'c', 'D']
+
+def testBlockingFIFO():
+    buf = fifo.BlockingFIFO(4)
+    try:
+        buf.get(timeout = 0.01)
+        assert False, "get() on an empty FIFO"
+    except fifo.Error_Timeout:                          # Empty: times out
+        pass
+    buf.put(None)
+    assert buf.get(timeout = 0.01) == None              # None is an item
+    received = []
+    def consume():
+        while True:
+            try:
+                received.append(buf.get())
+            except fifo.Error_Closed:
+                return
+    consumer = threading.Thread(target = consume)
+    consumer.start()
+    for n in range(1000):
+        assert buf.put(n, timeout = 5)
+    buf.close()
+    consumer.join(5)
+    assert received == list(range(1000))
+    try:
+        buf.put(0)
+        assert False, "put() on a closed FIFO"
+    except fifo.Error_Closed:
+        pass
+    # A producer putting batches bigger than the buffer, a consumer draining it
+    batches = fifo.BlockingFIFO(3)
+    received = []
+    def drain():
+        while True:
+            try:
+                received.extend([batches.get()] + batches.drain())
+            except fifo.Error_Closed:
+                return
+    consumer = threading.Thread(target = drain)
+    consumer.start()
+    for n in range(0, 1000, 7):
+        assert batches.putMany(range(n, n + 7), timeout = 5)
+    batches.close()
+    consumer.join(5)
+    assert received == list(range(1001))
+    full = fifo.BlockingFIFO(2)
+    assert full.put('a') and full.put('b')
+    assert full.put('c', timeout = 0.01) == False       # Full: times out
+    assert [full[0], full[-1]] == ['a', 'b']
+
+def testFIFOBulk():
+    buf = fifo.FIFO(5)
+    assert buf.extend('abc') == 3
+    assert buf.getMany(2) == ['a', 'b']
+    assert buf.extend('defgh') == 4                     # Blocking: only 4 fit
+    assert list(buf) == ['c', 'd', 'e', 'f', 'g']       # Wrapped, and not consumed
+    assert buf.isFull()
+    assert buf.drain() == ['c', 'd', 'e', 'f', 'g']
+    assert buf.isEmpty() and buf.drain() == []
+    shift = fifo.FIFO(4, blockOnFull = False)
+    shift.extend('ab')
+    assert shift.extend('cde') == 3
+    assert list(shift) == ['b', 'c', 'd', 'e']
+    assert shift.extend('0123456') == 7
+    assert shift.drain() == ['3', '4', '5', '6']
+    # Bulk and single-item operations agree
+    one = fifo.FIFO(7)
+    many = fifo.FIFO(7)
+    for n in range(50):
+        items = list(range(n, n + n % 5))
+        for item in items:
+            one.add(item)
+        many.extend(items)
+        assert list(one) == list(many)
+        got = [one.get() for m in range(min(n % 4, len(one)))]
+        assert many.getMany(n % 4) == got
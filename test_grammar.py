@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+"""A test module for grammar.py"""
+
+import itertools, random
+import grammar
+from test_muse import _newAlgorithm
+
+def testGrammarExpansion():
+    rules = grammar.Grammar("""
+        S -> A B A+4
+        A -> 0:1/8 2:1/8 C
+        B -> r:1/4 A-1
+        C -> 4:1/4
+    """)
+    expected = [(0, 1/8), (2, 1/8), (4, 1/4), (None, 1/4), (-1, 1/8), (1, 1/8), (3, 1/4),
+                (4, 1/8), (6, 1/8), (8, 1/4)]
+    assert list(rules.expand()) == expected
+    assert rules.getMemo('S') == tuple(expected)        # No alternatives: memoized whole
+    for bad in ("S -> T", "S -> 0:x", "S -> A | B\nA -> 1:1/4\nS -> A"):
+        try:
+            grammar.Grammar(bad)
+        except grammar.Error_Grammar:
+            continue
+        assert False, bad
+
+def testGrammarRecursion():
+    rules = grammar.Grammar("""
+        S -> A S
+        A -> 0:1/8 | [3] 1:1/8 2:1/8
+    """)
+    assert rules.getMemo('S') == None and rules.getMemo('A') == None
+    stream = rules.expand(rng = random.Random(1))
+    notes = list(itertools.islice(stream, 200000))      # Endless right recursion, constant memory
+    assert len(notes) == 200000
+    assert notes.count((2, 1/8)) > notes.count((0, 1/8))
+    left = grammar.Grammar("S -> S 0:1/8")
+    try:
+        next(left.expand())
+    except grammar.Error_Grammar:
+        pass
+    else:
+        assert False
+
+def testMAGrammar():
+    algorithm = _newAlgorithm(grammar.MAGrammar, seed = 4)
+    table = [str(note) for note in algorithm.getRangeTable()]
+    tonic = algorithm.getDegreeNote(0)
+    assert tonic.getNoteName() == algorithm.key.getTonic().getNoteName()
+    assert algorithm.getDegreeNote(len(algorithm.key.getNotes())).getMIDIByte() == tonic.getMIDIByte() + 12
+    for n in range(500):
+        note = algorithm.getNextNote()
+        assert note.isRest() or str(note) in table
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+
+"""A test module for markov.py"""
+
+import os, tempfile
+import markov
+from test_muse import _newAlgorithm
+
+def testMarkov():
+    phrase = [(0, 1/4), (2, 1/8), (4, 1/8), (None, 1/4), (4, 1/4), (2, 1/8), (1, 1/8), (0, 1/2)]
+    model = markov.MarkovModel(2)
+    model.train(phrase*3)
+    fd, filename = tempfile.mkstemp(suffix = '.mkv')
+    os.close(fd)
+    try:
+        model.save(filename)
+        loaded = markov.MarkovModel.load(filename)
+    finally:
+        os.remove(filename)
+    assert loaded.getStates() == model.getStates() and loaded.counts == model.counts
+    algorithm = _newAlgorithm(markov.MAMarkov, seed = 7)
+    algorithm.model = loaded
+    table = [str(note) for note in algorithm.getRangeTable()]
+    played = []
+    for n in range(40):
+        note = algorithm.getNextNote()
+        if note.isRest():
+            played.append((None, note.getDuration()))
+        else:
+            assert str(note) in table                   # In key and in range
+            played.append((algorithm.key.getScaleDegree(note), note.getDuration()))
+    # Every order-2 context of the phrase has a single continuation, so the chain loops it
+    assert any(played == (phrase*8)[start:start + 40] for start in range(len(phrase)))
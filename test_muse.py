@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+
+"""A test module for muse.py"""
+
+import muse
+
+def _newAlgorithm(cls, seed = 5, **changes):
+    config = muse.Configuration('*')
+    algorithm = cls()
+    algorithm.setConfig(config)
+    algorithm.changeParameters(changes)
+    algorithm.plantSeed(seed)
+    return algorithm
+
+def _stats(algorithm, count):
+    rests = 0
+    durations = 0
+    table = algorithm.getRangeTable()
+    indices = [0]*len(table)
+    for n in range(count):
+        note = algorithm.getNextNote()
+        durations += note.getDuration()
+        if note.isRest():
+            rests += 1
+        else:
+            indices[[t.getNoteString() for t in table].index(note.getNoteString())] += 1
+    return rests/count, durations/count, [i/(count - rests) for i in indices]
+
+def testMARandomBlocks():
+    count = 20000
+    scalar = _stats(_newAlgorithm(muse.MARandom, density = 0.7, blockSize = 1), count)
+    block = _stats(_newAlgorithm(muse.MARandom, density = 0.7), count)
+    assert abs(scalar[0] - 0.3) < 0.02 and abs(block[0] - 0.3) < 0.02         # Rest fraction
+    assert abs(scalar[1] - block[1]) < 0.02                                     # Mean duration
+    for s, b in zip(scalar[2], block[2]):                                       # Pitch histogram
+        assert abs(s - b) < 0.02
+
+def testRangeTable():
+    algorithm = _newAlgorithm(muse.MARandom)
+    table = algorithm.getRangeTable()
+    assert table is algorithm.getRangeTable()
+    assert len(table) == algorithm.notesInRange
+    assert str(table[0]) == str(algorithm.keyNoteMin) and str(table[-1]) == str(algorithm.keyNoteMax)
+    before = table[-1].getDuration()
+    note = algorithm.getNoteInKey(0.999)
+    assert note is not table[-1]                        # A copy, never the table's own note
+    note.setDuration(3/8)
+    assert table[-1].getDuration() == before
+
+def testInvLog2():
+    # The longest unit duration <= x: 1/8 for 3/16, a half note for 3/4, a breve for 3
+    cases = {1/16: 4, 1: 0, 2: -1, 3/16: 3, 3/4: 1, 3: -1, 1/256: 8}
+    assert {x: muse.Configuration._invLog2(x) for x in cases} == cases
+
+def testSeeding():
+    def notes(algorithm, count = 200):
+        return [(n.getNoteString(), n.getDuration()) for n in (algorithm.getNextNote() for i in range(count))]
+    for cls in (muse.MARandom, muse.MAGaussMeander):
+        for blockSize in (1, 4096):
+            first = notes(_newAlgorithm(cls, seed = 11, blockSize = blockSize))
+            assert first == notes(_newAlgorithm(cls, seed = 11, blockSize = blockSize))
+            assert first != notes(_newAlgorithm(cls, seed = 12, blockSize = blockSize))
+    algorithm = _newAlgorithm(muse.MARandom, seed = 11)
+    first = notes(algorithm)
+    algorithm.plantSeed(11)                             # Re-seeding restarts the stream
+    assert notes(algorithm) == first
+    assert muse.spawnSeed(11, 0) == muse.spawnSeed(11, 0)
+    assert len({muse.spawnSeed(11, 0), muse.spawnSeed(11, 1), muse.spawnSeed(12, 0), muse.spawnSeed(11, 0, 1)}) == 4
+    assert muse._seedParser(' None ') == None and muse._seedParser('0x10') == 16
+
+def testWeightedSampler():
+    import random
+    weights = [5, 0, 1, 2, 0.5]
+    sampler = muse.WeightedSampler(weights, 'abcde')
+    rng = random.Random(3)
+    count = 40000
+    for draws in ([sampler.sample(rng = rng) for n in range(count)], sampler.sample(count, rng)):
+        for item, w in zip('abcde', weights):
+            assert abs(draws.count(item)/count - w/sum(weights)) < 0.01
+        assert 'b' not in draws
+    assert len(sampler.sample(10, rng)) == 10
+    durations = muse.WeightedSampler.fromString("1/16:1 1/8:2 1/4:2")
+    assert durations.getItems() == (1/16, 1/8, 1/4) and durations.getWeight(1/8) == 2
+    assert muse._weightsParser(" none ") == None
+    assert muse._durationWeightsParser("3/8:1 3/128:1").getItems() == (3/8, 3/128)
+    for text in ("1/12:1 1/8:1", "0:1", "0.1:1"):           # Off every tick grid
+        try:
+            muse.Configuration.fromStrings({'durationWeights': text})
+        except muse.Error_InvalidConfig:
+            continue
+        assert False, text
+    algorithm = _newAlgorithm(muse.MARandom, durationWeights = durations,
+                              degreeWeights = muse.WeightedSampler.fromString("0:1 4:1"))
+    degrees = set()
+    for n in range(2000):
+        note = algorithm.getNextNote()
+        assert note.getDuration() in durations.getItems()
+        degrees.add(algorithm.key.getScaleDegree(note))
+    assert degrees == {0, 4}
+
+def testGaussMeander():
+    assert muse.MAGaussMeander._reflect(62, 40, 60) == 58 and muse.MAGaussMeander._reflect(-3, 0, 10) == 3
+    for blockSize in (1, 4096):
+        algorithm = _newAlgorithm(muse.MAGaussMeander, blockSize = blockSize)
+        pitches = []
+        for n in range(5000):
+            note = algorithm.getNextNote()
+            assert note.getDuration() > 0
+            pitches.append(note.getMIDIByte())
+        assert min(pitches) >= algorithm.minPitch and max(pitches) <= algorithm.maxPitch
+        assert min(pitches) < algorithm.minPitch + 3 and max(pitches) > algorithm.maxPitch - 3
+        algorithm = _newAlgorithm(muse.MAGaussMeander, blockSize = blockSize, inKey = True)
+        table = set(str(note) for note in algorithm.getRangeTable())
+        assert all(str(algorithm.getNextNote()) in table for n in range(2000))
+
+def testGetNextNotes():
+    def played(notes):
+        return [(str(note), note.isRest(), note.getDuration()) for note in notes]
+    for cls, changes in ((muse.MARandom, {'blockSize': 64}), (muse.MARandom, {'blockSize': 1}),
+                         (muse.MAGaussMeander, {'blockSize': 64}), (muse.MAGaussMeander, {'inKey': True}),
+                         (muse.MAFixed, {})):
+        one = _newAlgorithm(cls, **changes)
+        singles = [one.getNextNote() for n in range(300)]
+        singleKeys = [str(getattr(one, 'key', None))]
+        many = _newAlgorithm(cls, **changes)
+        keys = []
+        batches = []
+        for count in (1, 7, 100, 192):                  # Across block boundaries too
+            batches += many.getNextNotes(count, keys)
+        assert played(batches) == played(singles)       # The same stream, however it is cut
+        assert len(keys) == 300 and str(keys[-1]) == singleKeys[0]
+
+def testAlgorithmRegistry():
+    import subprocess, sys
+    assert muse.getAlgorithm('marandom') is muse.MARandom
+    assert muse.getAlgorithm('MAMarkov') is muse.getAlgorithm('markov:MAMarkov')
+    assert muse.getAlgorithm('markov:MarkovModel') == None          # Not a MelodyAlgorithm
+    assert muse.getAlgorithm('nosuchmodule:MAFoo') == None and muse.getAlgorithm('MAFoo') == None
+    @muse.registerAlgorithm(name = "testFixed")
+    class _TestFixed(muse.MAFixed):
+        pass
+    assert isinstance(muse._AlgorithmParser('TESTFIXED'), _TestFixed)
+    del muse._Algorithms['testfixed']
+    # Importing muse must not import the algorithms which live in their own modules
+    code = "import sys, muse; print('markov' in sys.modules)"
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'False'
+
+class _Unpickled(object):
+    count = 0
+    def __init__(self):
+        _Unpickled.count += 1
+    def __reduce__(self):
+        return (_Unpickled, ())
+
+def testConfigSnapshot():
+    import os, pickle, shutil, tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'cfg.ini')
+        with open(filename, 'w') as fd:
+            fd.write("[DEFAULT]\nkey = EbMaj\nnoteLowest = Bb3\nalgorithm = MAGaussMeander\n")
+        parsed = muse.Configuration(filename)
+        assert os.path.exists(filename + muse.Configuration._snapshotExt)
+        loaded = muse.Configuration(filename)
+        assert loaded.loadSnapshot(filename) != None
+        for name in ('key', 'keyNoteMin', 'keyNoteMax', 'timeSignature', 'shortestNote', 'numMeasures'):
+            assert str(loaded.get(name)) == str(parsed.get(name))
+        assert type(loaded.get('algorithm')) is muse.MAGaussMeander
+        assert loaded.get('algorithm') is not parsed.get('algorithm')   # Made anew
+        # An edit invalidates the snapshot, even one keeping the size and modification time
+        stat = os.stat(filename)
+        with open(filename, 'w') as fd:
+            fd.write("[DEFAULT]\nkey = AbMaj\nnoteLowest = Bb3\nalgorithm = MAGaussMeander\n")
+        os.utime(filename, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+        assert loaded.loadSnapshot(filename) == None
+        # A stale snapshot is turned down on its header alone, without unpickling it
+        with open(filename + muse.Configuration._snapshotExt, 'rb') as fd:
+            header = fd.readline()
+        with open(filename + muse.Configuration._snapshotExt, 'wb') as fd:
+            fd.write(header + pickle.dumps(_Unpickled()))
+        _Unpickled.count = 0
+        assert loaded.loadSnapshot(filename) == None and _Unpickled.count == 0
+        assert str(muse.Configuration(filename).get('key')) == str(muse.Key('AbMaj'))
+        with open(filename + muse.Configuration._snapshotExt, 'wb') as fd:
+            fd.write(b'not a pickle')
+        assert str(muse.Configuration(filename).get('key')) == str(muse.Key('AbMaj'))
+    finally:
+        shutil.rmtree(directory)
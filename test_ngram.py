@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+"""A test module for ngram.py"""
+
+import os, shutil, tempfile
+import composer, muse, ngram, render
+from test_muse import _newAlgorithm
+
+def testParseLily():
+    text = "\\key ees \\major\n  c'4~ c'8[ r8] ees''4. bes,16 cis\\breve % Measure 1\n as"
+    assert ngram.parseLily(text, 64) == [[(60, 24), (None, 8), (75, 24), (46, 4), (49, 128), (56, 128)]]
+    voices = ngram.parseLily("<<\n\\new Voice { \\voiceOne c'4 d'4 }\n\\new Voice { \\voiceTwo r2 }\n>>", 64)
+    assert voices == [[(60, 16), (62, 16)], [(None, 32)]]
+    assert ngram.parseLily("c'8[~ c'16 d'16] e'8 f'8 ~ f'8 g'8.]~ g'16", 64) == [[(60, 12), (62, 4), (64, 8), (65, 16), (67, 16)]]
+    # The Composer's Lilypond, beams and ties and all, parses to its whole duration
+    comp = composer.Composer(muse.Configuration.fromStrings({'timeSignature': '6/8', 'numMeasures': '8'}), 'unused.ly')
+    comp.setSeed(3)
+    lily = ''.join(render.LilyRenderer(comp.composeScore()).stream())
+    assert "[~" in lily or "]~" in lily
+    assert sum(ticks for pitch, ticks in ngram.parseLily(lily, 256)[0]) == 8*6/8*256
+    assert ngram.getStates([(None, 16), (60, 16), (62, 8), (None, 8), (59, 16)]) == \
+           [(ngram._REST, 16), (2, 8), (ngram._REST, 8), (-3, 16)]
+
+def testNgramModel():
+    directory = tempfile.mkdtemp()
+    try:
+        for seed in range(3):
+            comp = composer.Composer('*', os.path.join(directory, 'unused.ly'))
+            comp.numMeasures = 4
+            comp.setSeed(seed)
+            with open(os.path.join(directory, "piece{}.ly".format(seed)), 'w') as fd:
+                render.LilyRenderer(comp.composeScore()).write(fd)
+        trainer = ngram.NgramTrainer(1)
+        assert trainer.trainDirectory(directory) == 3
+        trainer.train([(2, 64), (-2, 64)]*4)            # A context with one continuation
+        filename = os.path.join(directory, 'model.ngm')
+        trainer.save(filename)
+        config = muse.Configuration('*')
+        config.config['ngramModel'] = filename
+        algorithm = ngram.MANgram()
+        algorithm.setConfig(config)
+        algorithm.plantSeed(3)
+    finally:
+        shutil.rmtree(directory)                        # The mapping outlives the file
+    model = algorithm.model
+    assert ngram.MANgram._models[filename] is model     # Mapped once, shared
+    assert (model.getOrder(), model.getResolution()) == (1, 256)
+    assert model.numStates == len(trainer.getStates()) and model.numContexts == len(trainer.counts)
+    up = trainer.getStates().index((2, 64))
+    down = trainer.getStates().index((-2, 64))
+    assert model.getState(up) == (2, 64)
+    context = model.findContext(up)
+    assert all(model.getNextState(context, u/10) == down for u in range(10))
+    assert model.findContext(model.numStates) == None
+    low = algorithm.keyNoteMin.getMIDIByte()
+    high = algorithm.keyNoteMax.getMIDIByte()
+    for n in range(200):
+        note = algorithm.getNextNote()
+        assert note.getDuration() > 0
+        assert note.isRest() or low <= note.getMIDIByte() <= high
+
+def testNgramNeedsModel():
+    try:
+        _newAlgorithm(ngram.MANgram)
+    except muse.Error_InvalidConfig:
+        pass
+    else:
+        assert False, "MANgram without an ngramModel"
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+"""A test module for timing.py and the composer's stage timers"""
+
+import io, json, os, shutil, tempfile
+import composer, timing
+
+def testStageTimers():
+    timing.reset()
+    comp = composer.Composer('*', 'unused.ly')
+    comp.numMeasures = 4
+    comp.composeScore()
+    assert timing.getStages() == {} and timing.getCounters() == {}     # Off: nothing recorded
+    timing.enable()
+    try:
+        comp = composer.Composer('*', 'unused.ly')
+        comp.numMeasures = 4
+        score = comp.composeScore()
+        comp.writeAll(io.StringIO())
+        stages = timing.getStages()
+        counters = timing.getCounters()
+        report = timing.getReport()
+    finally:
+        timing.enable(False)
+        timing.reset()
+    assert {'config', 'compose', 'compose/algorithm', 'compose/buffer', 'write', 'write/orchestrate'} <= set(stages)
+    assert stages['compose'][0] >= stages['compose/algorithm'][0] + stages['compose/buffer'][0]
+    assert stages['write/orchestrate'][1] == len(score) == counters['measures']
+    assert counters['notes'] > 0
+    assert counters.get('table builds', 0) + counters['table cache hits'] == len(score)
+    lines = timing.formatSummary(report).splitlines()
+    n = [line.split()[0] for line in lines].index('compose')
+    assert lines[n + 1].startswith("  ")                # Its stages, under it
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'run.profile.json')
+        timing.writeJSON(filename, report)
+        with open(filename) as fd:
+            assert json.load(fd) == json.loads(json.dumps(report))
+    finally:
+        shutil.rmtree(directory)
@@ -1,7 +1,6 @@
 #!/usr/bin/python3
 
 import pypond
-import muse
 from circular import Circular
 import re
 
@@ -46,7 +45,7 @@ class TheoryClass(object):
         note = pypond.Note(key.getTonicName())
         nextNote = note.getNoteByInterval(interval)
         quality = key.getQuality()
-        nextKey = muse.Key(nextNote.getNoteName())
+        nextKey = type(key)(nextNote.getNoteName())
         nextKey.setQuality(quality)
         return nextKey
 
@@ -107,18 +106,19 @@ class TheoryClass(object):
             return True
         # If there is no accidental in the tonic name
         quality = key.getQuality()
+        qualities = key._qualities
         # These are my best guesses
-        if quality == muse._KeyQuality.major:
+        if quality == qualities.major:
             offset = 0
-        elif quality == muse._KeyQuality.minor:
+        elif quality == qualities.minor:
             offset = 3
-        elif quality == muse._KeyQuality.dimwh:
+        elif quality == qualities.dimwh:
             offset = 3
-        elif quality == muse._KeyQuality.dimhw:
+        elif quality == qualities.dimhw:
             offset = 3
-        elif quality == muse._KeyQuality.chromatic:
+        elif quality == qualities.chromatic:
             offset = 0
-        elif quality == muse._KeyQuality.wholetone:
+        elif quality == qualities.wholetone:
             offset = 0
         else:
             offset = 0
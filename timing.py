@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+"""Stage timers and counters for the composer pipeline, for finding where a run
+spends its time.  Off unless enabled (composer.py --profile); the instrumented code
+checks timing.enabled before reading the clock, so when off they cost a branch:
+
+    if timing.enabled:
+        start = timing.now()
+    notes = self.algorithm.getNextNotes(self.batchSize, keys)
+    if timing.enabled:
+        start = timing.addTime('compose/algorithm', start)
+
+Stages are named like paths: 'compose/algorithm' is part of 'compose', and the
+summary shows it indented under it.  Stages:
+
+    config              reading the cfg (Composer())
+    compose             composing the score (the voices composed in worker
+                        processes are not timed, only the wait for them)
+    compose/algorithm   the melody algorithm choosing notes
+    compose/buffer      splitting the notes into measures, into the Score
+    write               rendering and writing each format
+    write/orchestrate   formatting measures as GNU Lilypond (Orchestrator)
+    lily                running GNU Lilypond
+
+Counters: notes, measures, decomposed notes (written as several tied notes),
+off-grid notes (written without the decomposition table), and the decomposition
+table cache's hits and builds.  getReport() returns it all as a dict, which
+writeJSON() saves; formatSummary() makes a table of it."""
+
+import time
+
+enabled = False
+now = time.perf_counter
+
+_stages = {}        # name : [seconds, calls]
+_counters = {}      # name : count
+_start = None       # now() when enabled
+
+def enable(on = True):
+    """Start (or with on = False, stop) timing and counting"""
+    global enabled, _start
+    enabled = on
+    if on and _start == None:
+        _start = now()
+
+def reset():
+    global _start
+    _stages.clear()
+    _counters.clear()
+    _start = now() if enabled else None
+
+def addTime(stage, start, calls = 1):
+    """Add the time since 'start' (a now() reading) to 'stage' and return now(), the
+    start of whatever comes next"""
+    end = now()
+    entry = _stages.get(stage, None)
+    if entry == None:
+        _stages[stage] = [end - start, calls]
+    else:
+        entry[0] += end - start
+        entry[1] += calls
+    return end
+
+def count(name, n = 1):
+    _counters[name] = _counters.get(name, 0) + n
+
+def getStages():
+    """Return {stage : (seconds, calls)}"""
+    return {name: tuple(entry) for name, entry in _stages.items()}
+
+def getCounters():
+    return dict(_counters)
+
+def getReport():
+    """Return the timings as a dict: 'total' (seconds since enabled), 'stages'
+    ({name : {'seconds', 'calls'}}) and 'counters'"""
+    total = 0
+    if _start != None:
+        total = now() - _start
+    return {
+        'total'     : total,
+        'stages'    : {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in _stages.items()},
+        'counters'  : dict(_counters),
+    }
+
+def formatSummary(report = None):
+    """Return getReport() (or 'report') as a table, one line per stage (children
+    indented under their parents, in order of time) and per counter"""
+    if report == None:
+        report = getReport()
+    total = report['total']
+    stages = report['stages']
+    lines = ["{:<24}{:>12}{:>8}{:>10}{:>14}".format("stage", "ms", "%", "calls", "us/call")]
+    def children(parent):
+        prefix = parent + '/' if parent else ''
+        names = [name for name in stages if name.startswith(prefix) and '/' not in name[len(prefix):]]
+        return sorted(names, key = lambda name: -stages[name]['seconds'])
+    def addLines(parent, depth):
+        for name in children(parent):
+            seconds = stages[name]['seconds']
+            calls = stages[name]['calls']
+            percent = 100*seconds/total if total > 0 else 0
+            label = '  '*depth + name.split('/')[-1]
+            lines.append("{:<24}{:>12.3f}{:>8.1f}{:>10}{:>14.3f}".format(
+                         label, 1e3*seconds, percent, calls, 1e6*seconds/max(calls, 1)))
+            addLines(name, depth + 1)
+    addLines('', 0)
+    lines.append("{:<24}{:>12.3f}{:>8.1f}".format("total", 1e3*total, 100.0 if total > 0 else 0))
+    for name, value in sorted(report['counters'].items()):
+        lines.append("{:<24}{:>12}".format(name, value))
+    return '\n'.join(lines)
+
+def writeJSON(filename, report = None):
+    """Write getReport() (or 'report') to 'filename' as JSON"""
+    import json
+    if report == None:
+        report = getReport()
+    with open(filename, 'w') as fd:
+        json.dump(report, fd, indent = 1, sort_keys = True)
+
+def _testTiming(argv):
+    USAGE = "python3 {} [numCalls]".format(argv[0])
+    numCalls = 1000000
+    if len(argv) > 1:
+        numCalls = int(argv[1])
+    def run():
+        for n in range(numCalls):
+            if enabled:
+                start = now()
+            if enabled:
+                addTime('test', start)
+                count('calls')
+    for on in (False, True):
+        enable(on)
+        start = time.perf_counter()
+        run()
+        print("{:>8}: {:.3f} us/timed call".format("on" if on else "off",
+              1e6*(time.perf_counter() - start)/numCalls))
+    print(formatSummary())
+
+if __name__ == "__main__":
+    import sys
+    argv = sys.argv
+    _testTiming(argv)